@@ -0,0 +1,193 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Service requests with twisted's Agent, rather than HTTPClientFactory'''
+
+from downpour import BaseRequestServicer, ConnectTimeoutError, logger, reactor
+
+from cStringIO import StringIO
+from twisted.web import client, error, http
+from twisted.internet import protocol
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.web.http_headers import Headers
+from twisted.python.failure import Failure
+
+class Body(protocol.Protocol):
+    '''Collects the body of a response, and hands it to the servicer once
+    it's all arrived. If `discard`, then the body is not wanted at all, and
+    the transfer is stopped as soon as it begins.'''
+    def __init__(self, servicer, discard=False):
+        self.servicer = servicer
+        self.discard  = discard
+        self.buffer   = StringIO()
+
+    def connectionMade(self):
+        if self.discard:
+            self.transport.stopProducing()
+
+    def dataReceived(self, data):
+        self.servicer.gotData(len(data))
+        self.buffer.write(data)
+
+    def connectionLost(self, reason):
+        if not self.discard:
+            self.servicer.gotBody(self.buffer.getvalue(), reason)
+
+class AgentServicer(BaseRequestServicer):
+    '''Services requests with `twisted.web.client.Agent`, which replaces the
+    deprecated `HTTPClientFactory` and keeps connections alive between
+    requests to the same host. It is otherwise a drop-in replacement for
+    `BaseRequestServicer`: the url, status and header callbacks, redirects,
+    proxies, `Auth`, abort rules, cancellation and decompression all behave
+    the same way, since they're inherited. Only the transfer itself differs.
+    To use it, give it to the fetcher: `BaseFetcher(servicer=AgentServicer)`'''
+    # Connections are shared by all the requests that this class services
+    pool = None
+
+    def __init__(self, *args, **kwargs):
+        # What we're waiting on, if anything: the response, or its body
+        self.pending  = None
+        self.transfer = None
+        BaseRequestServicer.__init__(self, *args, **kwargs)
+        # The connections we use belong to the pool, and not to us, so the
+        # result doesn't have to wait for any one of them to be closed
+        self._disconnectedDeferred.callback(None)
+
+    @classmethod
+    def connections(cls):
+        '''The pool of persistent connections'''
+        if cls.pool is None:
+            cls.pool = client.HTTPConnectionPool(reactor, persistent=True)
+        return cls.pool
+
+    def connect(self, contextFactory=None):
+        '''Start the transfer'''
+        self.watch()
+        self.send()
+
+    def send(self):
+        '''Make the request for the current url, through the proxy if there
+        is one. Called again for each redirect that's followed.'''
+        timeout = self.request.connectTimeout or 30
+        if self.proxy:
+            endpoint = TCP4ClientEndpoint(reactor, self.host, self.port or 80, timeout)
+            agent = client.ProxyAgent(endpoint, reactor, self.connections())
+        else:
+            agent = client.Agent(reactor, connectTimeout=timeout, pool=self.connections())
+        headers = Headers({'User-Agent': [self.agent]})
+        cookies = []
+        for key, value in self.headers.items():
+            if key.lower() == 'cookie':
+                cookies.append(value)
+            elif key.lower() not in ('host', 'user-agent', 'content-length'):
+                headers.addRawHeader(key, value)
+        cookies.extend('%s=%s' % item for item in self.cookies.items())
+        if cookies:
+            headers.addRawHeader('Cookie', '; '.join(cookies))
+        body = None
+        if self.postdata is not None:
+            body = client.FileBodyProducer(StringIO(self.postdata))
+        # A pooled connection may already be open, so there's no telling when
+        # we connect. The wait for the first byte starts now, instead
+        self.connected()
+        self.pending = agent.request(self.method, self.url, headers, body)
+        self.pending.addCallback(self.gotResponse).addErrback(self.failed)
+
+    def gotResponse(self, response):
+        self.pending = None
+        if not self.waiting:
+            response.deliverBody(Body(self, discard=True))
+            return
+        self.response = response
+        self.gotData(0)
+        self.gotStatus('%s/%i.%i' % response.version, str(response.code), response.phrase)
+        headers = dict((key.lower(), values) for key, values in response.headers.getAllRawHeaders())
+        self.gotHeaders(headers)
+        # Any of the callbacks may have cancelled the request
+        if not self.waiting:
+            response.deliverBody(Body(self, discard=True))
+            return
+        location = headers.get('location')
+        if self.status in ('301', '302', '303', '308') and location:
+            response.deliverBody(Body(self, discard=True))
+            self.redirect(location[0])
+            return
+        self.transfer = Body(self)
+        response.deliverBody(self.transfer)
+
+    def redirect(self, url):
+        '''Follow a redirect, just as HTTPPageGetter does'''
+        if not self.followRedirect:
+            self.noPage(Failure(error.PageRedirect(self.status, self.message, location=url)))
+            return self.finish()
+        self._redirectCount += 1
+        if self._redirectCount >= self.redirectLimit:
+            self.noPage(Failure(error.InfiniteRedirection(self.status,
+                'Infinite redirection detected', location=url)))
+            return self.finish()
+        if self.status == '303' or (self.status == '302' and self.afterFoundGet):
+            self.method   = 'GET'
+            self.postdata = None
+        self.setURL(url)
+        # onURL may have cancelled the request
+        if self.waiting:
+            self.send()
+
+    def gotBody(self, body, reason):
+        self.transfer = None
+        self.finish()
+        if not reason.check(client.ResponseDone, http.PotentialDataLoss):
+            self.noPage(reason)
+        elif self.status not in ('200', '201', '202'):
+            self.noPage(Failure(error.Error(self.status, self.message, body)))
+        elif self.method == 'HEAD':
+            self.page('')
+        else:
+            self.page(body)
+
+    def failed(self, reason):
+        '''The request failed before we got a response'''
+        self.pending = None
+        self.finish()
+        if reason.check(ConnectTimeoutError):
+            reason = self.timedOut('connect')
+        self.noPage(reason)
+
+    def finish(self):
+        '''Stop the watchdog and abandon any transfer still in progress'''
+        self.disarm()
+        if self.transfer:
+            transfer, self.transfer = self.transfer, None
+            transfer.discard = True
+            transfer.transport.stopProducing()
+        if self.pending:
+            pending, self.pending = self.pending, None
+            pending.cancel()
+
+    def stream(self):
+        return self.transfer and self.transfer.transport
+
+    def cancel(self, err):
+        self.noPage(Failure(err))
+        self.finish()
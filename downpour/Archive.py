@@ -0,0 +1,331 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+# 
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Archive responses to rolling, compressed, WARC-like segment files'''
+
+from downpour import logger, reactor
+
+import os
+import gzip
+import time
+import uuid
+import zlib
+import Queue
+import threading
+from cStringIO import StringIO
+
+class Archive(object):
+    '''Writes a record for every response (and every failure) it's given,
+    with its status, headers, final url, timing and body. Records are in a
+    WARC-like format, each compressed as its own gzip member, and written to
+    segment files in `path`, which are rotated once they reach `maxSize`
+    bytes or `maxAge` seconds. The formatting, compression and writing all
+    happen in a thread of its own, in batches of up to `batchSize` records.
+    Segments are fsync'd at most every `fsyncInterval` seconds (or never,
+    if it's None). Once `highWater` records (by default, three quarters of
+    `maxQueue`) are waiting to be written, the archive is `busy`, and the
+    fetcher starts no new requests until the writer catches up. Should the
+    queue fill up all the same, records are dropped (and counted) rather
+    than holding up the reactor.'''
+    def __init__(self, path, prefix='downpour', maxSize=1024 ** 3, maxAge=3600,
+        batchSize=100, fsyncInterval=5.0, maxQueue=10000, highWater=None):
+        self.path          = path
+        self.prefix        = prefix
+        self.maxSize       = maxSize
+        self.maxAge        = maxAge
+        self.batchSize     = batchSize
+        self.fsyncInterval = fsyncInterval
+        # The segment we're writing to, when it was opened, and the number
+        # of the next segment
+        self.segment       = None
+        self.opened        = 0
+        self.size          = 0
+        self.count         = 0
+        self.synced        = time.time()
+        # Some stats about what's been written
+        self.records       = 0
+        self.written       = 0
+        self.segments      = []
+        self.dropped       = 0
+        self.highWater     = highWater or (maxQueue * 3 / 4)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.queue  = Queue.Queue(maxQueue)
+        self.thread = threading.Thread(target=self.run, name='downpour-archive')
+        self.thread.daemon = True
+        self.thread.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.close)
+
+    @staticmethod
+    def read(path):
+        '''Read the records back out of a segment, or every segment in a
+        directory, in the order they were written. Each is a dictionary of
+        its fields, along with the `status` line, `headers` (a dictionary of
+        lists), and `body` of the response, if there was one. A record that
+        was cut short (by a crash mid-write, say) ends its segment.'''
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.warc.gz'):
+                    for record in Archive.read(os.path.join(path, name)):
+                        yield record
+            return
+        f = gzip.open(path)
+        try:
+            while True:
+                record = Archive.parse(f)
+                if record is None:
+                    return
+                yield record
+        except (EOFError, IOError):
+            # Including gzip's own complaints about a member that ends early
+            logger.warn('Truncated record at the end of %s' % path)
+        finally:
+            f.close()
+
+    @staticmethod
+    def index(path):
+        '''Like `read`, but each record comes with where it is: its segment,
+        and the offset of its gzip member there. It can be read again from
+        there with `readAt`, so that nothing has to be kept in the meantime.'''
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.warc.gz'):
+                    for entry in Archive.index(os.path.join(path, name)):
+                        yield entry
+            return
+        with open(path, 'rb') as f:
+            try:
+                for offset, data in Archive.members(f):
+                    record = Archive.parse(StringIO(data))
+                    if record is not None:
+                        yield path, offset, record
+            except (EOFError, zlib.error):
+                logger.warn('Truncated record at the end of %s' % path)
+
+    @staticmethod
+    def readAt(path, offset):
+        '''The record whose gzip member starts at this offset in a segment'''
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for offset, data in Archive.members(f):
+                return Archive.parse(StringIO(data))
+
+    @staticmethod
+    def members(f, chunk=65536):
+        '''The offset and the decompressed content of each gzip member in a
+        file, from wherever it's at. Only one member is held at a time.'''
+        offset  = f.tell()
+        pending = ''
+        while True:
+            data = pending or f.read(chunk)
+            if not data:
+                return
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            size, parts = 0, []
+            while True:
+                parts.append(d.decompress(data))
+                size += len(data)
+                # Whatever's left over belongs to the next member
+                if d.unused_data:
+                    break
+                data = f.read(chunk)
+                if not data:
+                    break
+            pending = d.unused_data
+            size -= len(pending)
+            yield offset, ''.join(parts)
+            offset += size
+
+    @staticmethod
+    def parse(f):
+        '''The next record in a segment, or None if there are no more. A record
+        that ends early raises EOFError.'''
+        line = f.readline()
+        while line.strip() != 'WARC/1.0':
+            if not line:
+                return None
+            line = f.readline()
+        record = {}
+        line = f.readline()
+        while line != '\r\n':
+            if not line:
+                raise EOFError('Record ended in its headers')
+            key, sep, value = line.partition(':')
+            record[key.strip()] = value.strip()
+            line = f.readline()
+        length  = int(record.get('Content-Length', 0))
+        content = f.read(length)
+        if len(content) < length:
+            raise EOFError('Record ended in its content')
+        record['status']  = None
+        record['headers'] = {}
+        record['body']    = ''
+        if content:
+            head, sep, record['body'] = content.partition('\r\n\r\n')
+            lines = head.split('\r\n')
+            record['status'] = tuple(lines[0].split(' ', 2))
+            for line in lines[1:]:
+                key, sep, value = line.partition(':')
+                record['headers'].setdefault(key.strip().lower(), []).append(value.strip())
+        return record
+
+    def record(self, factory, result):
+        '''Record the outcome of the request serviced by this factory. This
+        is invoked on the reactor thread, and so it just gathers what's needed
+        for the writer thread, and never waits on it.'''
+        try:
+            self.queue.put_nowait(self.gather(factory, result))
+        except Queue.Full:
+            self.dropped += 1
+            logger.error('Archive is full; dropped the record for %s' % factory.request.url)
+
+    def busy(self):
+        '''Whether the writer has fallen far enough behind that no more
+        requests should be started'''
+        return self.queue.qsize() >= self.highWater
+
+    def gather(self, factory, result):
+        '''Everything the writer thread will need to record this outcome'''
+        request = factory.request
+        failure = None
+        body    = result
+        if not isinstance(result, basestring):
+            failure = result.getErrorMessage()
+            body    = getattr(result.value, 'response', None) or ''
+        # The request's own `time` starts over with each redirect, but the
+        # servicer knows when the first hop began
+        now     = time.time()
+        begun   = getattr(factory, 'begun', None)
+        elapsed = (now - begun) if begun else (now + request.time)
+        return (
+            now,
+            request.url,
+            factory.url,
+            getattr(factory, 'version', None),
+            getattr(factory, 'status', None),
+            getattr(factory, 'message', None),
+            getattr(factory, 'response_headers', None) or {},
+            elapsed,
+            body,
+            failure)
+
+    def close(self):
+        '''Write everything that's been recorded, and close the segment'''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=1.0))
+                while len(batch) < self.batchSize:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            done = None in batch
+            try:
+                self.write([b for b in batch if b is not None])
+            except Exception:
+                logger.exception('Failed to write to archive')
+            if done:
+                self.rotate(closing=True)
+                return
+
+    def write(self, batch):
+        now = time.time()
+        # Segments are closed once they're too old or too big, and the next
+        # one isn't opened until there's something to write to it
+        if self.segment and (now - self.opened) >= self.maxAge:
+            self.rotate(closing=True)
+        if batch:
+            if not self.segment:
+                self.rotate()
+            data = ''.join(self.compress(self.format(*b)) for b in batch)
+            self.segment.write(data)
+            self.records += len(batch)
+            self.written += len(data)
+            self.size    += len(data)
+            if self.size >= self.maxSize:
+                self.rotate(closing=True)
+        if self.segment and self.fsyncInterval is not None and (now - self.synced) >= self.fsyncInterval:
+            self.sync()
+
+    def sync(self):
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.synced = time.time()
+
+    def rotate(self, closing=False):
+        '''Close the current segment, and unless closing, open the next one'''
+        if self.segment:
+            if self.fsyncInterval is not None:
+                self.sync()
+            self.segment.close()
+            self.segment = None
+        if not closing:
+            name = '%s-%s-%05i.warc.gz' % (self.prefix,
+                time.strftime('%Y%m%d%H%M%S', time.gmtime()), self.count)
+            self.count  += 1
+            self.opened  = time.time()
+            self.size    = 0
+            self.segment = open(os.path.join(self.path, name), 'ab')
+            self.segments.append(name)
+            logger.info('Archiving to %s' % name)
+
+    def compress(self, record):
+        # Each record is its own gzip member, so that records can be read
+        # individually, and the segment as a whole is a valid gzip file
+        c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(record) + c.flush()
+
+    def format(self, when, original, url, version, status, message, headers, elapsed, body, failure):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        if isinstance(original, unicode):
+            original = original.encode('utf-8')
+        # Failures that never got as far as a status have no content
+        content = ''
+        if status:
+            lines = ['%s %s %s' % (version, status, message)]
+            for key, values in headers.iteritems():
+                lines.extend('%s: %s' % (key, v) for v in values)
+            content = '\r\n'.join(lines) + '\r\n\r\n' + body
+        fields = [
+            'WARC/1.0',
+            'WARC-Type: %s' % (failure and 'x-failure' or 'response'),
+            'WARC-Record-ID: <urn:uuid:%s>' % uuid.uuid4(),
+            'WARC-Date: %s' % time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(when)),
+            'WARC-Target-URI: %s' % url,
+            'X-Downpour-Original-URI: %s' % original,
+            'X-Downpour-Elapsed: %f' % elapsed]
+        if failure:
+            fields.append('X-Downpour-Failure: %s' % ' '.join(failure.split()))
+        fields.extend([
+            'Content-Type: application/http; msgtype=response',
+            'Content-Length: %i' % len(content)])
+        return '\r\n'.join(fields) + '\r\n\r\n' + content + '\r\n\r\n'
@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+'''Use a fetcher from an asyncio service'''
+
+import threading
+import itertools
+from downpour import logger, reactor
+
+class AsyncioBridge(object):
+    '''Lets a service running on an asyncio event loop (or anything with the
+    same `create_future` and `call_soon_threadsafe`) use a fetcher. Twisted
+    can't share the loop, so the reactor runs on a thread of its own. Each
+    `fetch` hands its request to the reactor, and returns one of the loop's
+    futures. Once the request is done, and all of its callbacks have run,
+    the future is resolved on the loop: with the request itself, or with the
+    exception that it failed with. Every other request the fetcher has keeps
+    on working just as it did.
+
+    A fetcher that keeps its requests in redis (the PoliteFetcher) hands
+    back a copy of each one, not the request that was pushed, so they're
+    told apart by an id that's stored on the request, `_bridgeId`, and the
+    future is resolved with that copy.'''
+    def __init__(self, fetcher, loop):
+        self.fetcher = fetcher
+        self.loop    = loop
+        self.thread  = None
+        # The futures of the requests we've been given, and how the failed
+        # ones failed, by each request's `_bridgeId`. These are only touched
+        # on the reactor thread.
+        self.futures  = {}
+        self.failures = {}
+        self.ids      = itertools.count()
+        # We hear about each request by way of the fetcher's own hooks
+        self.outcome, fetcher.outcome = fetcher.outcome, self._outcome
+        self.onDone,  fetcher.onDone  = fetcher.onDone, self._onDone
+
+    def start(self):
+        '''Start the fetcher, and the reactor, on a thread of their own'''
+        self.thread = threading.Thread(target=self.fetcher.start,
+            kwargs={'installSignalHandlers': False}, name='downpour-reactor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        '''Stop the fetcher, and wait for the reactor to finish'''
+        reactor.callFromThread(self.fetcher.stop)
+        if self.thread:
+            self.thread.join(timeout)
+
+    def fetch(self, request):
+        '''Fetch a request. Call this on the loop, and await what it returns.'''
+        future = self.loop.create_future()
+        reactor.callFromThread(self._submit, request, future)
+        return future
+
+    def _submit(self, request, future):
+        request._bridgeId = next(self.ids)
+        self.futures[request._bridgeId] = future
+        self.fetcher.push(request)
+
+    @staticmethod
+    def _id(request):
+        # Requests that didn't come through us don't have one
+        return getattr(request, '_bridgeId', None)
+
+    def _outcome(self, request, result):
+        key = self._id(request)
+        if key in self.futures and not isinstance(result, basestring):
+            self.failures[key] = result
+        return self.outcome(request, result)
+
+    def _onDone(self, request):
+        try:
+            return self.onDone(request)
+        finally:
+            key = self._id(request)
+            future = self.futures.pop(key, None)
+            if future is not None:
+                failure = self.failures.pop(key, None)
+                self.loop.call_soon_threadsafe(self._resolve, future, request, failure)
+
+    @staticmethod
+    def _resolve(future, request, failure):
+        # Whoever was waiting may have given up on it
+        if future.cancelled():
+            return
+        if failure is not None:
+            future.set_exception(failure.value)
+        else:
+            future.set_result(request)
@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+'''Measure how late the reactor runs, and find out what's holding it up'''
+
+from downpour import logger, reactor
+
+import os
+import sys
+import time
+import bisect
+import signal
+import threading
+import collections
+from twisted.internet import task
+
+class LagMonitor(object):
+    '''Keeps an eye on the reactor. A timer that's meant to fire every
+    `interval` seconds measures how late it actually fires, which is how
+    long anything else waiting on the reactor was kept waiting, too. Those
+    lags are kept in a histogram, and the most recent of them are kept for
+    percentiles.
+
+    Meanwhile, a thread samples the reactor thread's stack every
+    `resolution` seconds while the reactor's late by more than `slow`. Each
+    sample is put down to the innermost callback on the stack (`onSuccess`,
+    `onHeaders`, a fetcher's `onDone` and so on), and the time it stands
+    for is tallied in `culprits`. The same thread makes a sampling profile
+    of the reactor thread on demand, with `profile`, or when it's sent a
+    signal, with `profileOnSignal`.
+
+    To use it, give it to a fetcher before it starts:
+
+        fetcher.monitor = LagMonitor()'''
+    # How often to measure, in seconds, and how late counts as slow
+    interval   = 0.05
+    slow       = 0.1
+    # How often to sample the reactor thread's stack
+    resolution = 0.005
+    # How many of the most recent lags to keep for percentiles
+    window     = 10000
+    # The upper bounds of the buckets in the histogram, in seconds
+    buckets    = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+    # The names of the callbacks that slowness is put down to. Anything else
+    # is put down to whatever function the reactor thread was in
+    callbacks  = set([
+        # A request's callbacks
+        'onSuccess', 'onError', 'onDone', 'onHeaders', 'onStatus', 'onURL',
+        # A fetcher's
+        'onBatch', 'onEmptyQueue', 'outcome', 'pop', 'push', 'extend', 'grow',
+        # And the processing in between
+        '_success', '_error', '_done', 'screen', 'record'
+    ])
+
+    def __init__(self, interval=None, slow=None):
+        self.interval = interval or self.interval
+        self.slow     = slow or self.slow
+        self.lags     = collections.deque(maxlen=self.window)
+        self.counts   = [0] * (len(self.buckets) + 1)
+        self.ticks    = 0
+        self.worst    = 0.0
+        # How many slow ticks there have been, and how much time has been
+        # put down to each culprit, and where exactly within it
+        self.stalls   = 0
+        self.culprits = collections.defaultdict(float)
+        self.sites    = collections.defaultdict(lambda: collections.defaultdict(float))
+        self.timer    = None
+        self.thread   = None
+        self.ident    = None
+        self.running  = False
+        # When the reactor was last seen, and when it's next expected
+        self.beat     = None
+        self.expected = None
+        # The profile under way, if any: when it ends, where it's written,
+        # the number of samples of each stack, and whether the sampler has
+        # yet to say that it's started
+        self.until    = None
+        self.path     = None
+        self.samples  = None
+        self.started  = False
+
+    def start(self):
+        '''Start monitoring. This has to be called on the reactor thread,
+        which is what `BaseFetcher.start` does.'''
+        if self.running:
+            return
+        self.running  = True
+        self.ident    = threading.current_thread().ident
+        self.beat     = time.time()
+        self.expected = self.beat + self.interval
+        self.timer    = task.LoopingCall(self.tick)
+        self.timer.start(self.interval, now=False)
+        self.thread   = threading.Thread(target=self.sample, name='downpour-lag')
+        self.thread.daemon = True
+        self.thread.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def stop(self):
+        self.running = False
+        if self.timer and self.timer.running:
+            self.timer.stop()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(1)
+
+    def tick(self):
+        now = time.time()
+        lag = max(now - self.expected, 0)
+        self.beat     = now
+        self.expected = now + self.interval
+        self.ticks   += 1
+        self.worst    = max(self.worst, lag)
+        self.lags.append(lag)
+        self.counts[bisect.bisect_left(self.buckets, lag)] += 1
+
+    def percentile(self, p):
+        '''The lag that `p` percent of recent ticks were no later than'''
+        if not self.lags:
+            return 0.0
+        lags = sorted(self.lags)
+        return lags[min(int(len(lags) * p / 100.0), len(lags) - 1)]
+
+    def histogram(self):
+        '''The number of ticks that have been up to each bucket's bound late.
+        The last bucket is for everything later than that.'''
+        bounds = self.buckets + [float('inf')]
+        return zip(bounds, self.counts)
+
+    def stats(self):
+        return {
+            'ticks'   : self.ticks,
+            'p50'     : self.percentile(50),
+            'p90'     : self.percentile(90),
+            'p99'     : self.percentile(99),
+            'worst'   : self.worst,
+            'stalls'  : self.stalls,
+            'culprits': dict(self.culprits),
+            # Where within each culprit the time went
+            'sites'   : dict((c, dict(s)) for c, s in self.sites.items())
+        }
+
+    #################
+    # Sampling the reactor thread
+    #################
+    def sample(self):
+        stalled = False
+        while self.running:
+            time.sleep(self.resolution)
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+            if self.until is not None:
+                if self.started:
+                    self.started = False
+                    logger.warn('Profiling for %is to %s' % (self.until - time.time(), self.path))
+                self.sampled(frame)
+            # The reactor's due a tick by `expected`, and so if it's more
+            # than `slow` past that, then it's stuck in something
+            if time.time() - self.expected > self.slow:
+                if not stalled:
+                    self.stalls += 1
+                    stalled = True
+                culprit, site = self.attribute(frame)
+                self.culprits[culprit] += self.resolution
+                self.sites[culprit][site] += self.resolution
+            else:
+                stalled = False
+            del frame
+
+    @staticmethod
+    def describe(frame):
+        '''A short name for the function a frame is in. Only the code is
+        looked at, since the frame's locals are another thread's to touch.'''
+        code = frame.f_code
+        return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+    def attribute(self, frame):
+        '''The innermost callback on the stack, and where within it we are'''
+        site = self.describe(frame)
+        while frame is not None:
+            if frame.f_code.co_name in self.callbacks:
+                return self.describe(frame), site
+            frame = frame.f_back
+        return site, site
+
+    #################
+    # Profiling
+    #################
+    def profile(self, seconds=30, path=None):
+        '''Sample the reactor thread's stack for the next `seconds`, and then
+        write each distinct stack (outermost first, separated by semicolons)
+        and how many times it was seen to `path`. This is the "folded" format
+        that flame graph tools read. Returns the path.'''
+        if self.until is not None:
+            logger.warn('Already profiling to %s' % self.path)
+            return self.path
+        if not self.running:
+            logger.warn('The monitor has not been started, so nothing will be sampled')
+        return self.begin(seconds, path)
+
+    def begin(self, seconds, path=None):
+        '''Set up a profile for the sampler thread to take, unless one is
+        already under way. This neither logs nor takes any locks, so it's
+        safe to call from a signal handler. The sampler says when the
+        profile has started.'''
+        if self.until is None:
+            self.path    = path or 'downpour-%i-%i.folded' % (os.getpid(), time.time())
+            self.samples = collections.defaultdict(int)
+            self.started = True
+            # This goes last, since it's what the sampler looks for
+            self.until   = time.time() + seconds
+        return self.path
+
+    def profileOnSignal(self, signum=signal.SIGUSR2, seconds=30):
+        '''Start profiling (for `seconds`) whenever this process is sent a
+        signal, so that a fetcher can be profiled without a restart. The
+        handler only sets the profile up, and the sampler does the rest.'''
+        signal.signal(signum, lambda *args: self.begin(seconds))
+
+    def sampled(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self.describe(frame))
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+        if time.time() >= self.until:
+            self.write()
+
+    def write(self):
+        samples, self.samples = self.samples, None
+        path, self.until = self.path, None
+        try:
+            with open(path, 'w') as f:
+                for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                    f.write('%s %i\n' % (stack, count))
+            logger.warn('Wrote profile of %i samples to %s' % (sum(samples.values()), path))
+        except Exception:
+            logger.exception('Failed to write profile to %s' % path)
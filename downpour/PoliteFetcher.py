@@ -23,38 +23,86 @@
 
 '''Politely (per pay-level-domain) fetch urls'''
 
-from downpour import BaseFetcher, RobotsRequest, logger, reactor
+from downpour import BaseFetcher, RobotsRequest, UserPreemptionError, Pickled, logger, reactor
+from downpour.PublicSuffix import PublicSuffix
+from downpour.Robots import Matchers
+from downpour.RedisThread import RedisThread
+from downpour.Shards import Shard, Shards, ShardedQueue
 
+import os
 import qr
 import time
 import reppy
-import redis
+import socket
 import urlparse
+import functools
 import threading
+import collections
+from twisted.web import error
+from twisted.internet import task
+from twisted.internet.abstract import isIPAddress
+from twisted.internet.error import DNSLookupError
+from twisted.python.failure import Failure
+
+def blocking(method):
+    '''Marks a method that makes blocking calls to redis. Whenever it's called
+    from anywhere but the redis thread (which is to say, the reactor), the
+    time it takes is time that no other I/O could happen, and it's added to
+    the fetcher's `stalls`. This only measures the stall; it's up to the
+    caller whether the method runs on the redis thread.'''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.timing or (self.io and self.io.current()):
+            return method(self, *args, **kwargs)
+        # Only the outermost call is timed, so nothing's counted twice
+        self.timing = True
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.timing = False
+            stall = self.stalls[method.__name__]
+            elapsed = time.time() - start
+            stall['calls']   += 1
+            stall['seconds'] += elapsed
+            stall['worst']    = max(stall['worst'], elapsed)
+    return wrapper
 
 class Counter(object):
+    # Each request's flight and lease are known by its url as it was popped,
+    # in `_leaseId`, since its url may well change (on a redirect, say)
+    # before it's done.
     @staticmethod
-    def put(r, request):
+    def put(r, request, worker=None):
         key = 'flight:' + request._originalKey
-        # Just put some dummy value in there. We're mostly interested
-        # in the sorted-ness and the zremrangebyrank
-        o = r.zadd(key, **{request.url: time.time() + (request.timeout * 2)})
-        if r.ttl(key) < (request.timeout * 2):
-            o = r.expire(key, request.timeout * 2)
-            # logger.debug('Exprire %s %fs: %s' % (key, request.timeout * 2, repr(o)))
-        
-        o = r.zcard(key)
-        # logger.debug('Put %s (%s) to expire at %fs; zcard = %d' % (request.url, request._originalKey, (time.time() + request.timeout * 2), o))
-        return o
+        lease = request._leaseId = request.url
+        expires = request.timeout * 2
+        with r.pipeline(transaction=False) as p:
+            # If we know which worker this is, then record a lease on this
+            # request, so that it can be requeued should this worker die
+            if worker:
+                p.hset('lease:' + worker, lease, Pickled.dumps(request))
+            # Just put some dummy value in there. We're mostly interested
+            # in the sorted-ness and the zremrangebyrank
+            p.zadd(key, **{lease: time.time() + expires})
+            p.ttl(key)
+            p.zcard(key)
+            ttl, card = p.execute()[-2:]
+        if ttl < expires:
+            r.expire(key, expires)
+        return card
     
     @staticmethod
-    def remove(r, request):
+    def remove(r, request, worker=None):
         key = 'flight:' + request._originalKey
+        lease = getattr(request, '_leaseId', None) or request.url
         with r.pipeline() as p:
-            o = p.zrem(key, request.url)
+            if worker:
+                p.hdel('lease:' + worker, lease)
+            o = p.zrem(key, lease)
             o = p.zremrangebyscore(key, 0, time.time())
             o = p.zcard(key)
-            o, removed, card = p.execute()
+            card = p.execute()[-1]
         
         # logger.debug('Remove %s (%s); Removed: %d; zcard = %d' % (request.url, request._originalKey, removed, card))
         return card
@@ -71,41 +119,141 @@ class Counter(object):
         # logger.debug('Len %s; Removed: %d; zcard = %d' % (key, removed, card))
         return card
 
+class Job(object):
+    '''A named stream of requests. Jobs share a PoliteFetcher in proportion to
+    their weights, and each may be capped on how many requests it can have in
+    flight at once in each worker. The unnamed job is the default, and its
+    queues are the ones that PoliteFetcher has always used.'''
+    def __init__(self, name, weight, maxFlight, shards):
+        self.name      = name
+        self.weight    = float(weight)
+        self.maxFlight = maxFlight
+        # Each job keeps its own queue for each domain, and its own schedule
+        # of those domains. Politeness is still enforced across jobs. Each
+        # domain is scheduled on the same shard as its queue.
+        self.prefix    = 'job:%s:' % name if name else ''
+        self.plds      = ShardedQueue(self.prefix + 'plds', shards)
+        # The credit this job has in the current round
+        self.deficit   = 0.0
+        self.inFlight  = 0
+        self.served    = 0
+        self.done      = 0
+        self.started   = time.time()
+    
+    def queueKey(self, key):
+        '''The name of this job's queue for a domain'''
+        return self.prefix + key
+    
+    def full(self):
+        return self.maxFlight is not None and self.inFlight >= self.maxFlight
+
 class PoliteFetcher(BaseFetcher):
     # This is the maximum number of parallel requests we can make 
     # to the same key
     maxParallelRequests = 5
     
+    # How many requests to write to (or read from) redis in each pipeline
+    # when enqueueing requests in bulk
+    batchSize = 1000
+    
+    # Each domain has a circuit breaker. Once its requests have failed this
+    # many times in a row, its circuit opens, and its requests wait for
+    # `breakerCooldown` seconds. Then a single request probes it. If that
+    # succeeds, the circuit closes and the rest are released, and if not,
+    # it's left open for twice as long, up to `breakerMaxCooldown`.
+    # Which request is the probe is kept in the breaker itself (as `probe`,
+    # by lease), so that whichever worker finishes it decides the circuit.
+    breakerThreshold   = 5
+    breakerCooldown    = 300
+    breakerMaxCooldown = 3600
+    
+    # What politeness is enforced on. With 'hostname', every subdomain is a
+    # site of its own. With 'domain', it's the registered domain (as found
+    # with the public suffix list), so that all of example.co.uk's hosts are
+    # polite to one another. With 'ip', it's the address the hostname
+    # resolves to, which catches many sites on shared hosting. This should
+    # be the same for every worker sharing a redis.
+    keyBy = 'hostname'
+    # How many hostnames to remember the key of
+    keyCacheSize = 100000
+    # Hostnames are resolved without blocking the reactor, and their
+    # requests are set aside until they are. One that doesn't resolve is
+    # keyed on its hostname for this many seconds, and then tried again.
+    unresolvedTime = 300
+    
+    # Requests that robots.txt disallows are dropped as they're enqueued,
+    # if we already have it, or from their domain's queue once we fetch it.
+    # This many sites' rules are kept compiled for checking against.
+    robotsCacheSize = 10000
+    
+    # Scheduling (`pop`), and the bookkeeping in redis when each request is
+    # done, happen on a thread of their own. That way, the reactor keeps on
+    # moving data while redis is slow to answer. Set this to False to make
+    # every call to redis on the reactor thread.
+    #
+    # Adding requests still blocks whichever thread does it, since those
+    # calls return how many were added: `push`, `extend`, `enqueue` and
+    # `trim`, and `grow` and `arrived`, which write what they take from the
+    # incoming queue through `bulk`. So do `len`, `idle`, `stats` and
+    # `rebalance`. Their time on the reactor is all counted in `stalls`.
+    #
+    # The scheduler's own state (each job's credit, counts and the ring of
+    # jobs) is shared between the two threads, and is only ever changed
+    # while holding `lock`, which is never held across a call to redis.
+    # Everything else on the fetcher belongs to the reactor, and the redis
+    # thread hands its changes to it with `onReactor`.
+    offload = True
+    
+    # Requests `enqueue`d to the incoming queue are noticed the moment they
+    # arrive, by a thread that waits on it with a blocking pop, on a redis
+    # connection of its own. The timed `grow` is then only a fallback. The
+    # thread wakes every `notifyTimeout` seconds to see if it should stop.
+    # Each request it takes is moved to this worker's own `incoming:<worker>`
+    # list as it's popped, and only leaves that once it's been queued, so
+    # that should we stop (or die) in between, it's reclaimed like a lease.
+    notify        = True
+    notifyTimeout = 1
+    
     def __init__(self, poolSize=10, agent=None, stopWhenDone=False, 
-        delay=2, allowAll=False, **kwargs):
+        delay=2, allowAll=False, worker=None, leaseTime=30, shards=None, **kwargs):
         
         # Call the parent constructor
         BaseFetcher.__init__(self, poolSize, agent, stopWhenDone)
-        # Include a priority queue of plds
-        self.pldQueue = qr.PriorityQueue('plds', **kwargs)
-        # Make sure that there is an entry in the plds for
-        # each domain waiting to be fetched. Also, include
-        # the number of urls from each domain in the count
-        # of remaining urls to be fetched.
-        self.r = redis.Redis(**kwargs)
-        # Redis has a pipeline feature that allows for bulk
-        # requests, the result of which is a list of the 
-        # result of each individual request. Thus, only get
-        # the length of each of the queues in the pipeline
-        # as we're just going to set remaining to the sum
-        # of the lengths of each of the domain queues.
-        with self.r.pipeline() as p:
-            for key in self.r.keys('domain:*'):
-                self.pldQueue.push(key, 0)
-                p.llen(key)
-            self.remaining = sum(p.execute())
+        self.kwargs   = kwargs
+        # The frontier can be spread over several redis instances, each
+        # described by a dictionary of the arguments for `redis.Redis` (and
+        # optionally a `name`). Each domain's queues, flights, schedule and
+        # circuit breaker are all kept on the shard it hashes to, and so are
+        # the leases on its requests (in each shard's `lease:<worker>`). The
+        # first shard also holds what's shared by everything: the incoming
+        # queue, and the `workers` whose leases are still alive. Without
+        # shards, there's just the one.
+        self.shards = Shards(shards or [kwargs])
+        # The thread that redis calls are made on, whether a round of
+        # scheduling is under way there, and whether we've been asked for
+        # another since it started. Whatever time the reactor does spend
+        # blocked on redis is tallied in `stalls`, by method.
+        self.io         = RedisThread() if self.offload else None
+        self.lock       = threading.Lock()
+        self.scheduling = False
+        self.again      = False
+        self.timing     = False
+        self.stalls     = collections.defaultdict(
+            lambda: {'calls': 0, 'seconds': 0.0, 'worst': 0.0})
+        self.r = self.shards[0].r
+        # Jobs, by name, and the order in which they take turns. Each job
+        # has a priority queue of plds, and the default job's is `pldQueue`
+        self.jobs     = {}
+        self.ring     = []
+        self.turn     = 0
+        self.pldQueue = self.addJob(None).plds
         # For whatever reason, pushing key names back into the 
         # priority queue has been problematic. As such, we'll
         # set them aside as they fail, and then retry them at
         # some point. Like when the next request finishes.
         self.retries = []
         # Now make a queue for incoming requests
-        self.requests = qr.Queue('request', **kwargs)
+        self.requests = Pickled.queue(qr.Queue, 'request', **self.shards[0].kwargs)
         self.delay = float(delay)
         # This is used when we have to impose a delay before
         # servicing the next available request.
@@ -114,42 +262,315 @@ class PoliteFetcher(BaseFetcher):
         # For example, if you're checking for allow in other places
         self.allowAll = allowAll
         self.userAgentString = reppy.getUserAgentString(self.agent)
-        self.lock  = threading.RLock()
-        self.tlock = threading.RLock()
+        # Compiled robots.txt rules, and how many requests they've dropped,
+        # on the way in ('enqueue') and from the queues ('recheck')
+        self.matchers = Matchers(self.userAgentString, self.robotsCacheSize)
+        self.dropped  = collections.defaultdict(int)
+        # The politeness key of each hostname we've seen, least recently
+        # used first, and (with keyBy 'ip') when each hostname that didn't
+        # resolve is due to be tried again, and the requests waiting on each
+        # hostname that's being resolved
+        self.keys       = collections.OrderedDict()
+        self.unresolved = collections.OrderedDict()
+        self.resolving  = {}
+        if self.keyBy == 'domain':
+            self.suffixes = PublicSuffix.load()
         
-        # This needs to actually be kept in Redis, since we anticipate
-        # running more than one process at any one time.
-        #   This used to be self.flights
-        # When we first start fetching, we
-        # Something we have to take into account is resetting this when
-        # we exit. If this gets out of whack, then we could get crawls
-        # stalled.
-        # To 
+        # The in-flight counts need to be kept in Redis, since we anticipate
+        # running more than one process at any one time. If a process dies,
+        # though, its flights would block their domains until they expire,
+        # and the requests themselves would be lost. So, each worker holds
+        # a lease on the requests it has in flight (in `lease:<worker>`),
+        # and keeps its lease alive in the `workers` sorted set. When a
+        # worker's lease runs out, any other worker reclaims its requests.
+        self.worker    = worker or '%s:%i' % (socket.gethostname(), os.getpid())
+        self.leaseTime = leaseTime
+        self.taken     = 'incoming:' + self.worker
+        # If we're picking up from where a previous incarnation of this
+        # worker left off, then its requests are ours to reclaim right away
+        self.reclaim(self.worker)
+        self.heartbeat = task.LoopingCall(self.offloaded, self.renew)
+        self.heartbeat.start(self.leaseTime / 3.0, now=True)
+        self.listening = False
+        self.listener  = None
+        if self.notify:
+            self.listen()
     
+    @blocking
     def __len__(self):
         ''''''
-        return len(self.pldQueue) + len(self.requests)
+        # While a round of scheduling is under way, whatever it's popped is
+        # still to be fetched, even though it's no longer in redis. So are
+        # any requests that are waiting on a proxy.
+        count = (int(self.scheduling) + len(self.held) +
+            sum(len(waiting) for waiting in self.resolving.itervalues()))
+        # Every job's schedule is counted in a single round trip to each
+        # shard, and the incoming queue along with the first shard's
+        for shard in self.shards:
+            with shard.r.pipeline(transaction=False) as p:
+                for job in self.ring:
+                    p.zcard(job.plds.key)
+                if shard is self.shards[0]:
+                    p.llen(self.requests.key)
+                count += sum(p.execute())
+        return count
     
+    @blocking
     def idle(self):
         '''Returns whether or not this fetcher can handle more work'''
-        # Look at when the next item can be fetched
-        next, when = self.pldQueue.peek(withscores=True)
-        # If there is no next item available, then we're idle
-        if not next:
-            return True
-        # Alternatively, we'd only idle if the next request can not
-        # yet be serviced.
-        return when > time.time()
+        now = time.time()
+        for shard in self.shards:
+            # Look at when the next item can be fetched. We'd only idle
+            # if no job has a request that can be serviced yet. Every job's
+            # head on a shard is found in the one round trip.
+            with shard.r.pipeline(transaction=False) as p:
+                for job in self.ring:
+                    p.zrange(job.plds.key, 0, 0, withscores=True)
+                for head in p.execute():
+                    if head and head[0][1] <= now:
+                        return False
+        return True
+    
+    #################
+    # Jobs
+    #################
+    def addJob(self, name, weight=1, maxFlight=None):
+        '''Add a job, or change the weight and cap of an existing one. Any
+        requests already queued in redis for a new job are picked up.'''
+        with self.lock:
+            job = self.jobs.get(name)
+            if job:
+                job.weight, job.maxFlight = float(weight), maxFlight
+                return job
+            job = self.jobs[name] = Job(name, weight, maxFlight, self.shards)
+            self.ring.append(job)
+        # Make sure that there is an entry in the plds for
+        # each domain waiting to be fetched. Also, include
+        # the number of urls from each domain in the count
+        # of remaining urls to be fetched.
+        # Redis has a pipeline feature that allows for bulk
+        # requests, the result of which is a list of the 
+        # result of each individual request. Thus, only get
+        # the length of each of the queues in the pipeline
+        # as we're just going to add to remaining the sum
+        # of the lengths of each of the domain queues.
+        count = 0
+        for shard in self.shards:
+            with shard.r.pipeline() as p:
+                for key in shard.r.scan_iter(job.prefix + 'domain:*', self.batchSize):
+                    job.plds.pushTo(shard, key[len(job.prefix):], 0)
+                    p.zcard(key)
+                count += sum(p.execute())
+        # A job may first be heard of on the redis thread
+        self.onReactor(self.requeued, count)
+        return job
+    
+    def job(self, name):
+        '''The job with this name, which is added if it's new to us'''
+        return self.jobs.get(name) or self.addJob(name)
+    
+    @blocking
+    def stats(self):
+        '''The weight, cap, requests in flight, served and done, throughput
+        (requests done per second) and queue depth of each job'''
+        now = time.time()
+        depths = collections.defaultdict(int)
+        for shard in self.shards:
+            for name, depth in shard.r.hgetall('depths').iteritems():
+                depths[name] += int(depth)
+        return dict((job.name, {
+            'weight'   : job.weight,
+            'maxFlight': job.maxFlight,
+            'inFlight' : job.inFlight,
+            'served'   : job.served,
+            'done'     : job.done,
+            'rate'     : job.done / max(now - job.started, 1e-6),
+            'depth'    : depths[job.name or ''],
+            'domains'  : len(job.plds)
+        }) for job in self.ring)
+    
+    #################
+    # Shards
+    #################
+    def addShard(self, name=None, **kwargs):
+        '''Add a redis instance to the frontier, and move over the domains
+        that now belong to it. Every other worker sharing the frontier has
+        to be given the new shard, too.'''
+        shard = self.shards.add(name, **kwargs)
+        self.rebalance()
+        return shard
+    
+    @blocking
+    def rebalance(self):
+        '''Move every domain that's kept on a shard other than the one it
+        hashes to. This is best done while the other workers are paused, as
+        each domain is in neither place for the moment that it's moving.
+        Returns how many domains' queues were moved.'''
+        moved = 0
+        for shard in self.shards:
+            for job in self.ring:
+                # Unlike KEYS, SCAN doesn't hold up everyone else using the
+                # shard while it looks through the whole keyspace
+                for name in shard.r.scan_iter(job.prefix + 'domain:*', self.batchSize):
+                    key = name[len(job.prefix):]
+                    owner = self.shard(key)
+                    if owner is not shard:
+                        self.move(job, key, shard, owner)
+                        moved += 1
+        if moved:
+            logger.warn('Rebalanced %i domains over %i shards' % (moved, len(self.shards)))
+        return moved
+    
+    def move(self, job, key, source, dest):
+        '''Move a job's queue for a domain from one shard to another, along
+        with its place in the job's schedule. The first job's queue to move
+        takes the domain's flights, politeness and circuit breaker with it.
+        The domain's leases stay where they are, since `reclaim` looks for
+        them on every shard.'''
+        name   = job.queueKey(key)
+        packed = self.pack(key)
+        with source.r.pipeline() as p:
+            p.zrange(name, 0, -1, withscores=True)
+            p.zscore(job.plds.key, packed)
+            p.zscore('polite', key)
+            p.hgetall('breaker:' + key)
+            p.zrange('flight:' + key, 0, -1, withscores=True)
+            p.delete(name, 'breaker:' + key, 'flight:' + key)
+            p.zrem(job.plds.key, packed)
+            p.zrem('polite', key)
+            items, when, polite, breaker, flights = p.execute()[:5]
+        with dest.r.pipeline() as p:
+            # The destination may already have some requests for this domain,
+            # if any arrived after the shard was added, and these join them
+            if items:
+                p.execute_command('ZADD', name, *[x for i in items for x in (i[1], i[0])])
+            if when is not None:
+                p.execute_command('ZADD', job.plds.key, when, packed)
+            if polite is not None and polite > time.time():
+                p.zadd('polite', **{key: polite})
+            if breaker:
+                p.hmset('breaker:' + key, breaker)
+            if flights:
+                p.execute_command('ZADD', 'flight:' + key, *[x for f in flights for x in (f[1], f[0])])
+            p.hincrby('depths', job.name or '', len(items))
+            p.execute()
+        source.r.hincrby('depths', job.name or '', -len(items))
+    
+    @staticmethod
+    def hostname(req):
+        return urlparse.urlparse(req.url.strip()).hostname
     
     def getKey(self, req):
-        # This actually considers the whole domain name, including subdomains, uniquely
-        # This aliasing is just in case we want to change that scheme later, easily
-        return 'domain:%s' % urlparse.urlparse(req.url.strip()).hostname
+        '''The politeness key for a request, per `keyBy`, or None if its
+        hostname is still being resolved. A url without a hostname has a key
+        all the same, 'domain:None'.'''
+        hostname = self.hostname(req)
+        key = self.keys.pop(hostname, None)
+        if key is None:
+            found = self.keyFor(hostname)
+            if found is None:
+                return None
+            key = 'domain:%s' % found
+            # A hostname that didn't resolve is only keyed on itself for now
+            if hostname in self.unresolved:
+                return key
+            while len(self.keys) >= self.keyCacheSize:
+                self.keys.popitem(last=False)
+        # It's been used, so it's now the most recently used
+        self.keys[hostname] = key
+        return key
+    
+    def keyFor(self, hostname):
+        '''What to be polite to for this hostname. This is only consulted
+        once per hostname, and then cached by `getKey`. None means that the
+        answer isn't known yet, and that its requests have to wait.'''
+        if not hostname:
+            # There's nothing to look up, so all of these share 'domain:None'
+            return str(hostname)
+        if self.keyBy == 'hostname':
+            return hostname
+        if self.keyBy == 'domain':
+            return self.suffixes.registered(hostname)
+        if self.keyBy == 'ip':
+            if isIPAddress(hostname):
+                return hostname
+            retry = self.unresolved.get(hostname)
+            if retry is not None:
+                if retry > time.time():
+                    return hostname
+                del self.unresolved[hostname]
+            self.resolve(hostname)
+            return None
+        raise ValueError('Unknown keyBy %s' % repr(self.keyBy))
+    
+    def resolve(self, hostname):
+        '''Look up a hostname's address with the reactor's resolver, unless
+        we already are. Its requests are queued once we know.'''
+        if hostname in self.resolving:
+            return
+        self.resolving[hostname] = []
+        d = reactor.resolve(hostname)
+        d.addErrback(self.unresolvable, hostname)
+        d.addCallback(self.resolved, hostname)
+    
+    def unresolvable(self, failure, hostname):
+        # The request itself will fail soon enough, so until we try again,
+        # its hostname is as good a key as any
+        logger.warn('Could not resolve %s; keying on hostname' % hostname)
+        while len(self.unresolved) >= self.keyCacheSize:
+            self.unresolved.popitem(last=False)
+        self.unresolved[hostname] = time.time() + self.unresolvedTime
+        return None
+    
+    def resolved(self, address, hostname):
+        '''Queue the requests that were waiting on this hostname'''
+        if address is not None:
+            while len(self.keys) >= self.keyCacheSize:
+                self.keys.popitem(last=False)
+            self.keys[hostname] = 'domain:%s' % address
+        requests = self.resolving.pop(hostname, [])
+        if self.bulk(requests):
+            self.serveNext()
+    
+    def shard(self, key):
+        '''The shard that everything for a particular key is kept on'''
+        return self.shards.find(key)
+    
+    def queue(self, key, job=None):
+        '''The queue of requests for a particular key in a job. These are
+        priority queues, scored by each request's rank, so that the most
+        urgent request for a domain is served first, and then oldest first.'''
+        return Pickled.queue(qr.PriorityQueue, self.job(job).queueKey(key), **self.shard(key).kwargs)
     
     def allowed(self, url):
         '''Are we allowed to fetch this url/urls?'''
-        logger.warn('Allowed? %s' % url)
-        return self.allowAll or reppy.allowed(url, self.agent, self.userAgentString)
+        if self.allowAll:
+            return True
+        allowed = self.matchers.allowed(url)
+        if allowed is None:
+            return reppy.allowed(url, self.agent, self.userAgentString)
+        return allowed
+    
+    def disallowed(self, request):
+        '''Whether this request is known to be disallowed by robots.txt.
+        If we haven't got its site's robots.txt yet, then it isn't.'''
+        return not self.allowAll and self.matchers.allowed(request.url) is False
+    
+    # When a request is dropped because robots.txt disallows it
+    def onDisallowed(self, request):
+        pass
+    
+    def drop(self, requests):
+        '''The requests that robots.txt allows (or might), having counted
+        and reported the rest'''
+        kept = []
+        for r in requests:
+            if self.disallowed(r):
+                self.dropped['enqueue'] += 1
+                self.onDisallowed(r)
+            else:
+                kept.append(r)
+        return kept
     
     def crawlDelay(self, request):
         '''How long to wait before getting the next page from this domain?'''
@@ -160,6 +581,72 @@ class PoliteFetcher(BaseFetcher):
         return (self.allowAll and self.delay) or reppy.crawlDelay(request.url, self.agent) or self.delay
         # return self.delay
     
+    #################
+    # The redis thread
+    #################
+    def offloaded(self, func, *args):
+        '''Call `func` on the redis thread, if we have one, and otherwise
+        right here. Failures are logged, since nobody's waiting on them.'''
+        if not self.io:
+            return func(*args)
+        d = self.io.submit(func, *args)
+        d.addErrback(lambda f: logger.error('%s failed: %s' % (func.__name__, f.getTraceback())))
+        return d
+    
+    def onReactor(self, func, *args):
+        '''Call `func` on the reactor thread, whichever thread we're on'''
+        if self.io and self.io.current():
+            reactor.callFromThread(func, *args)
+        else:
+            func(*args)
+    
+    def serveNext(self):
+        '''Requests are popped on the redis thread, as many as there's room
+        for at once, and the reactor starts them when they're handed back.
+        Only one round of this is under way at any time. If we're asked to
+        serve more while it is, then another round follows it.'''
+        if not self.io:
+            return BaseFetcher.serveNext(self)
+        if self.scheduling:
+            self.again = True
+            return
+        self._unhold()
+        if not self._ready() or len(self.held) >= self.poolSize:
+            return
+        # Each request that's started takes a proxy, and so the pool has to
+        # be consulted before every one of them
+        room = 1 if self.proxies else self.poolSize - self.numFlight
+        self.scheduling = True
+        self.again      = False
+        d = self.io.submit(self.popMany, room)
+        d.addErrback(self.unscheduled).addCallback(self.scheduled)
+    
+    def popMany(self, count):
+        '''Pop up to `count` requests'''
+        requests = []
+        while len(requests) < count:
+            request = self.pop()
+            if request is None:
+                break
+            requests.append(request)
+        return requests
+    
+    def unscheduled(self, failure):
+        logger.error('Failed to pop requests: %s' % failure.getTraceback())
+        return []
+    
+    def scheduled(self, requests):
+        '''A round of scheduling has handed back these requests to start'''
+        self.scheduling = False
+        for request in requests:
+            self._start(request)
+        if self.again or requests:
+            self.serveNext()
+        elif self.stopWhenDone and self.processed and not self.numFlight and not len(self) and not self.incoming:
+            # Had this round found nothing, the last request to be done
+            # would have stopped us. It was waiting on us instead.
+            self.stop()
+    
     # Event callbacks
     def onDone(self, request):
         # Append this next one onto the pld queue.
@@ -171,14 +658,75 @@ class PoliteFetcher(BaseFetcher):
         #   request, since subsequent requests will like depend on
         #   it.
         # self.pldQueue.push(request._originalKey, time.time() + self.crawlDelay(request))
+        job = self.job(request.job)
         with self.lock:
-            if isinstance(request, RobotsRequest):
-                self.pldQueue.push(request._originalKey, time.time() + self.crawlDelay(request))
-            # If this request would bring down our parallel requests 
-            # down from the maximum, then we should immediately requeue
-            # the original key to reduce latency.
-            if Counter.remove(self.r, request) == (self.maxParallelRequests - 1):
-                self.pldQueue.push(request._originalKey, time.time() + self.crawlDelay(request))
+            job.inFlight -= 1
+            job.done     += 1
+        self.offloaded(self.finished, request, job)
+    
+    @blocking
+    def finished(self, request, job):
+        '''The bookkeeping in redis for a request that's done'''
+        if isinstance(request, RobotsRequest):
+            self.recheck(request._originalKey, request.url)
+            self.schedule(request._originalKey, time.time() + self.crawlDelay(request), job)
+        # If this request would bring down our parallel requests 
+        # down from the maximum, then we should immediately requeue
+        # the original key to reduce latency.
+        if Counter.remove(self.shard(request._originalKey).r, request, self.worker) == (self.maxParallelRequests - 1):
+            self.schedule(request._originalKey, time.time() + self.crawlDelay(request), job)
+    
+    def recheck(self, key, url):
+        '''Now that we have this site's robots.txt, drop whatever requests
+        it disallows from the key's queue in every job, so they're never
+        popped. The queues are scanned a batch at a time.'''
+        if self.allowAll:
+            return
+        # The shared matchers belong to the reactor thread, so this check
+        # compiles a site's rules for itself
+        matchers = Matchers(self.userAgentString)
+        if matchers.get(urlparse.urlparse(url).netloc) is None:
+            return
+        r = self.shard(key).r
+        dropped = 0
+        for job in self.ring:
+            name = job.queueKey(key)
+            batch = []
+            for value, score in r.zscan_iter(name, count=self.batchSize):
+                request = self.unpack(value)
+                if request is None:
+                    continue
+                # Keyed by domain or address, a queue may mix sites, and
+                # those whose robots.txt we don't have are left alone
+                if matchers.allowed(request.url) is False:
+                    batch.append(value)
+                    self.onReactor(self.onDisallowed, request)
+                if len(batch) >= self.batchSize:
+                    dropped += self.discard(r, job, name, batch)
+                    batch = []
+            if batch:
+                dropped += self.discard(r, job, name, batch)
+        if dropped:
+            logger.info('Dropped %i disallowed requests for %s' % (dropped, key))
+            self.onReactor(self.rechecked, dropped)
+    
+    def discard(self, r, job, name, values):
+        '''Remove these members from a domain's queue'''
+        with r.pipeline(transaction=False) as p:
+            p.zrem(name, *values)
+            p.hincrby('depths', job.name or '', -len(values))
+            return p.execute()[0]
+    
+    def rechecked(self, dropped):
+        '''Account for the requests that a recheck dropped'''
+        self.dropped['recheck'] += dropped
+        self.remaining -= dropped
+    
+    def schedule(self, key, when, job):
+        '''Schedule a domain to be fetched from again at `when`, or when its
+        circuit is next due to be probed, if that's later'''
+        until = self.shard(key).r.hget('breaker:' + key, 'until')
+        job.plds.push(key, max(when, float(until or 0)))
     
     # When we try to pop off an empty queue
     def onEmptyQueue(self, key):
@@ -186,120 +734,508 @@ class PoliteFetcher(BaseFetcher):
     
     # How many are in flight from this particular key?
     def inFlight(self, key):
-        return Counter.len(self.r, key)
+        return Counter.len(self.shard(key).r, key)
+    
+    #################
+    # Circuit breakers for failing domains
+    #################
+    def severity(self, result):
+        '''How much this outcome counts towards opening its domain's circuit.
+        A domain that doesn't resolve is opened right away, and otherwise any
+        failure to get a response, or a 5xx response, counts once.'''
+        if not isinstance(result, Failure) or result.check(UserPreemptionError):
+            return 0
+        if result.check(DNSLookupError):
+            return self.breakerThreshold
+        if result.check(error.Error):
+            return 1 if str(getattr(result.value, 'status', '')).startswith('5') else 0
+        return 1
+    
+    def outcome(self, request, result):
+        key = getattr(request, '_originalKey', None)
+        if not key:
+            return
+        self.offloaded(self.breaker, request, key, self.severity(result))
+    
+    @blocking
+    def breaker(self, request, key, severity):
+        '''Update the circuit breaker for this domain with how this request
+        turned out'''
+        name = 'breaker:' + key
+        r = self.shard(key).r
+        lease = getattr(request, '_leaseId', None) or request.url
+        if r.hget(name, 'probe') == lease:
+            # This request alone decides whether the circuit closes
+            if severity:
+                self.trip(key, 2 * float(r.hget(name, 'cooldown') or self.breakerCooldown), request.job)
+            else:
+                logger.info('Closing circuit for %s' % key)
+                r.delete(name)
+                self.job(request.job).plds.push(key, time.time())
+        elif severity:
+            with r.pipeline() as p:
+                p.hincrby(name, 'failures', severity)
+                p.hget(name, 'until')
+                failures, until = p.execute()
+            # If it's already open, then this was just a straggler
+            if failures >= self.breakerThreshold and until is None:
+                self.trip(key, self.breakerCooldown, request.job)
+        else:
+            # Only consecutive failures count
+            r.hdel(name, 'failures')
+    
+    def trip(self, key, cooldown, job=None):
+        '''Open the circuit for this domain for `cooldown` seconds. Any other
+        jobs with requests for it find out when they next get to it.'''
+        cooldown = min(cooldown, self.breakerMaxCooldown)
+        until = time.time() + cooldown
+        logger.warn('Opening circuit for %s for %fs' % (key, cooldown))
+        with self.shard(key).r.pipeline() as p:
+            p.hmset('breaker:' + key, {'until': until, 'cooldown': cooldown, 'failures': 0})
+            p.hdel('breaker:' + key, 'probe')
+            p.execute()
+        self.job(job).plds.push(key, until)
+    
+    #################
+    # Leases on in-flight requests
+    #################
+    @blocking
+    def renew(self):
+        '''Extend our lease, and reclaim the requests of any worker whose
+        lease has run out.'''
+        try:
+            self.r.zadd('workers', **{self.worker: time.time() + self.leaseTime})
+            self.reconcile()
+        except Exception:
+            logger.exception('Failed to renew lease for %s' % self.worker)
+    
+    def reconcile(self):
+        '''Reclaim the in-flight requests of every worker whose lease has
+        expired. Returns how many requests were requeued.'''
+        count = 0
+        for worker in self.r.zrangebyscore('workers', 0, time.time()):
+            # Only one worker gets to remove the dead one from the set,
+            # and so only one worker reclaims its requests
+            if self.r.zrem('workers', worker):
+                count += self.reclaim(worker)
+        return count
+    
+    @blocking
+    def reclaim(self, worker):
+        '''Requeue all the requests leased by the provided worker at the
+        front of their domains' queues, and clear their flights. Each lease
+        is kept on the same shard as the request's domain. Any requests it
+        had taken from the incoming queue, but not yet queued, go back to
+        the front of the incoming queue.'''
+        with self.r.pipeline() as p:
+            p.lrange('incoming:' + worker, 0, -1)
+            p.delete('incoming:' + worker)
+            taken = p.execute()[0]
+        if taken:
+            # The oldest are at the right-hand end of both lists
+            self.r.rpush(self.requests.key, *taken)
+            logger.warn('Returned %i incoming requests from %s' % (len(taken), worker))
+        leases = {}
+        count = 0
+        for shard in self.shards:
+            leases.update(shard.r.hgetall('lease:' + worker))
+        for url, data in leases.items():
+            try:
+                request = Pickled.loads(data)
+                key = request._originalKey
+                r = self.shard(key).r
+                # A score of 0 puts it ahead of anything ranked by time
+                self.queue(key, request.job).push(request, 0)
+                r.zrem('flight:' + key, url)
+                # If it was probing its domain, then the domain is due to be
+                # probed again right away, rather than after a cooldown. The
+                # probe held off every job until then, in `polite`, too.
+                if r.hget('breaker:' + key, 'probe') == url:
+                    with r.pipeline() as p:
+                        p.hset('breaker:' + key, 'until', time.time())
+                        p.hdel('breaker:' + key, 'probe')
+                        p.zrem('polite', key)
+                        p.execute()
+                r.hincrby('depths', request.job or '', 1)
+                self.job(request.job).plds.push(key, time.time())
+                count += 1
+            except Exception:
+                logger.exception('Failed to reclaim %s from %s' % (url, worker))
+        for shard in self.shards:
+            shard.r.delete('lease:' + worker)
+        self.onReactor(self.requeued, count)
+        if leases:
+            logger.warn('Reclaimed %i requests from %s' % (len(leases), worker))
+        return len(leases)
+    
+    def requeued(self, count):
+        self.remaining += count
+    
+    def stop(self):
+        # Our lease is left to expire immediately, so that any requests we
+        # still had in flight are picked up by other workers. Whatever the
+        # redis thread still has to do is done first.
+        try:
+            if self.heartbeat.running:
+                self.heartbeat.stop()
+            self.unlisten()
+            if self.io:
+                self.io.stop()
+            self.r.zadd('workers', **{self.worker: 0})
+        except Exception:
+            logger.exception('Failed to release lease for %s' % self.worker)
+        BaseFetcher.stop(self)
     
     #################
     # Insertion to our queue
     #################
+    @blocking
     def extend(self, requests):
+        '''Enqueue many requests at once. Rather than making a few round trips
+        to redis for every request, they're grouped by key and written in
+        pipelined batches of `batchSize`. Returns how many were added.'''
         count = 0
-        t = time.time()
+        batch = []
         for r in requests:
-            count += self.push(r) or 0
+            batch.append(r)
+            if len(batch) >= self.batchSize:
+                count += self.bulk(batch)
+                batch = []
+        if batch:
+            count += self.bulk(batch)
+        return count
+    
+    def bulk(self, requests):
+        '''Write a batch of requests to their domains' queues in one pipeline,
+        and schedule any of those domains that aren't already scheduled.'''
+        requests = self.drop(requests)
+        if not requests:
+            return 0
+        now = time.time()
+        # Each request is serialized exactly once, and the arguments for a
+        # single ZADD per domain (in each job) are built up as we go
+        groups = collections.defaultdict(list)
+        for r in requests:
+            key = self.getKey(r)
+            if key is None:
+                # It's queued once its hostname has been resolved
+                self.resolving[self.hostname(r)].append(r)
+                continue
+            groups[(r.job, key)].extend((self.rank(r), self.pack(r)))
+        # Then each shard gets the domains that belong to it
+        shards = collections.defaultdict(list)
+        for name, key in groups:
+            shards[self.shard(key)].append((name, key))
+        count = 0
+        for shard, keys in shards.iteritems():
+            plds = collections.defaultdict(list)
+            with shard.r.pipeline(transaction=False) as p:
+                for name, key in keys:
+                    p.execute_command('ZADD', self.job(name).queueKey(key), 'NX', *groups[(name, key)])
+                    plds[name].extend((now, self.pack(key)))
+                # A domain that's already in the pld queue keeps its place (and
+                # any delay it's serving), but a new one can be fetched now
+                for name, args in plds.iteritems():
+                    p.execute_command('ZADD', self.job(name).plds.key, 'NX', *args)
+                added = p.execute()[:len(keys)]
+            # Then keep track of how deep each job's queues are
+            depths = collections.defaultdict(int)
+            for (name, key), n in zip(keys, added):
+                depths[name] += n
+            with shard.r.pipeline(transaction=False) as p:
+                for name, n in depths.iteritems():
+                    p.hincrby('depths', name or '', n)
+                p.execute()
+            count += sum(added)
+        self.remaining += count
+        return count
+    
+    @blocking
+    def enqueue(self, requests):
+        '''Add requests to the shared incoming queue, from which whichever
+        workers are sharing this redis will `grow`. Requests are written in
+        pipelined batches of `batchSize`. Returns how many were written.'''
+        count = 0
+        batch = []
+        with self.r.pipeline(transaction=False) as p:
+            for r in requests:
+                batch.append(self.pack(r))
+                if len(batch) >= self.batchSize:
+                    p.lpush(self.requests.key, *batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                p.lpush(self.requests.key, *batch)
+                count += len(batch)
+            p.execute()
         return count
     
     def grow(self, upto=10000):
+        return BaseFetcher.grew(self, self.drain(upto))
+    
+    @blocking
+    def drain(self, upto=10000):
+        '''Move up to `upto` requests from the incoming queue into their
+        domains' queues. Returns how many there were.'''
         count = 0
-        t = time.time()
-        r = self.requests.pop()
-        while r and count < upto:
-            count += self.push(r) or 0
-            r = self.requests.pop()
+        key = self.requests.key
+        while upto > 0:
+            n = min(self.batchSize, upto)
+            # Pop a whole range at once. The incoming queue is pushed on the
+            # left and popped from the right, so the oldest requests are at
+            # the right-hand end. This happens in a transaction, so that no
+            # two workers ever pop the same requests.
+            with self.r.pipeline() as p:
+                p.lrange(key, -n, -1)
+                p.ltrim(key, 0, -n - 1)
+                items = p.execute()[0]
+            if not items:
+                break
+            requests = (self.unpack(i) for i in reversed(items))
+            count += self.bulk([r for r in requests if r is not None])
+            upto -= len(items)
         logger.debug('Grew by %i' % count)
-        return BaseFetcher.grew(self, count)
+        return count
+    
+    #################
+    # Notification of incoming requests
+    #################
+    def listen(self):
+        '''Start waiting on the incoming queue'''
+        self.listening = True
+        self.listener  = threading.Thread(target=self.waitForRequests,
+            args=(Shard(**self.shards[0].kwargs).r,), name='downpour-listener')
+        self.listener.daemon = True
+        self.listener.start()
     
+    def unlisten(self):
+        '''Stop waiting on the incoming queue, which takes up to
+        `notifyTimeout` seconds'''
+        self.listening = False
+        if self.listener and self.listener is not threading.current_thread():
+            self.listener.join(self.notifyTimeout + 1)
+    
+    def waitForRequests(self, r):
+        '''Block on the incoming queue, and hand each request that arrives
+        to the reactor. Popping it is atomic, so only one of the workers
+        waiting on the queue gets each request, and it's moved to our own
+        list of taken requests in the same step.'''
+        key = self.requests.key
+        while self.listening:
+            try:
+                item = r.brpoplpush(key, self.taken, self.notifyTimeout)
+            except Exception:
+                if self.listening:
+                    logger.exception('Failed waiting on incoming requests')
+                    time.sleep(self.notifyTimeout)
+                continue
+            if item is None:
+                continue
+            if self.listening:
+                reactor.callFromThread(self.arrived, item)
+            else:
+                # Too late for us, so it goes back where it was, for whoever
+                # is next to grow
+                with r.pipeline() as p:
+                    p.lrem(self.taken, item, 1)
+                    p.rpush(key, item)
+                    p.execute()
+    
+    @blocking
+    def arrived(self, value):
+        '''A request has been enqueued. It goes to its domain's queue right
+        away, along with anything else that's arrived since, and then the
+        fallback `grow` is put off for another period. If we've stopped
+        listening, then it's left among the taken requests to be reclaimed.'''
+        if not self.listening:
+            return 0
+        request = self.unpack(value)
+        count = self.bulk([request]) if request is not None else 0
+        self.r.lrem(self.taken, value, 1)
+        return BaseFetcher.grew(self, count + self.drain())
+    
+    def pack(self, obj):
+        '''Serialize something the way our qr queues do, so that what we write
+        to redis in bulk can be read back through them'''
+        return Pickled.dumps(obj)
+    
+    def unpack(self, value):
+        '''The inverse of `pack`'''
+        return None if value is None else Pickled.loads(value)
+    
+    @blocking
     def trim(self, request, trim):
-        # Then, trim that list
-        qr.Queue(self.getKey(request)).trim(trim)
+        # Then, trim that queue, keeping only the first `trim` requests
+        key = self.getKey(request)
+        if key is None:
+            return
+        r = self.shard(key).r
+        removed = r.zremrangebyrank(self.job(request.job).queueKey(key), trim, -1)
+        r.hincrby('depths', request.job or '', -removed)
     
+    @blocking
     def push(self, request):
-        key = self.getKey(request)
-        q = qr.Queue(key)
-        if not len(q):
-            self.pldQueue.push(key, time.time())
-        q.push(request)
-        self.remaining += 1
-        return 1
+        # A request is just a batch of one. A duplicate of a request that's
+        # already queued isn't added again, and so it isn't counted either.
+        return self.bulk([request])
     
+    @blocking
     def pop(self, polite=True):
-        '''Get the next request'''
+        '''Get the next request. Jobs take turns by deficit round-robin: each
+        time it's a job's turn, it earns credit in proportion to its weight,
+        and it spends one for each request it's given. A job that has nothing
+        ready (or that is at its cap) forfeits the rest of its turn.'''
         now = time.time()
+        soonest = None
+        # Jobs are only ever added to the ring, so this goes around the ring
+        # as it was when it started
+        with self.lock:
+            ring = list(self.ring)
+            quantum = 1.0 / min(job.weight for job in ring)
+        for visit in range(len(ring) + 1):
+            job = ring[self.turn]
+            if job.deficit >= 1:
+                if not job.full():
+                    request, when = self.popFrom(job, polite, now)
+                    if request is not None:
+                        with self.lock:
+                            job.deficit  -= 1
+                            job.served   += 1
+                            job.inFlight += 1
+                        return request
+                    if when is not None and (soonest is None or when < soonest):
+                        soonest = when
+                # With nothing ready, or at its cap, a job can't save up credit
+                with self.lock:
+                    job.deficit = 0
+            # Now it's the next job's turn
+            with self.lock:
+                self.turn = (self.turn + 1) % len(ring)
+                ring[self.turn].deficit += ring[self.turn].weight * quantum
+        # If the next-fetchable is not soon enough, then wait
+        if soonest is not None:
+            self.onReactor(self.wait, soonest)
+        return None
+    
+    def wait(self, when):
+        '''Try to serve the next request at `when`, unless we already will'''
+        if not (self.timer and self.timer.active()):
+            logger.debug('Waiting %f seconds' % (when - time.time()))
+            self.timer = reactor.callLater(max(when - time.time(), 0), self.serveNext)
+    
+    def popFrom(self, job, polite, now):
+        '''Get the next request from this job. Returns the request, if there
+        is one ready, and otherwise when the next one will be'''
         while True:
             # Get the next plds we might want to fetch from
-            next, when = self.pldQueue.peek(withscores=True)
+            next, when = job.plds.peek(withscores=True)
             if not next:
-                return None
+                return None, None
             # If the next-fetchable is not soon enough, then wait
             if polite and when > now:
-                with self.tlock:
-                    if not (self.timer and self.timer.active()):
-                        logger.debug('Waiting %f seconds on %s' % (when - now, next))
-                        self.timer = reactor.callLater(when - now, self.serveNext)
-                    return None
+                return None, when
             else:
                 # Go ahead and pop this item
                 last = next
-                next = self.pldQueue.pop()
-                # Unset the timer
-                self.timer = None
-                q = qr.Queue(next)
+                next = job.plds.pop()
+                q = self.queue(next, job.name)
+                # Everything else about this domain is on the same shard
+                db = self.shard(next).r
                 
-                with self.lock:
-                    if len(q):
-                        # If we've already saturated our parallel requests, then we'll
-                        # wait some short amount of time before we make our next request.
-                        # There is logic elsewhere so that if one of these requests 
-                        # completes before this small amount of time elapses, then it
-                        # will be advanced accordingly.
-                        if Counter.len(self.r, next) >= self.maxParallelRequests:
-                            self.pldQueue.push(next, time.time() + 20)
+                if len(q):
+                    # If we've already saturated our parallel requests, then we'll
+                    # wait some short amount of time before we make our next request.
+                    # There is logic elsewhere so that if one of these requests 
+                    # completes before this small amount of time elapses, then it
+                    # will be advanced accordingly.
+                    if Counter.len(db, next) >= self.maxParallelRequests:
+                        job.plds.push(next, time.time() + 20)
+                        continue
+                    
+                    # If this domain's circuit is open, then its requests have to
+                    # wait until it's due to be probed, and then only one goes.
+                    # Nothing else is released until that probe reports back, or
+                    # should it never do so, until it's time for another probe.
+                    # Likewise if another job has fetched from it too recently
+                    probing = False
+                    with db.pipeline(transaction=False) as p:
+                        p.hmget('breaker:' + next, 'until', 'cooldown')
+                        p.zscore('polite', next)
+                        (until, cooldown), allowed = p.execute()
+                    if allowed and allowed > time.time():
+                        job.plds.push(next, allowed)
+                        continue
+                    if until is not None:
+                        if float(until) > time.time():
+                            job.plds.push(next, float(until))
                             continue
+                        logger.info('Probing %s' % next)
+                        until = time.time() + float(cooldown or self.breakerCooldown)
+                        db.hset('breaker:' + next, 'until', until)
+                        probing = True
                         
-                        # If the robots for this particular request is not fetched
-                        # or it's expired, then we'll have to make a request for it
-                        v = q.peek()
-                        domain = urlparse.urlparse(v.url).netloc
-                        robot = reppy.findRobot('http://' + domain)
-                        if not self.allowAll and (not robot or robot.expired):
-                            logger.debug('Making robots request for %s' % next)
-                            r = RobotsRequest('http://' + domain + '/robots.txt')
-                            r._originalKey = next
-                            # Increment the number of requests we currently have in flight
-                            Counter.put(self.r, r)
-                            return r
-                        else:
-                            logger.debug('Popping next request from %s' % next)
-                            v = q.pop()
-                            # This was the source of a rather difficult-to-track bug
-                            # wherein the pld queue would slowly drain, despite there
-                            # being plenty of logical queues to draw from. The problem
-                            # was introduced by calling urlparse.urljoin when invoking
-                            # the request's onURL method. As a result, certain redirects
-                            # were making changes to the url, saving it as an updated
-                            # value, but we'd then try to pop off the queue for the new
-                            # hostname, when in reality, we should pop off the queue 
-                            # for the original hostname.
-                            v._originalKey = next
-                            # Increment the number of requests we currently have in flight
-                            Counter.put(self.r, v)
-                            # At this point, we should also schedule the next request
-                            # to this domain.
-                            self.pldQueue.push(next, time.time() + self.crawlDelay(v))
-                            return v
+                    # If the robots for this particular request is not fetched
+                    # or it's expired, then we'll have to make a request for it
+                    v = q.peek()
+                    domain = urlparse.urlparse(v.url).netloc
+                    robot = reppy.findRobot('http://' + domain)
+                    if not self.allowAll and (not robot or robot.expired):
+                        logger.debug('Making robots request for %s' % next)
+                        r = RobotsRequest('http://' + domain + '/robots.txt')
+                        r._originalKey = next
+                        r.job = job.name
+                        # Increment the number of requests we currently have in flight
+                        Counter.put(db, r, self.worker)
+                        if probing:
+                            db.hset('breaker:' + next, 'probe', r._leaseId)
+                        return r, None
                     else:
-                        try:
-                            if Counter.len(self.r, next) == 0:
-                                logger.debug('Calling onEmptyQueue for %s' % next)
-                                self.onEmptyQueue(next)
-                            else:
-                                # Otherwise, we should try again in a little bit, and 
-                                # see if the last request has finished.
-                                self.pldQueue.push(next, time.time() + 20)
-                                logger.debug('Requests still in flight for %s. Waiting' % next)
-                        except Exception:
-                            logger.exception('onEmptyQueue failed for %s' % next)
-                        continue
-        return None
+                        logger.debug('Popping next request from %s' % next)
+                        v = q.pop()
+                        # This was the source of a rather difficult-to-track bug
+                        # wherein the pld queue would slowly drain, despite there
+                        # being plenty of logical queues to draw from. The problem
+                        # was introduced by calling urlparse.urljoin when invoking
+                        # the request's onURL method. As a result, certain redirects
+                        # were making changes to the url, saving it as an updated
+                        # value, but we'd then try to pop off the queue for the new
+                        # hostname, when in reality, we should pop off the queue 
+                        # for the original hostname.
+                        v._originalKey = next
+                        v.job = job.name
+                        # Increment the number of requests we currently have in flight
+                        Counter.put(db, v, self.worker)
+                        # At this point, we should also schedule the next request
+                        # to this domain, for this job and any other.
+                        if probing:
+                            db.hset('breaker:' + next, 'probe', v._leaseId)
+                            when = until
+                        else:
+                            when = time.time() + self.crawlDelay(v)
+                        # Whatever's in the past no longer holds anyone back, and
+                        # it's pruned as we go, so that this stays as small as the
+                        # number of domains being fetched from right now
+                        with db.pipeline(transaction=False) as p:
+                            p.zremrangebyscore('polite', 0, time.time())
+                            p.zadd('polite', **{next: when})
+                            p.hincrby('depths', job.name or '', -1)
+                            p.execute()
+                        job.plds.push(next, when)
+                        return v, None
+                else:
+                    try:
+                        if Counter.len(db, next) == 0:
+                            logger.debug('Calling onEmptyQueue for %s' % next)
+                            self.onReactor(self.onEmptyQueue, next)
+                        else:
+                            # Otherwise, we should try again in a little bit, and 
+                            # see if the last request has finished.
+                            job.plds.push(next, time.time() + 20)
+                            logger.debug('Requests still in flight for %s. Waiting' % next)
+                    except Exception:
+                        logger.exception('onEmptyQueue failed for %s' % next)
+                    continue
+        return None, None
         
 if __name__ == '__main__':
     import logging
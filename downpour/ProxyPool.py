@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+# 
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Spread requests over a pool of forward proxies'''
+
+from downpour import Auth, parse, logger
+
+import time
+import random
+
+class Proxy(object):
+    '''A single proxy in a pool, and the bookkeeping for it'''
+    def __init__(self, url, weight=1, maxFlight=None):
+        self.url       = url
+        self.weight    = float(weight)
+        self.maxFlight = maxFlight
+        scheme, host, port, path = parse(url)
+        self.key       = '%s:%s' % (host, port)
+        # How many requests are currently using this proxy
+        self.numFlight = 0
+        # Consecutive failures, and how many times in a row we've had to
+        # eject this proxy. While ejected, `until` is when it may return.
+        self.failures  = 0
+        self.ejections = 0
+        self.until     = 0
+        # Running totals for stats
+        self.requests  = 0
+        self.errors    = 0
+        self.latency   = 0.0
+        self.slowest   = 0.0
+
+    def available(self, now):
+        if self.until > now:
+            return False
+        return self.maxFlight is None or self.numFlight < self.maxFlight
+
+    def stats(self):
+        return {
+            'inFlight': self.numFlight,
+            'requests': self.requests,
+            'errors'  : self.errors,
+            'latency' : (self.requests and self.latency / self.requests) or 0.0,
+            'slowest' : self.slowest,
+            'ejected' : self.until > time.time()
+        }
+
+class ProxyPool(object):
+    '''A set of proxies to route requests through. Proxies are picked either
+    by `least-loaded` (fewest requests in flight relative to weight) or by
+    `weighted` random selection, and each may have a cap on the number of
+    requests it has in flight. A proxy that fails `maxFailures` times in a
+    row is ejected for `backoff` seconds, doubling each time it's ejected
+    again, up to `maxBackoff`.'''
+    def __init__(self, proxies=None, strategy='least-loaded', maxFailures=3,
+        backoff=30, maxBackoff=600):
+        if strategy not in ('least-loaded', 'weighted'):
+            raise ValueError('Unknown proxy selection strategy: %s' % strategy)
+        self.strategy    = strategy
+        self.maxFailures = maxFailures
+        self.backoff     = backoff
+        self.maxBackoff  = maxBackoff
+        self.proxies     = {}
+        for url in (proxies or []):
+            self.add(url)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def add(self, url, weight=1, maxFlight=None, username=None, password=None):
+        '''Add a proxy to the pool. If credentials are provided, they're
+        registered with `Auth`, as any other proxy's would be.'''
+        proxy = Proxy(url, weight, maxFlight)
+        if username:
+            Auth.register(proxy.key, None, username, password)
+        self.proxies[url] = proxy
+        return proxy
+
+    def remove(self, url):
+        '''Remove a proxy from the pool. Requests in flight are unaffected.'''
+        proxy = self.proxies.pop(url, None)
+        if proxy:
+            Auth.unregister(proxy.key)
+        return proxy
+
+    def available(self):
+        '''Whether any proxy can take another request right now'''
+        now = time.time()
+        return any(p.available(now) for p in self.proxies.itervalues())
+
+    def delay(self):
+        '''How long until an ejected proxy is given another chance, or None
+        if there's no ejected proxy to wait on.'''
+        now = time.time()
+        waits = [p.until - now for p in self.proxies.itervalues() if p.until > now]
+        return (waits and min(waits)) or None
+
+    def acquire(self):
+        '''Pick a proxy for a request, or None if none is available'''
+        now = time.time()
+        candidates = [p for p in self.proxies.itervalues() if p.available(now)]
+        if not candidates:
+            return None
+        if self.strategy == 'weighted':
+            point = random.uniform(0, sum(p.weight for p in candidates))
+            for proxy in candidates:
+                point -= proxy.weight
+                if point <= 0:
+                    break
+        else:
+            proxy = min(candidates, key=lambda p: p.numFlight / p.weight)
+        proxy.numFlight += 1
+        return proxy
+
+    def release(self, proxy, elapsed, failed=False):
+        '''A request through this proxy finished after `elapsed` seconds'''
+        proxy.numFlight -= 1
+        proxy.requests  += 1
+        proxy.latency   += elapsed
+        proxy.slowest    = max(proxy.slowest, elapsed)
+        if not failed:
+            proxy.failures  = 0
+            proxy.ejections = 0
+            return
+        proxy.errors   += 1
+        proxy.failures += 1
+        if proxy.failures >= self.maxFailures:
+            wait = min(self.backoff * (2 ** proxy.ejections), self.maxBackoff)
+            logger.warn('Ejecting proxy %s for %fs' % (proxy.url, wait))
+            proxy.until     = time.time() + wait
+            proxy.failures  = 0
+            proxy.ejections += 1
+
+    def stats(self):
+        '''A dictionary of stats for each proxy, keyed on url'''
+        return dict((url, p.stats()) for url, p in self.proxies.iteritems())
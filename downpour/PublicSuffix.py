@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Find the registered domain of a hostname with the public suffix list'''
+
+import os
+import codecs
+
+class PublicSuffix(object):
+    '''The rules of the public suffix list (https://publicsuffix.org/),
+    compiled into a trie of labels, read from the top-level domain down.
+    A hostname's registered domain is its public suffix and one more label,
+    so `registered('a.b.example.co.uk')` is `'example.co.uk'`.'''
+    # Where to look for the list, if we're not told. These are where the
+    # `publicsuffix` package puts it on Debian and Fedora, respectively
+    paths = [
+        '/usr/share/publicsuffix/public_suffix_list.dat',
+        '/usr/share/publicsuffix/effective_tld_names.dat'
+    ]
+
+    # Markers in the trie for the end of a rule, and for an exception rule
+    RULE      = ''
+    EXCEPTION = '!'
+
+    # Lists we've already compiled, by path
+    loaded = {}
+
+    def __init__(self, rules=()):
+        self.root = {}
+        for rule in rules:
+            self.add(rule)
+
+    @classmethod
+    def load(cls, path=None):
+        '''The compiled list at `path` (or the first of `paths` that exists).
+        Each list is only read and compiled once per process.'''
+        if path is None:
+            for path in cls.paths:
+                if os.path.exists(path):
+                    break
+            else:
+                raise IOError('No public suffix list found in %s' % ', '.join(cls.paths))
+        if path not in cls.loaded:
+            with codecs.open(path, encoding='utf-8') as f:
+                cls.loaded[path] = cls(f)
+        return cls.loaded[path]
+
+    def add(self, rule):
+        '''Add a rule, as it would appear in the list. Comments and blank
+        lines are ignored, and only the first word of a line is the rule'''
+        rule = rule.strip().split(' ', 1)[0].split('\t', 1)[0]
+        if not rule or rule.startswith('//'):
+            return
+        exception = rule.startswith('!')
+        node = self.root
+        for label in reversed(rule.lstrip('!').split('.')):
+            node = node.setdefault(self.label(label), {})
+        node[self.EXCEPTION if exception else self.RULE] = True
+
+    @staticmethod
+    def label(label):
+        '''Labels are kept lowercase and, if they're international, in their
+        ASCII-compatible (punycode) form, which is how they arrive in urls'''
+        if isinstance(label, str):
+            try:
+                label = label.decode('ascii')
+            except UnicodeDecodeError:
+                label = label.decode('utf-8')
+        label = label.lower()
+        if label == '*':
+            return '*'
+        try:
+            return label.encode('ascii')
+        except UnicodeEncodeError:
+            return label.encode('idna')
+
+    def suffix(self, labels):
+        '''How many of these labels (in their usual order) are the public
+        suffix. Unlisted top-level domains count as public suffixes.'''
+        # The implicit `*` rule
+        length = 1
+        node   = self.root
+        for depth, label in enumerate(reversed(labels), 1):
+            if '*' in node:
+                length = depth
+            node = node.get(label)
+            if node is None:
+                break
+            if self.EXCEPTION in node:
+                # The exception's own label is the registered one
+                return depth - 1
+            if self.RULE in node:
+                length = depth
+        return length
+
+    def registered(self, hostname):
+        '''The registered domain of `hostname`. If the hostname is itself a
+        public suffix, or an IP address, then it's returned as-is.'''
+        if ':' in hostname or hostname.replace('.', '').isdigit():
+            return hostname
+        labels = [self.label(l) for l in hostname.strip('.').split('.')]
+        length = self.suffix(labels) + 1
+        return '.'.join(labels[-length:])
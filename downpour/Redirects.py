@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+'''Remember permanent redirects, so that later requests can skip the hop'''
+
+from downpour import logger
+from downpour.RedisThread import RedisThread
+
+import time
+import urlparse
+import collections
+
+class Redirects(object):
+    '''A bounded cache of the permanent (301 and 308) redirects we've seen.
+    Each is remembered by the url that was redirected, and when the path and
+    query survive the redirect unchanged, by its scheme and host as well, so
+    that (for instance) every `http://example.com/...` url can go straight
+    to `https://www.example.com/...`. Give it a redis connection to share
+    what it learns with other workers, through the hash at `key`.'''
+    # The statuses that are taken to be permanent
+    statuses = ('301', '308')
+    # Whether to learn redirects of whole hosts, as well as of single urls
+    prefixes = True
+    # How many hops to follow through the cache for one url
+    maxHops  = 5
+    # How long a url that redis had nothing for is taken not to redirect,
+    # and how many such urls to remember. These are kept apart from the
+    # redirects themselves, so that they never crowd them out.
+    missTime = 60
+    missSize = 10000
+    # With redis, lookups and writes are made on a thread of their own, so
+    # the reactor never waits on them. A url that isn't known here is asked
+    # after (along with any others that have come up in the meantime, in a
+    # single HMGET), and it's whatever requests follow that benefit. Set
+    # this to False to make them right away, on the caller's thread.
+    offload  = True
+
+    def __init__(self, size=10000, redis=None, key='redirects'):
+        self.size    = size
+        self.redis   = redis
+        self.key     = key
+        # Targets by url (or scheme and host), least recently used first
+        self.targets = collections.OrderedDict()
+        # When redis was last asked about each url it had nothing for, or
+        # is being asked now, oldest first
+        self.missed  = collections.OrderedDict()
+        # The urls waiting to be asked about, and whether we're asking
+        self.wanted  = set()
+        self.asking  = False
+        self.io      = RedisThread('downpour-redirects') if redis is not None and self.offload else None
+        self.hits    = 0
+        self.misses  = 0
+        self.learned = 0
+        self.asked   = 0
+
+    def __len__(self):
+        return len(self.targets)
+
+    def stop(self):
+        '''Finish writing what we've learned to redis'''
+        if self.io:
+            self.io.stop()
+
+    @staticmethod
+    def origin(url):
+        '''The scheme and host of a url, as they're kept in the cache'''
+        parsed = urlparse.urlsplit(url)
+        return '%s://%s' % (parsed.scheme.lower(), parsed.netloc.lower())
+
+    def remember(self, source, target):
+        self.missed.pop(source, None)
+        self.targets.pop(source, None)
+        if len(self.targets) >= self.size:
+            self.targets.popitem(last=False)
+        self.targets[source] = target
+
+    def miss(self, source):
+        '''Redis is being asked about `source`, and until it says otherwise,
+        it's taken not to redirect'''
+        self.missed.pop(source, None)
+        if len(self.missed) >= self.missSize:
+            self.missed.popitem(last=False)
+        self.missed[source] = time.time()
+
+    def record(self, source, target, status):
+        '''We were redirected from `source` to `target` with `status`'''
+        if str(status) not in self.statuses or source == target:
+            return
+        records = {source: target}
+        if self.prefixes:
+            before = urlparse.urlsplit(source)
+            after  = urlparse.urlsplit(target)
+            if (before.path or '/', before.query) == (after.path or '/', after.query):
+                records[self.origin(source)] = self.origin(target)
+        for source, target in records.iteritems():
+            self.remember(source, target)
+        if self.io:
+            self.io.submit(self.redis.hmset, self.key, records).addErrback(self.failed)
+        elif self.redis is not None:
+            self.redis.hmset(self.key, records)
+        self.learned += 1
+
+    def lookup(self, source):
+        '''Where `source` redirects to, if we know'''
+        target = self.targets.pop(source, None)
+        if target is not None:
+            # It's been used, so it's now the most recently used
+            self.targets[source] = target
+            return target
+        if self.redis is None:
+            return None
+        when = self.missed.get(source)
+        if when is not None and time.time() - when < self.missTime:
+            return None
+        self.miss(source)
+        if not self.io:
+            self.answered(self.ask([source]))
+            return self.targets.get(source)
+        self.wanted.add(source)
+        if not self.asking:
+            self.query()
+        return None
+
+    def query(self):
+        '''Ask redis about every url that's wanted, on the redis thread'''
+        wanted, self.wanted = list(self.wanted), set()
+        self.asking = True
+        d = self.io.submit(self.ask, wanted)
+        d.addErrback(self.failed)
+        d.addCallback(self.answered)
+
+    def ask(self, wanted):
+        '''Where each of these urls redirects, in one round trip to redis'''
+        return zip(wanted, self.redis.hmget(self.key, wanted))
+
+    def answered(self, found):
+        '''Remember what redis knew, and ask about whatever's come up since'''
+        self.asking = False
+        self.asked += 1
+        for source, target in found or []:
+            if target is not None:
+                self.remember(source, target)
+        if self.wanted:
+            self.query()
+
+    def failed(self, failure):
+        logger.error('Redirects failed: %s' % failure.getTraceback())
+
+    def find(self, url):
+        '''The url that `url` permanently redirects to, if we know of one,
+        following the cache for up to `maxHops` hops. Otherwise, None.'''
+        seen = set([url])
+        for hop in range(self.maxHops):
+            target = self.lookup(url)
+            if target is None:
+                origin = self.origin(url)
+                prefix = self.lookup(origin)
+                if prefix is None:
+                    break
+                target = prefix + url[len(origin):]
+            if target in seen:
+                # A loop. Better to let the server tell us where to go
+                break
+            seen.add(target)
+            url = target
+        if len(seen) == 1:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return url
+
+    def stats(self):
+        return {
+            'size'   : len(self.targets),
+            'hits'   : self.hits,
+            'misses' : self.misses,
+            'learned': self.learned,
+            'asked'  : self.asked
+        }
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+'''Make blocking redis calls on a thread of their own'''
+
+from downpour import reactor
+
+import time
+import Queue
+import threading
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+class RedisThread(object):
+    '''A single thread that makes blocking calls (to redis, say) on the
+    reactor's behalf, one after another, in the order they were submitted.
+    Each call's result is delivered by a Deferred, on the reactor thread.
+    Whatever has been submitted by the time the thread gets around to it is
+    run as one batch, and the results of a batch are handed back all at
+    once, so a burst of calls costs the reactor a single wakeup.'''
+    # The most calls to run in one batch
+    batchSize = 100
+
+    def __init__(self, name='downpour-redis'):
+        self.queue   = Queue.Queue()
+        self.stopped = False
+        # How many batches and calls we've run, and how long they've taken
+        self.batches = 0
+        self.calls   = 0
+        self.busy    = 0.0
+        self.thread  = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __len__(self):
+        '''How many calls are waiting to be run'''
+        return self.queue.qsize()
+
+    def current(self):
+        '''Whether or not we're being called from this thread'''
+        return threading.current_thread() is self.thread
+
+    def submit(self, func, *args, **kwargs):
+        '''Call `func` on this thread. Returns a Deferred for its result.
+        Once stopped, calls are made right away, on the caller's thread.'''
+        if self.stopped:
+            return defer.maybeDeferred(func, *args, **kwargs)
+        d = defer.Deferred()
+        self.queue.put((d, func, args, kwargs))
+        return d
+
+    def stop(self, timeout=10):
+        '''Finish any calls already submitted, and then stop. Results that
+        the reactor is too late to see are discarded.'''
+        if self.stopped:
+            return
+        self.stopped = True
+        self.queue.put(None)
+        if not self.current():
+            self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            start = time.time()
+            results = []
+            for item in batch:
+                if item is None:
+                    continue
+                d, func, args, kwargs = item
+                try:
+                    results.append((d, True, func(*args, **kwargs)))
+                except Exception:
+                    results.append((d, False, Failure()))
+            self.batches += 1
+            self.calls   += len(results)
+            self.busy    += time.time() - start
+            if results:
+                reactor.callFromThread(self.deliver, results)
+            if None in batch:
+                return
+
+    @staticmethod
+    def deliver(results):
+        for d, succeeded, result in results:
+            if succeeded:
+                d.callback(result)
+            else:
+                d.errback(result)
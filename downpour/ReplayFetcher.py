@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+# 
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Replay archived responses through requests, without the network'''
+
+from downpour import BaseFetcher, Archive, logger, reactor
+
+from twisted.web import error
+from twisted.python.failure import Failure
+
+class ReplayError(Exception):
+    '''The exception used when a request has no recorded response, or the
+    response it recorded was a failure without an HTTP status'''
+    def __init__(self, value):
+        self.value = value
+    def __repr__(self):
+        return repr(self.value)
+    def __str__(self):
+        return str(self.value)
+
+class ReplayFetcher(BaseFetcher):
+    '''Services requests from the responses recorded in an Archive, rather
+    than from the network. Requests go through the same callbacks that they
+    would if they were being fetched (`onURL`, `onStatus`, `onHeaders`, and
+    then `onSuccess` or `onError`, and `onDone`), and the fetcher's rules
+    and callbacks apply, too. This makes it possible to measure the callbacks
+    and scheduling on their own, or regression-test them deterministically.
+    
+    Each response is delayed by `latency` seconds, which may be a number, a
+    callable that returns one (for example, `lambda: random.expovariate(10)`)
+    or, by default, the time it took when it was recorded. Delays are then
+    divided by `speedup`.
+    
+    Only where each response is in the archive is kept in memory. Its body
+    is read from there when it's replayed.'''
+    def __init__(self, path, poolSize=10, agent=None, stopWhenDone=False,
+        speedup=1.0, latency=None, **kwargs):
+        BaseFetcher.__init__(self, poolSize, agent, stopWhenDone, **kwargs)
+        self.speedup = float(speedup)
+        self.latency = latency
+        # Where each record is (its segment and offset), and how long it took,
+        # keyed on the url that was originally requested. If a url was
+        # recorded more than once, the last recording wins
+        self.records = {}
+        for segment, offset, record in Archive.index(path):
+            self.records[record['X-Downpour-Original-URI']] = (
+                segment, offset, float(record.get('X-Downpour-Elapsed', 0)))
+        logger.info('Indexed %i recorded responses' % len(self.records))
+    
+    def urls(self):
+        '''The urls that have recorded responses'''
+        return self.records.keys()
+    
+    def delay(self, elapsed):
+        '''How long to wait before replaying a response that took `elapsed`
+        seconds when it was recorded'''
+        if self.latency is None:
+            delay = elapsed
+        elif callable(self.latency):
+            delay = self.latency()
+        else:
+            delay = self.latency
+        return max(delay, 0) / self.speedup
+    
+    def connect(self, factory):
+        where = self.records.get(factory.request.url)
+        reactor.callLater(self.delay(where[2] if where else 0), self.replay, factory, where)
+    
+    def replay(self, factory, where):
+        '''Read the recorded response, and feed it through the request's
+        servicer'''
+        try:
+            record = Archive.readAt(*where[:2]) if where else None
+            self.deliver(factory, record)
+        except Exception:
+            logger.exception('Failed to replay %s' % factory.request.url)
+            factory.noPage(Failure())
+        finally:
+            # The servicer holds its result until its connection is closed,
+            # and there's no connection here, so we have to say so ourselves
+            if not factory._disconnectedDeferred.called:
+                factory._disconnectedDeferred.callback(None)
+    
+    def deliver(self, factory, record):
+        if not record:
+            factory.noPage(Failure(ReplayError('No recording of %s' % factory.request.url)))
+            return
+        url = record['WARC-Target-URI']
+        if url != factory.url:
+            factory.setURL(url)
+        if not record['status']:
+            factory.noPage(Failure(ReplayError(record.get('X-Downpour-Failure', 'Failed'))))
+            return
+        version, status, message = (record['status'] + (None, None, None))[:3]
+        factory.gotStatus(version, status, message)
+        factory.gotHeaders(record['headers'])
+        # The request may well have been cancelled in one of those
+        if not factory.waiting:
+            return
+        if status.startswith('2'):
+            factory.page(record['body'])
+        else:
+            factory.noPage(Failure(error.Error(status, message, record['body'])))
@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+'''Check urls against robots.txt rules that have already been fetched'''
+
+import time
+import reppy
+import urllib
+import urlparse
+import collections
+
+class Matcher(object):
+    '''The rules of one site's robots.txt that apply to one user agent,
+    compiled for checking many urls against. Rules are tried in order of
+    precedence (the longest first, and allows before disallows of the same
+    length), so the first to match decides, and there's no more lookup of
+    the site or the agent for each url.'''
+    def __init__(self, robot, agent, until=None):
+        self.robot = robot
+        self.agent = agent
+        self.until = until
+        rules = getattr(robot.findAgent(agent), 'allowances', None)
+        if rules is None:
+            # This reppy doesn't expose its rules, and so it has to decide
+            self.rules = None
+        else:
+            self.rules = [(pattern.match, allow) for length, pattern, allow in
+                sorted(rules, key=lambda rule: (-rule[0], not rule[2]))]
+
+    def expired(self, now=None):
+        if self.until is None:
+            return self.robot.expired
+        return (now or time.time()) > self.until
+
+    def __call__(self, url):
+        '''Whether or not `url` may be fetched'''
+        if self.rules is None:
+            return self.robot.allowed(url, self.agent)
+        parsed = urlparse.urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        if path == '/robots.txt':
+            return True
+        path = urllib.unquote(path.replace('%2f', '%252f'))
+        for match, allow in self.rules:
+            if match(path):
+                return allow
+        return True
+
+class Matchers(object):
+    '''A bounded cache of compiled matchers, by site (host and port). The
+    least recently used are forgotten first. Sites whose robots.txt hasn't
+    been fetched (or has expired) don't have one.'''
+    def __init__(self, agent, size=10000):
+        self.agent    = agent
+        self.size     = size
+        self.matchers = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.matchers)
+
+    def get(self, netloc):
+        now = time.time()
+        matcher = self.matchers.pop(netloc, None)
+        if matcher is None or matcher.expired(now):
+            matcher = self.compile(netloc, now)
+            if matcher is None:
+                return None
+        if len(self.matchers) >= self.size:
+            self.matchers.popitem(last=False)
+        self.matchers[netloc] = matcher
+        return matcher
+
+    def compile(self, netloc, now):
+        robot = reppy.findRobot('http://' + netloc)
+        if not robot or robot.expired:
+            return None
+        remaining = getattr(robot, 'remaining', None)
+        return Matcher(robot, self.agent, None if remaining is None else now + remaining)
+
+    def allowed(self, url):
+        '''Whether `url` may be fetched, or None if we don't know yet'''
+        matcher = self.get(urlparse.urlparse(url).netloc)
+        return None if matcher is None else matcher(url)
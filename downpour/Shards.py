@@ -0,0 +1,155 @@
+#! /usr/bin/env python
+#
+# Copyright (c) 2011 SEOmoz
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+'''Spread the frontier over several redis instances'''
+
+import qr
+import redis
+from downpour import Pickled
+import bisect
+import hashlib
+
+class Shard(object):
+    '''A single redis instance in the frontier. The keyword arguments are
+    those for `redis.Redis` (and qr), and it's known by `name`, which
+    defaults to its host, port and database. It's the name, and not the
+    order in which shards are listed, that decides which domains it holds.'''
+    def __init__(self, name=None, **kwargs):
+        self.kwargs = kwargs
+        self.name   = name or '%s:%s/%s' % (
+            kwargs.get('unix_socket_path') or kwargs.get('host', 'localhost'),
+            kwargs.get('port', 6379), kwargs.get('db', 0))
+        self.r      = redis.Redis(**kwargs)
+
+    def __repr__(self):
+        return '<Shard %s>' % self.name
+
+class Shards(object):
+    '''A consistent-hashing ring of shards. Each shard is placed on the ring
+    at `replicas` points, and each key belongs to the shard at the next
+    point round from its own hash. Adding a shard then only moves about
+    1 / N of the keys, all of them to the new shard.'''
+    replicas  = 128
+    # How many keys' shards to remember
+    cacheSize = 100000
+
+    def __init__(self, configs):
+        self.shards = []
+        self.points = []
+        self.owners = []
+        self.cache  = {}
+        for config in configs:
+            self.add(**config)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def __getitem__(self, index):
+        return self.shards[index]
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def add(self, name=None, **kwargs):
+        '''Add a shard to the ring, and return it. Whatever's already on the
+        other shards has to be `rebalance`d to be found again.'''
+        shard = Shard(name, **kwargs)
+        if any(s.name == shard.name for s in self.shards):
+            raise ValueError('Shard %s was given twice' % shard.name)
+        self.shards.append(shard)
+        for i in range(self.replicas):
+            point = self.hash('%s#%i' % (shard.name, i))
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, shard)
+        self.cache.clear()
+        return shard
+
+    def find(self, key):
+        '''The shard that `key` belongs to'''
+        if len(self.shards) == 1:
+            return self.shards[0]
+        try:
+            return self.cache[key]
+        except KeyError:
+            if len(self.cache) >= self.cacheSize:
+                self.cache.clear()
+            index = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+            shard = self.cache[key] = self.owners[index]
+            return shard
+
+class ShardedQueue(object):
+    '''A qr priority queue with a part on each shard, where each value is
+    kept on the shard that it belongs to. Peeking and popping look at the
+    heads of all the parts, and take whichever comes first. That's a round
+    trip to every shard for each peek (and for `len`), since the heads can't
+    be known without asking, so callers that look at several queues at once
+    are better off pipelining them on each shard themselves.'''
+    def __init__(self, key, shards):
+        self.key    = key
+        self.shards = shards
+        self.parts  = {}
+        # The part that the last peek found the head in
+        self.last   = None
+
+    def __len__(self):
+        return sum(len(self.part(shard)) for shard in self.shards)
+
+    def part(self, shard):
+        '''This queue's part on a shard'''
+        try:
+            return self.parts[shard.name]
+        except KeyError:
+            part = self.parts[shard.name] = Pickled.queue(qr.PriorityQueue, self.key, **shard.kwargs)
+            return part
+
+    def push(self, value, score):
+        return self.part(self.shards.find(value)).push(value, score)
+
+    def pushTo(self, shard, value, score):
+        '''Push onto a particular shard, rather than the one it belongs to'''
+        return self.part(shard).push(value, score)
+
+    def peek(self, withscores=False):
+        self.last = None
+        best, when = None, None
+        for shard in self.shards:
+            part = self.part(shard)
+            value, score = part.peek(withscores=True)
+            if value and (when is None or score < when):
+                best, when, self.last = value, score, part
+        return (best, when) if withscores else best
+
+    def pop(self):
+        '''Pop the head that was last peeked at or, if we haven't just
+        peeked, whichever head comes first now'''
+        if self.last is None:
+            self.peek()
+        part, self.last = self.last, None
+        return part.pop() if part else None
@@ -47,14 +47,20 @@ import os
 import re
 import time
 import reppy
+import heapq
 import base64
+import hashlib
 import urlparse
+import itertools
 import threading
+import collections
 import cPickle as pickle
 from twisted import internet
-from twisted.python import log
+from twisted.python import log, threadable
 from twisted.web import http, client, error
-from twisted.internet import reactor, ssl
+from twisted.internet import reactor, ssl, threads, defer
+from twisted.internet.error import TimeoutError as ConnectTimeoutError
+from twisted.python.threadpool import ThreadPool
 from twisted.python.failure import Failure
 
 # Logging
@@ -98,15 +104,32 @@ class Auth(object):
     # The purpose of this class is to manage HTTP Authentication user/pass
     # pairs, and to generate request headers associated with HTTP Auth
     _auths = {}
+    # Keys for the hosts we've been given, so that we don't have to parse
+    # them again on every lookup. We're given whole urls, too, so only the
+    # `_keysSize` most recently used are kept.
+    _keys = collections.OrderedDict()
+    _keysSize = 10000
+    # The most recent challenge we've seen from each host, as a tuple of
+    # the method and realm, so that we know what to send preemptively
+    _realms = {}
+    # The digest parameters (nonce, nonce count, etc.) for each host/realm
+    _nonces = {}
+    # For parsing the parameters of a challenge, some of which are quoted
+    _params = re.compile(r'([\w-]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^,\s]*)')
 
     @staticmethod
     def _makeKey(host, realm=None):
         # Given a host, realm, generate the key to store this under
-        _scheme, _host, _port, _path = parse(host)
-        if _host == '':
-            _scheme, _host, _port, _path = parse('http://' + host)
-        if _port:
-            _host = '%s:%s' % (_host, _port)
+        _host = Auth._keys.pop(host, None)
+        if _host is None:
+            _scheme, _host, _port, _path = parse(host)
+            if _host == '':
+                _scheme, _host, _port, _path = parse('http://' + host)
+            if _port:
+                _host = '%s:%s' % (_host, _port)
+            while len(Auth._keys) >= Auth._keysSize:
+                Auth._keys.popitem(last=False)
+        Auth._keys[host] = _host
         if realm:
             return '%s:%s' % (_host, realm)
         return _host
@@ -128,37 +151,92 @@ class Auth(object):
         # This gets the user/pass pair for the provided host/realm combination
         # If we can't find one for the specific realm, then we look for any
         # default user/pass pair registered for the host
-        pair = Auth._auths.get(Auth._makeKey(host, realm), (None, None))
+        return Auth._lookup(Auth._makeKey(host), realm)
+
+    @staticmethod
+    def _lookup(key, realm=None):
+        # The same as `get`, but with a host key that's already been made
+        pair = (realm and Auth._auths.get('%s:%s' % (key, realm))) or (None, None)
         if not pair[0]:
-            pair = Auth._auths.get(Auth._makeKey(host, None), (None, None))
+            pair = Auth._auths.get(key, (None, None))
         return pair
 
     @staticmethod
-    def auth(host, request, headers):
-        # First, determine what kind of authentication has to happen
+    def preempt(host, port, method='GET', uri='/'):
+        # Get the Authorization header to send with a request to this host
+        # and port before it's asked for one, if we have credentials for it.
+        # If the host has challenged us for Digest auth before, we'll use
+        # the nonce it gave us. Otherwise, it gets Basic auth.
+        if not Auth._auths:
+            return None
+        key = '%s:%s' % (host, port)
+        scheme, realm = Auth._realms.get(key, ('basic', None))
+        user, password = Auth._lookup(key, realm)
+        if not (user and password):
+            return None
+        if scheme == 'digest':
+            return Auth._digest(key, realm, user, password, method, uri)
+        return Auth._basic(user, password)
+
+    @staticmethod
+    def challenge(host, headers):
+        # Parse the challenge in these response headers, if any, and make
+        # note of it for subsequent requests to this host. Returns the name
+        # of the header to respond with, the method and the parameters
         auth = headers.get('proxy-authenticate', [None])[0]
         if auth:
             # And save the request header name
             authname = 'Proxy-Authorization'
         else:
-            auth = headers.get('authenticate', [None])[0]
+            auth = (headers.get('www-authenticate') or headers.get('authenticate') or [None])[0]
             if auth:
                 # And save the request header name
                 authname = 'Authorization'
             else:
-                return {}
+                return None, None, {}
 
         # With all of that determine, we can do the source-agnostic work
-        chunks = auth.split(' ')
-        method = chunks.pop(0)
-        params = [r.strip().partition('=') for r in chunks]
-        params = dict((r[0], r[2].strip('"')) for r in params)
+        method, sep, rest = auth.strip().partition(' ')
+        method = method.lower()
+        params = dict((k.lower(), v.strip('"')) for k, v in Auth._params.findall(rest))
+        key = Auth._makeKey(host)
+        if authname == 'Authorization' and method in ('basic', 'digest'):
+            Auth._realms[key] = (method, params.get('realm', None))
+        if method == 'digest':
+            Auth._remember(key, params)
+        return authname, method, params
+
+    @staticmethod
+    def _remember(key, params):
+        # Keep a digest challenge's nonce around, resetting its count
+        Auth._nonces['%s:%s' % (key, params.get('realm', None))] = {
+            'nonce'    : params.get('nonce', ''),
+            'opaque'   : params.get('opaque', None),
+            'algorithm': params.get('algorithm', 'MD5'),
+            'qop'      : Auth._qop(params.get('qop', None)),
+            'count'    : 0
+        }
+
+    @staticmethod
+    def _qop(offered):
+        # The quality of protection to sign with, of those offered. We only
+        # sign the request line, and not the body, so it has to be 'auth'
+        if not offered:
+            return None
+        if 'auth' in [q.strip().lower() for q in offered.split(',')]:
+            return 'auth'
+        raise AuthException('Unsupported Digest qop: %s' % offered)
+
+    @staticmethod
+    def auth(host, request, headers):
+        authname, method, params = Auth.challenge(host, headers)
+        if not authname:
+            return {}
 
-        if method.lower() == 'basic':
+        if method == 'basic':
             signature = Auth.basicAuth(params, host, request, headers)
-        elif method.lower() == 'digest':
-            # signature = Auth.digestAuth(params, host, request, headers)
-            raise AuthException('Unsupported Auth method: Digest')
+        elif method == 'digest':
+            signature = Auth.digestAuth(params, host, request, headers)
         else:
             raise AuthException('Unsupported Auth method: %s' % method)
 
@@ -171,15 +249,66 @@ class Auth(object):
     def basicAuth(params, host, request, headers):
         auth = Auth.get(host, params.get('realm', None))
         if auth[0] and auth[1]:
-            raw  = '%s:%s' % auth
-            auth = 'Basic %s' % base64.b64encode(raw).strip()
-            return auth
+            return Auth._basic(*auth)
         else:
             return None
 
+    @staticmethod
+    def _basic(user, password):
+        raw = '%s:%s' % (user, password)
+        return 'Basic %s' % base64.b64encode(raw).strip()
+
     @staticmethod
     def digestAuth(params, host, request, headers):
-        return {}
+        realm = params.get('realm', None)
+        user, password = Auth.get(host, realm)
+        if not (user and password):
+            return None
+        key = Auth._makeKey(host)
+        if '%s:%s' % (key, realm) not in Auth._nonces:
+            # This is only the case if we weren't given the challenge
+            Auth._remember(key, params)
+        # The method and uri we sign are those of the request
+        method, uri = 'GET', '/'
+        if request:
+            method = getattr(request, 'method', None) or 'GET'
+            parsed = urlparse.urlparse(request.url)
+            uri = parsed.path or '/'
+            if parsed.query:
+                uri += '?' + parsed.query
+        return Auth._digest(key, realm, user, password, method, uri)
+
+    @staticmethod
+    def _cnonce():
+        return os.urandom(8).encode('hex')
+
+    @staticmethod
+    def _digest(key, realm, user, password, method, uri):
+        # Sign a request per RFC 2617, using the nonce we have for this
+        # host and realm, and bumping its nonce count
+        params = Auth._nonces.get('%s:%s' % (key, realm))
+        if not params:
+            return None
+        md5 = lambda s: hashlib.md5(s).hexdigest()
+        params['count'] += 1
+        nc     = '%08x' % params['count']
+        cnonce = Auth._cnonce()
+        ha1 = md5('%s:%s:%s' % (user, realm, password))
+        if params['algorithm'].lower() == 'md5-sess':
+            ha1 = md5('%s:%s:%s' % (ha1, params['nonce'], cnonce))
+        ha2 = md5('%s:%s' % (method, uri))
+        qop = params['qop']
+        if qop:
+            response = md5(':'.join((ha1, params['nonce'], nc, cnonce, qop, ha2)))
+        else:
+            response = md5(':'.join((ha1, params['nonce'], ha2)))
+        auth = 'Digest username="%s", realm="%s", nonce="%s", uri="%s", response="%s", algorithm=%s' % (
+            user, realm, params['nonce'], uri, response, params['algorithm'])
+        if params['opaque'] is not None:
+            auth += ', opaque="%s"' % params['opaque']
+        if qop:
+            auth += ', qop=%s, nc=%s, cnonce="%s"' % (qop, nc, cnonce)
+        return auth
 
 class UserPreemptionError(error.Error):
     '''The exception raised when a user cancels a request'''
@@ -193,18 +322,56 @@ class UserPreemptionError(error.Error):
     def __str__(self):
         return repr(self)
 
+class PhaseTimeout(defer.TimeoutError):
+    '''The exception used when one phase of a request takes too long. The
+    `phase` is one of 'connect', 'first-byte', 'idle', 'rate' or 'total'.'''
+    def __init__(self, phase, message):
+        defer.TimeoutError.__init__(self, message)
+        self.phase = phase
+
+class RequestGetter(client.HTTPPageGetter):
+    '''Tells the servicer as data arrives, so that it can tell whether or not
+    the transfer has stalled.'''
+    def dataReceived(self, data):
+        self.factory.gotData(len(data))
+        client.HTTPPageGetter.dataReceived(self, data)
+
+    # A permanent redirect that keeps the method and body, like a 301 does
+    handleStatus_308 = client.HTTPPageGetter.handleStatus_301
+
 class BaseRequestServicer(client.HTTPClientFactory):
     '''This class services requests, providing the request with
     additional callbacks beyond those typically provided. For
     example, it's by way of this class that `onHeaders`, `onURL`,
     and `onStatus` are supported.'''
-    def __init__(self, request, agent):
-        '''Provide the request to service, and the user agent to identify with.'''
+    def __init__(self, request, agent, fetcher=None, proxy=None):
+        '''Provide the request to service, the user agent to identify with,
+        and optionally the fetcher whose abort rules should be applied, and
+        a proxy from the fetcher's pool to route it through.'''
+        self.fetcher          = fetcher
+        self.pooled           = proxy
+        # Whether we added an Authorization header of our own accord
+        self.preempted        = False
         self.request          = request
         self.request.cached   = True
         self.request.time     = -time.time()
         self.request.encoding = None
-        client.HTTPClientFactory.__init__(self, url=request.url, agent=agent, headers=request.headers, timeout=request.timeout,
+        # When the request was started, when we last connected, when the
+        # first byte since then arrived and the last one did, and how many
+        # bytes have arrived in the current window for `minRate`
+        self.begun        = None
+        self.connectedAt  = None
+        self.firstByte    = None
+        self.lastRead     = None
+        self.windowStart  = None
+        self.windowBytes  = 0
+        # How many bytes of the response have arrived in all, and when the
+        # fetcher paused reading it to save memory, if it has
+        self.received     = 0
+        self.pausedAt     = None
+        # The request's timeouts are all enforced by our watchdog, rather
+        # than by HTTPClientFactory
+        client.HTTPClientFactory.__init__(self, url=request.url, agent=agent, headers=request.headers, timeout=0,
             followRedirect=request.followRedirect, redirectLimit=request.redirectLimit, postdata=self.request.data)
 
     def setURL(self, url):
@@ -215,6 +382,10 @@ class BaseRequestServicer(client.HTTPClientFactory):
         as the argument to the request callback.'''
         # Especially on redirects, the url can lack a domain name
         url = urlparse.urljoin(self.request.url, url)
+        # If this is a permanent redirect, later requests can skip it
+        status = getattr(self, 'status', None)
+        if status and self.fetcher and self.fetcher.redirects is not None:
+            self.fetcher.redirects.record(self.url, url, status)
         try:
             self.request.onURL(url)
         except UserPreemptionError as e:
@@ -222,9 +393,13 @@ class BaseRequestServicer(client.HTTPClientFactory):
         except:
             logger.exception('%s onURL failed' % self.request.url)
         scheme, host, port, path = parse(url)
-        self.proxy = os.environ.get('%s_proxy' % scheme) or self.request.proxy
-        # If a proxy is specified in the environment, or for this
-        # particular request, service it with that proxy
+        target = (host, port)
+        if self.pooled:
+            self.proxy = self.pooled.url
+        else:
+            self.proxy = os.environ.get('%s_proxy' % scheme) or self.request.proxy
+        # If a proxy is specified in the environment, for this particular
+        # request, or from the pool, service it with that proxy
         if self.proxy:
             scheme, host, port, path = parse(self.proxy)
             self.scheme = scheme
@@ -247,15 +422,43 @@ class BaseRequestServicer(client.HTTPClientFactory):
                 # if it decides to be stupid, then we'll try to encode the
                 # url as utf-8
                 client.HTTPClientFactory.setURL(self, url.encode('utf-8'))
+        self.preempt(target[0], target[1], self.path)
         logger.debug('URL: %s' % self.url)
 
+    def preempt(self, host, port, path):
+        '''Send credentials with the request for this host, if we have some,
+        rather than waiting to be challenged for them. Any we sent to the
+        host we're being redirected from are removed.'''
+        if self.preempted:
+            del self.headers['Authorization']
+            self.preempted = False
+        if self.headers.get('Authorization') is not None:
+            return
+        auth = Auth.preempt(host, port, self.method, path)
+        if auth:
+            self.headers['Authorization'] = auth
+            self.preempted = True
+
     def gotHeaders(self, headers):
         '''Received headers, a dictionary of lists.'''
+        # Before anything else, see if the fetcher would rather we not
+        # bother reading the body of this response at all
+        reason = self.fetcher and self.fetcher.screen(self.status, headers)
+        if reason:
+            self.cancel(UserPreemptionError('Aborted by %s rule' % reason))
+            return
         try:
             # This request is marked as cached iff every request was served out
             # of the cache specified, and it was a hit.
             cached = self.proxy and ('HIT from %s' % self.host) in ';'.join(headers.get('x-cache', ''))
             self.request.cached = self.request.cached and cached
+            # If we've been challenged for credentials, make note of it so
+            # that subsequent requests to this host can be preemptive
+            if self.status == '401':
+                try:
+                    Auth.challenge(self.url, headers)
+                except Exception:
+                    logger.exception('%s challenge unparseable' % self.url)
             # Set the request's encoding, if applicable
             self.request.encoding = ';'.join(headers.get('content-encoding', ['identity']))
             self.request.onHeaders(headers)
@@ -283,47 +486,234 @@ class BaseRequestServicer(client.HTTPClientFactory):
             logger.exception('%s onStatus failed' % self.request.url)
         client.HTTPClientFactory.gotStatus(self, version, status, message)
 
+    # The protocol, once we've connected
+    p = None
+    protocol = RequestGetter
+
     def buildProtocol(self, *args, **kwargs):
         '''In order to facilitate user preemption, we need to remember
         the protocol we made. So, save it and pass through.'''
         self.p = client.HTTPClientFactory.buildProtocol(self, *args, **kwargs)
+        self.connected()
         return self.p
 
+    def connect(self, contextFactory):
+        '''Start the transfer. If a proxy is being used, the host and port
+        are those of the proxy.'''
+        self.watch()
+        timeout = self.request.connectTimeout or 30
+        if self.scheme == 'https':
+            reactor.connectSSL(self.host, self.port or 443, self, contextFactory, timeout=timeout)
+        else:
+            reactor.connectTCP(self.host, self.port or 80, self, timeout=timeout)
+
+    def clientConnectionFailed(self, connector, reason):
+        if reason.check(ConnectTimeoutError):
+            reason = self.timedOut('connect')
+        client.HTTPClientFactory.clientConnectionFailed(self, connector, reason)
+
+    def page(self, page):
+        self.disarm()
+        if self.fetcher:
+            self.fetcher._transferred(self)
+        client.HTTPClientFactory.page(self, page)
+
+    def noPage(self, reason):
+        self.disarm()
+        if self.fetcher:
+            self.fetcher._transferred(self)
+        client.HTTPClientFactory.noPage(self, reason)
+
+    # The fetcher can pause reading the response to keep its memory in
+    # check. While it's paused, the request can't be idle or slow, and its
+    # `idleTimeout` and `minRate` start afresh when it's resumed.
+    def stream(self):
+        '''The transport the response is being read from, if any'''
+        return self.p and self.p.transport
+
+    def pause(self):
+        transport = self.stream()
+        if transport and self.pausedAt is None:
+            transport.pauseProducing()
+            self.pausedAt = time.time()
+
+    def resume(self):
+        '''Resume reading. Returns how long we were paused for.'''
+        if self.pausedAt is None:
+            return 0
+        now = time.time()
+        paused, self.pausedAt = now - self.pausedAt, None
+        self.lastRead = self.windowStart = now
+        self.windowBytes = 0
+        transport = self.stream()
+        if transport and self.waiting:
+            transport.resumeProducing()
+            self.arm()
+        return paused
+
+    # Our watchdog enforces the request's timeouts. The request's `timeout`
+    # covers the whole transfer, `connectTimeout` just the connection, and
+    # `firstByteTimeout` the wait for a response once connected. After that,
+    # `idleTimeout` limits any pause between reads, and if there's a
+    # `minRate`, at least that many bytes a second have to arrive in each
+    # window of `minRateWindow` seconds. Rather than being rescheduled on
+    # every read, the watchdog wakes up at the earliest deadline and works
+    # out whether it has really passed.
+    watchdog = None
+
+    def watch(self):
+        '''The transfer is starting'''
+        self.begun = time.time()
+        self.arm()
+
+    def connected(self):
+        '''We've (re)connected, and are waiting on a response'''
+        self.connectedAt = time.time()
+        self.firstByte   = None
+        self.windowBytes = 0
+        self.arm()
+
+    def gotData(self, length):
+        now = time.time()
+        if self.firstByte is None:
+            self.firstByte = self.windowStart = now
+        self.lastRead     = now
+        self.windowBytes += length
+        self.received    += length
+        if self.fetcher:
+            self.fetcher._buffer(self, length)
+
+    def deadlines(self):
+        '''The times at which each phase would run out of time'''
+        r = self.request
+        checks = []
+        if r.timeout:
+            checks.append((self.begun + r.timeout, 'total'))
+        if self.connectedAt is not None:
+            if self.firstByte is None:
+                if r.firstByteTimeout:
+                    checks.append((self.connectedAt + r.firstByteTimeout, 'first-byte'))
+            elif self.pausedAt is None:
+                if r.idleTimeout:
+                    checks.append((self.lastRead + r.idleTimeout, 'idle'))
+                if r.minRate:
+                    checks.append((self.windowStart + r.minRateWindow, 'rate'))
+        return sorted(checks)
+
+    def arm(self):
+        self.disarm()
+        checks = self.deadlines()
+        if checks and self.waiting:
+            self.watchdog = reactor.callLater(max(checks[0][0] - time.time(), 0), self.check)
+
+    def disarm(self):
+        if self.watchdog and self.watchdog.active():
+            self.watchdog.cancel()
+        self.watchdog = None
+
+    def check(self):
+        self.watchdog = None
+        if not self.waiting:
+            return
+        now = time.time()
+        for when, phase in self.deadlines():
+            if when > now:
+                break
+            if phase == 'rate':
+                if self.windowBytes >= self.request.minRate * (now - self.windowStart):
+                    # Fast enough. On to the next window
+                    self.windowStart, self.windowBytes = now, 0
+                    continue
+            self.cancel(self.timedOut(phase).value)
+            return
+        self.arm()
+
+    def timedOut(self, phase):
+        '''Count a timeout, and make the failure for it'''
+        if self.fetcher:
+            self.fetcher.timeouts[phase] += 1
+        return Failure(PhaseTimeout(phase, 'Getting %s exceeded its %s timeout' % (self.url, phase)))
+
     def cancel(self, err):
         '''If the user needs to preempt the transfer. For example, if looking
         at the content headers, we decide we don't want to get the file.'''
         self.noPage(Failure(err))
-        self.p.quietLoss = True
-        self.p.transport.loseConnection()
+        # We may not have even connected yet
+        if self.p:
+            self.p.quietLoss = True
+            self.p.transport.loseConnection()
 
 class BaseRequest(object):
-    time           = 0
-    proxy          = None
-    timeout        = 45
-    # Any headers that should be sent with the request
-    headers        = {}
-    redirectLimit  = 10
-    followRedirect = 1
-    cached         = False
-    encoding       = 'identity'
-    
-    def __init__(self, url, data=None, proxy=None, headers=None):
+    # Requests are kept compact, since there can be millions of them queued
+    # at once. Subclasses get a __dict__ for any fields of their own unless
+    # they declare __slots__ for them, too. Any of these that haven't been
+    # set for a particular request take their value from `_defaults`, and
+    # subclasses can still override them with class attributes.
+    __slots__ = ('url', 'data', 'time', 'proxy', 'timeout', 'headers',
+        'redirectLimit', 'followRedirect', 'cached', 'encoding', 'priority',
+        'connectTimeout', 'firstByteTimeout', 'idleTimeout', 'minRate',
+        'minRateWindow', 'job', '_originalKey', '_leaseId', '_bridgeId')
+    _defaults = {
+        'time'          : 0,
+        'proxy'         : None,
+        # Timeouts, in seconds. The `timeout` covers the whole transfer, and
+        # the others each cover one phase of it. See BaseRequestServicer
+        'timeout'       : 45,
+        'connectTimeout': 30,
+        'firstByteTimeout': None,
+        'idleTimeout'   : None,
+        # If set, the slowest transfer rate (in bytes a second) to tolerate,
+        # averaged over windows of `minRateWindow` seconds
+        'minRate'       : None,
+        'minRateWindow' : 5,
+        # Any headers that should be sent with the request
+        'headers'       : {},
+        'redirectLimit' : 10,
+        'followRedirect': 1,
+        'cached'        : False,
+        'encoding'      : 'identity',
+        # Requests with a higher priority are serviced first. Priorities
+        # are relative, and may be negative for bulk work
+        'priority'      : 0,
+        # The job this request belongs to, for fetchers that are shared
+        # between jobs. None is the default job
+        'job'           : None
+    }
+
+    def __init__(self, url, data=None, proxy=None, headers=None, priority=None, job=None):
         self.url, fragment = urlparse.urldefrag(url)
         self.data = data
         if proxy:
             self.proxy = proxy
         if headers:
             self.headers = headers
+        if priority:
+            self.priority = priority
+        if job:
+            self.job = job
 
-    def __del__(self):
-        # For a brief while, I was having problems with memory leaks, and so
-        # I was printing this out in order to help make sure that requests
-        # were getting freed. It has been a long time since that ugly day, but
-        # this will stay as a reminder. FWIW, Python's garbage collection is
-        # based on reference counting, which cannot detect leaks in the form
-        # of isolated cliques with no external references (circular reference)
-        # logger.debug('Deleting request for %s' % self.url)
-        pass
+    def __getattr__(self, name):
+        # Only invoked for attributes that haven't been set
+        try:
+            return self._defaults[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    # Objects with __slots__ need help to be pickled, which is how they're
+    # stored in redis by the PoliteFetcher
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                try:
+                    state.setdefault(name, cls.__dict__[name].__get__(self, cls))
+                except (AttributeError, KeyError):
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
 
     def cancel(self, reason):
         '''If for any reason, you discover you don't want to fetch
@@ -378,6 +768,9 @@ class BaseRequest(object):
                 import zlib
                 logger.info('Decompressing deflate-encoded content')
                 response = zlib.decompress(response)
+            if self.encoding in ('gzip', 'x-gzip', 'zlib', 'deflate'):
+                # The decompressed body counts against the memory budget
+                fetcher._decoded(self, len(response))
             self.onSuccess(response, fetcher)
         except Exception as e:
             logger.exception('Request success handler failed')
@@ -397,6 +790,8 @@ class BaseRequest(object):
         return Failure(self)
 
 class RobotsRequest(BaseRequest):
+    __slots__ = ('status', 'ttl')
+
     def __init__(self, url, *args, **kwargs):
         BaseRequest.__init__(self, url, *args, **kwargs)
         self.status = 200
@@ -419,23 +814,141 @@ class RobotsRequest(BaseRequest):
     def onError(self, *args, **kwargs):
         reppy.parse('', url=self.url, autorefresh=False, ttl=self.ttl)
 
+class Pickled(object):
+    '''How requests (and everything else) are serialized in redis. It's made
+    the `serializer` of every qr queue, with `queue`, and used directly for
+    whatever is written in bulk, so that the two always agree, byte for
+    byte. Whatever protocol qr asks for is ignored for the same reason.'''
+    @staticmethod
+    def dumps(obj, *args):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(value):
+        return pickle.loads(value)
+
+    @classmethod
+    def queue(cls, kind, key, **kwargs):
+        '''A qr queue of this `kind` that uses us. qr doesn't take a serializer
+        as an argument, but each queue keeps the one it uses as `serializer`'''
+        q = kind(key, **kwargs)
+        q.serializer = cls
+        return q
+
 class BaseFetcher(object):
-    def __init__(self, poolSize=10, agent=None, stopWhenDone=False, grow=5.0):
+    # The number of seconds a request has to wait in order to be worth
+    # one more level of priority. This keeps low-priority requests from
+    # being starved forever by a steady stream of urgent ones.
+    aging = 60.0
+    # Rules for abandoning a response as soon as its headers arrive, before
+    # any of its body is read. If provided, `contentTypes` is a list of
+    # patterns, one of which the content-type must match, `maxLength` is
+    # the largest content-length to accept, and `abortStatuses` is a list
+    # of statuses ('404') or status classes ('5xx') to abandon.
+    contentTypes  = None
+    maxLength     = None
+    abortStatuses = None
+    # A ProxyPool to spread requests over. Requests that specify their own
+    # proxy still use it.
+    proxies       = None
+    # An Archive to record every response and failure to
+    archive       = None
+    # The class that services each request. AgentServicer is an alternative
+    # built on twisted's Agent, and it can also be chosen at construction
+    servicer      = BaseRequestServicer
+    # A LagMonitor to measure how late the reactor runs, and what's making
+    # it so. It's started along with the fetcher.
+    monitor       = None
+    # A Redirects cache. The permanent redirects that requests run into are
+    # remembered, and later requests go straight to where they lead.
+    redirects     = None
+    # A budget, in bytes, for the responses held in memory (decompressed,
+    # once they have been), from when they start to arrive until their
+    # requests are done with them. Once it's exceeded, no new requests are
+    # started, and only the smallest response is still read, so that one
+    # finishes and gives back its memory. That goes on until it's back down
+    # to `resumeBuffered` (by default, three quarters of the budget).
+    maxBuffered    = None
+    resumeBuffered = None
+    # If `onBatch` is overridden, requests that are done are handed to it
+    # in batches of `flushSize`, or whatever has been collected once the
+    # oldest has been waiting `flushAge` seconds, and whatever's left when
+    # the fetcher stops.
+    flushSize      = 100
+    flushAge       = 5.0
+
+    def __init__(self, poolSize=10, agent=None, stopWhenDone=False, grow=5.0,
+        readAhead=1000, processors=0, maxPending=None, servicer=None):
         self.sslContext = ssl.ClientContextFactory()
-        # The base fetcher keeps track of requests as a list
+        if servicer:
+            self.servicer = servicer
+        # The base fetcher keeps track of requests as a heap, ordered by
+        # their rank, and then by the order in which they arrived
         self.requests = []
+        self.sequence = itertools.count()
+        # Iterators that requests are lazily read from as slots open up,
+        # and the most requests we'll read ahead into our heap from them
+        self.sources   = collections.deque()
+        self.readAhead = max(readAhead, 1)
         # A limit on the number of requests that can be in flight
         # at the same time
         self.poolSize = poolSize
-        # Keeping tabs on counts. The lock is necessary to avoid
-        # contentious access to numFlight, processed, remaining.
+        # Keeping tabs on counts. These are only ever touched from the
+        # reactor thread, and so they need no lock.
         # numFlight => the number of requests currently active
         # processed => the number of requests completed
         # remaining => how many requests are left
-        self.lock = threading.RLock()
         self.numFlight = 0
         self.processed = 0
         self.remaining = 0
+        # Requests handed to us by other threads, waiting to be ingested on
+        # the reactor thread. The lock only guards whether or not we've
+        # already asked the reactor to ingest them.
+        self.incoming  = collections.deque()
+        self.ingesting = False
+        self.lock      = threading.Lock()
+        # How many responses have been aborted by each kind of rule, and how
+        # many requests have run out of time in each phase
+        self.aborts   = collections.defaultdict(int)
+        self.timeouts = collections.defaultdict(int)
+        # Used to wait for an ejected proxy to come back, and the requests
+        # that have been popped but are waiting on a proxy from the pool
+        self.proxyTimer = None
+        self.held       = collections.deque()
+        # Used to wait for the archive's writer to catch up
+        self.archiveTimer = None
+        # The bytes held in responses, and the most ever held. The servicers
+        # whose responses are still arriving are in `transfers`, and those
+        # that have been paused in `paused`. While we're over budget, then
+        # `throttled` is when that started, and `exempt` is the one response
+        # that's still read. The decompressed size of each request's response
+        # is in `decoded`, until the request is done.
+        self.buffered       = 0
+        self.bufferedPeak   = 0
+        self.transfers      = set()
+        self.paused         = set()
+        self.exempt         = None
+        self.decoded        = {}
+        self.pauses         = 0
+        self.pausedSeconds  = 0.0
+        self.throttled      = None
+        self.throttledSeconds = 0.0
+        # Requests that are done, waiting to be handed to `onBatch`
+        self.completed  = []
+        self.flushTimer = None
+        self.batching   = self.__class__.onBatch != BaseFetcher.onBatch
+        # If there are processors, then successful responses are handed to
+        # requests (decompressed, and `onSuccess` invoked) in a pool of that
+        # many threads, rather than on the reactor thread. If more than
+        # `maxPending` are waiting on the pool, we stop making new requests
+        # until it catches up.
+        self.pending    = 0
+        self.maxPending = maxPending or (processors * 2)
+        self.threadPool = None
+        if processors:
+            self.threadPool = ThreadPool(1, processors, 'downpour')
+            reactor.callWhenRunning(self.threadPool.start)
+            reactor.addSystemEventTrigger('during', 'shutdown', self.threadPool.stop)
         # Use this user agent when making requests
         self.agent = agent or 'rogerbot/1.0'
         self.stopWhenDone = stopWhenDone
@@ -444,38 +957,115 @@ class BaseFetcher(object):
         self.growLater = reactor.callLater(self.period, self.grow, self.poolSize)
 
     # This is how subclasses communicate how many requests they have
-    # left to fulfill.
+    # left to fulfill. While streaming, this only includes the requests
+    # that have been read so far.
     def __len__(self):
         return self.remaining
 
+    # Whether or not there are lazy sources that have yet to be exhausted.
+    # If so, the number of requests left to fulfill is unknown.
+    def streaming(self):
+        return bool(self.sources)
+
+    # This reads requests from our lazy sources until either the read-ahead
+    # buffer is full or the sources are exhausted. Returns how many requests
+    # were read.
+    def fill(self):
+        count = 0
+        while self.sources and len(self.requests) < self.readAhead:
+            try:
+                request = next(self.sources[0])
+            except StopIteration:
+                self.sources.popleft()
+                continue
+            except Exception:
+                logger.exception('Failed to read from source. Abandoning it.')
+                self.sources.popleft()
+                continue
+            heapq.heappush(self.requests,
+                (self.rank(request), next(self.sequence), request))
+            count += 1
+        self.remaining += count
+        return count
+
     # This is how we get the next request to service. Return None if there
     # is no next request to service. That doesn't have to mean that it's done
     def pop(self):
+        if self.sources:
+            self.fill()
         try:
-            return self.requests.pop()
+            return heapq.heappop(self.requests)[2]
         except IndexError:
             return None
 
+    # This is how requests are ordered. Lower ranks are serviced first. A
+    # request's rank is the time it was enqueued, less its priority worth
+    # of aging, so a request that has waited `aging` seconds is on par with
+    # a fresh request one priority level higher.
+    def rank(self, request):
+        return time.time() - (request.priority * self.aging)
+
     # This is how to fetch another request
     def push(self, request):
-        self.requests.append(request)
+        heapq.heappush(self.requests,
+            (self.rank(request), next(self.sequence), request))
         self.serveNext()
-        with self.lock:
-            self.remaining += 1
+        self.remaining += 1
         return 1
 
-    # This is how to fetch several more requests
+    # This is how to fetch several more requests. If `requests` is an
+    # iterator or generator rather than a list, it's consumed lazily, only
+    # as slots open up, and we return None as we can't know how many
+    # requests it will yield.
     def extend(self, requests):
-        self.requests.extend(requests)
+        if not hasattr(requests, '__len__'):
+            self.sources.append(iter(requests))
+            self.serveNext()
+            return None
+        for request in requests:
+            heapq.heappush(self.requests,
+                (self.rank(request), next(self.sequence), request))
         self.serveNext()
-        with self.lock:
-            self.remaining += len(requests)
+        self.remaining += len(requests)
         return len(requests)
 
+    # Everything else here happens on the reactor thread, so other threads
+    # mustn't call `push` or `extend`. Instead, they can hand requests over
+    # with these, and the reactor will ingest them in batches of up to
+    # `readAhead`. Requests are ingested in the order they were handed over.
+    def pushFromThread(self, request):
+        self.extendFromThread((request,))
+
+    def extendFromThread(self, requests):
+        self.incoming.extend(requests)
+        self._ingestSoon(reactor.callFromThread)
+
+    # Ask the reactor to ingest, unless we already have
+    def _ingestSoon(self, call):
+        with self.lock:
+            if self.ingesting:
+                return
+            self.ingesting = True
+        call(self.ingest)
+
+    # Move a batch of requests handed over by other threads into the queue.
+    # If there are more than that, the rest wait for the next reactor turn
+    # so that we don't hold up everything else.
+    def ingest(self):
+        with self.lock:
+            self.ingesting = False
+        batch = []
+        while self.incoming and len(batch) < self.readAhead:
+            batch.append(self.incoming.popleft())
+        if self.incoming:
+            self._ingestSoon(lambda f: reactor.callLater(0, f))
+        if batch:
+            self.extend(batch)
+        return len(batch)
+
     def idle(self):
         '''Returns whether or not this fetcher can handle more work'''
-        with self.lock:
-            return self.numFlight < self.poolSize
+        return self.numFlight < self.poolSize
 
     # This is a way for the fetcher to let you know that it is capable of
     # handling more requests than are currently enqueued. Returns how much
@@ -494,12 +1084,36 @@ class BaseFetcher(object):
             self.growLater.delay(self.period)
         except:
             # This is when grow got called because of the timer
-            with self.lock:
-                self.growLater = reactor.callLater(self.period, self.grow, self.poolSize - self.numFlight)
+            self.growLater = reactor.callLater(self.period, self.grow, self.poolSize - self.numFlight)
         if count:
             self.serveNext()
         return count
 
+    # This is how the abort rules are applied to a response. Returns the
+    # kind of rule it ran afoul of, or None if its body should be read.
+    def screen(self, status, headers):
+        reason = None
+        if self.abortStatuses and status:
+            for s in self.abortStatuses:
+                if status == s or (s.endswith('xx') and status[0] == s[0]):
+                    reason = 'status'
+                    break
+        # Redirects are followed regardless of what they contain
+        if not reason and status and not status.startswith('3'):
+            if self.contentTypes:
+                ctype = ';'.join(headers.get('content-type', ['']))
+                if not any(re.match(p, ctype, re.I) for p in self.contentTypes):
+                    reason = 'content-type'
+            if not reason and self.maxLength is not None:
+                try:
+                    if int(headers.get('content-length', [0])[0]) > self.maxLength:
+                        reason = 'content-length'
+                except ValueError:
+                    pass
+        if reason:
+            self.aborts[reason] += 1
+        return reason
+
     # These can be overridden to do various post-processing. For example,
     # you might want to add more requests, etc.
     def onDone(self, request):
@@ -511,15 +1125,62 @@ class BaseFetcher(object):
     def onError(self, request):
         pass
 
+    # If overridden, this is called with lists of requests that are done,
+    # successfully or not, so that they can be written somewhere in bulk
+    def onBatch(self, requests):
+        pass
+
+    # Hand whatever requests are done to `onBatch` now
+    def flush(self):
+        if self.flushTimer and self.flushTimer.active():
+            self.flushTimer.cancel()
+        self.flushTimer = None
+        if not self.completed:
+            return 0
+        batch, self.completed = self.completed, []
+        try:
+            self.onBatch(batch)
+        except Exception as e:
+            logger.exception('BaseFetcher:onBatch failed.')
+        return len(batch)
+
+    # This is called with the raw outcome of each request (its body, or its
+    # failure) before any of the request's own callbacks. Policies can use it
+    # to keep track of the health of whatever it is they schedule by.
+    def outcome(self, request, result):
+        pass
+
     # These are how you can start and stop the reactor. It's a convenience
     # so that you don't have to import reactor when you want to use this
-    def start(self):
+    def start(self, installSignalHandlers=True):
+        if self.monitor:
+            reactor.callWhenRunning(self.monitor.start)
         self.serveNext()
-        reactor.run()
+        reactor.run(installSignalHandlers=installSignalHandlers)
 
     def stop(self):
+        self.flush()
+        if self.monitor:
+            self.monitor.stop()
+        if self.redirects is not None:
+            self.redirects.stop()
         reactor.stop()
 
+    # How much memory responses are using, and how much the budget has had
+    # to hold them up
+    def memory(self):
+        return {
+            'buffered' : self.buffered,
+            'peak'     : self.bufferedPeak,
+            'budget'   : self.maxBuffered,
+            'paused'   : len(self.paused),
+            'pauses'   : self.pauses,
+            'pausedSeconds'   : self.pausedSeconds + sum(
+                time.time() - s.pausedAt for s in self.paused),
+            'throttledSeconds': self.throttledSeconds + (
+                time.time() - self.throttled if self.throttled else 0)
+        }
+
     # These are internal callbacks, and should generally not be modified
     # in descendent classes. They manage the proper execution of a number
     # of requests at a single time, and changing them can result in deadlock,
@@ -532,22 +1193,136 @@ class BaseFetcher(object):
     def _done(self, request):
         '''A request has completed'''
         try:
-            with self.lock:
-                self.numFlight -= 1
-                self.processed += 1
-                self.remaining -= 1
-                logger.info('Processed : %i | Remaining : %i | In Flight : %i' % (self.processed, self.remaining, self.numFlight))
+            self.numFlight -= 1
+            self.processed += 1
+            self.remaining -= 1
+            logger.info('Processed : %i | Remaining : %i%s | In Flight : %i' % (self.processed, self.remaining, '+' if self.streaming() else '', self.numFlight))
             self.onDone(request)
         except Exception as e:
             logger.exception('BaseFetcher:onDone failed.')
         finally:
+            if self.batching:
+                self._collect(request)
             # If there are no more requests being serviced, and no requests
-            # waiting to be serviced, the perhaps it is time to stop.
-            if self.stopWhenDone and not self.numFlight and not len(self):
-                self.stop()
-                return
+            # waiting to be serviced, the perhaps it is time to stop. Any
+            # lazy sources have to be read to know that they're exhausted.
+            if self.stopWhenDone and not self.numFlight and not len(self) and not self.incoming:
+                self.fill()
+                if not len(self):
+                    self.stop()
+                    return
             self.serveNext()
 
+    def _collect(self, request):
+        '''Set a request that's done aside for `onBatch`'''
+        self.completed.append(request)
+        if len(self.completed) >= self.flushSize:
+            self.flush()
+        elif not self.flushTimer:
+            self.flushTimer = reactor.callLater(self.flushAge, self.flush)
+
+    def _buffer(self, servicer, length):
+        '''Some more of a response has arrived'''
+        self.transfers.add(servicer)
+        self.buffered += length
+        self.bufferedPeak = max(self.bufferedPeak, self.buffered)
+        if self.maxBuffered is None or self.buffered <= self.maxBuffered:
+            return
+        if self.throttled is None:
+            self.throttled = time.time()
+            logger.warn('Holding %i bytes. Throttling' % self.buffered)
+        # Only the smallest response is left running, and it stays the one
+        # that's running until it's finished, so that something finishes
+        # rather than every response growing in turn
+        if self.exempt not in self.transfers:
+            self._exempt(min(self.transfers, key=lambda s: s.received))
+        for other in self.transfers - self.paused:
+            if other is not self.exempt:
+                self._pause(other)
+
+    def _exempt(self, servicer):
+        '''Leave this response running, and it alone, while over budget'''
+        self.exempt = servicer
+        if servicer in self.paused:
+            self.paused.discard(servicer)
+            self.pausedSeconds += servicer.resume()
+
+    def _decoded(self, request, length):
+        '''A request's response has been decompressed to `length` bytes,
+        which are held until the request is done. Responses may be
+        decompressed in the thread pool, but this is counted on the reactor
+        thread, before the request is done.'''
+        if not threadable.isInIOThread():
+            reactor.callFromThread(self._decoded, request, length)
+            return
+        self.decoded[request] = self.decoded.get(request, 0) + length
+        self.buffered += length
+        self.bufferedPeak = max(self.bufferedPeak, self.buffered)
+
+    def _lowWater(self):
+        if self.resumeBuffered is None:
+            return self.maxBuffered * 0.75
+        return self.resumeBuffered
+
+    def _pause(self, servicer):
+        servicer.pause()
+        if servicer.pausedAt is not None:
+            self.paused.add(servicer)
+            self.pauses += 1
+
+    def _transferred(self, servicer):
+        '''A response has finished arriving, one way or another. Its memory
+        is ours until its request is done with it.'''
+        self.transfers.discard(servicer)
+        if servicer in self.paused:
+            self.paused.discard(servicer)
+            self.pausedSeconds += servicer.resume()
+        if servicer is self.exempt:
+            self.exempt = None
+        # If everything left is paused, then the smallest gets to run
+        if self.paused and not (self.transfers - self.paused):
+            self._exempt(min(self.paused, key=lambda s: s.received))
+
+    def _unbuffer(self, result, servicer):
+        '''A request is done with its response'''
+        try:
+            self._transferred(servicer)
+            self.buffered -= servicer.received + self.decoded.pop(servicer.request, 0)
+            servicer.received = 0
+            if self.throttled is not None and self.buffered <= self._lowWater():
+                logger.warn('Holding %i bytes. Resuming' % self.buffered)
+                self.throttledSeconds += time.time() - self.throttled
+                self.throttled = None
+                self.exempt    = None
+                for paused in list(self.paused):
+                    self.pausedSeconds += paused.resume()
+                self.paused.clear()
+        except Exception as e:
+            logger.exception('BaseFetcher:_unbuffer failed.')
+        return result
+
+    def _record(self, result, factory):
+        '''Hand the outcome of a request to the archive, untouched'''
+        try:
+            self.archive.record(factory, result)
+        except Exception as e:
+            logger.exception('BaseFetcher:_record failed.')
+        return result
+
+    def _process(self, response, request):
+        '''Hand a successful response to its request, either right here on
+        the reactor thread, or in the thread pool if there is one. Either
+        way, the rest of the callbacks happen on the reactor thread.'''
+        if not self.threadPool:
+            return request._success(response, self)
+        self.pending += 1
+        d = threads.deferToThreadPool(reactor, self.threadPool, request._success, response, self)
+        return d.addBoth(self._processed)
+
+    def _processed(self, result):
+        self.pending -= 1
+        return result
+
     def _success(self, request):
         '''A request has completed successfully.'''
         try:
@@ -562,42 +1337,135 @@ class BaseFetcher(object):
         except Exception as e:
             logger.exception('BaseFetcher:onError failed.')
 
+    def _outcome(self, result, request):
+        '''Let the policy see how a request turned out'''
+        try:
+            self.outcome(request, result)
+        except Exception as e:
+            logger.exception('BaseFetcher:outcome failed.')
+        return result
+
+    def _release(self, result, proxy, started):
+        '''A request through a pooled proxy has finished. Only failures that
+        aren't HTTP responses count against the health of the proxy.'''
+        try:
+            failed = isinstance(result, Failure) and not result.check(error.Error)
+            self.proxies.release(proxy, time.time() - started, failed)
+        except Exception as e:
+            logger.exception('BaseFetcher:_release failed.')
+        return result
+
+    # Whether this request has to wait on the proxy pool. Only requests that
+    # would take a proxy from the pool ever do. If every proxy is busy, then
+    # a request finishing will serve the next one, but if they've all been
+    # ejected, then we have to check back when one is given another chance.
+    def _proxiesBusy(self, r):
+        if not self.proxies or r.proxy or self.proxies.available():
+            return False
+        delay = self.proxies.delay()
+        if delay and not (self.proxyTimer and self.proxyTimer.active()):
+            logger.debug('Waiting %f seconds on proxies' % delay)
+            self.proxyTimer = reactor.callLater(delay, self.serveNext)
+        return True
+
+    # This is how the transfer is actually started for a request's servicer.
+    # If http_proxy or https_proxy, or whatever appropriate proxy is set, or
+    # one is provided from the pool, then the servicer resolves it.
+    def connect(self, factory):
+        factory.connect(self.sslContext)
+
     # This repeatedly services available requests while there are spots open
     # and there are requests to be serviced. If there are no queued requests,
     # then it will attempt to grow the queue with a call to `grow`, which
     # must return by how much the queue grew.
     def serveNext(self):
-        with self.lock:
-            while self.numFlight < self.poolSize:
-                r = self.pop()
-                if r == None:
-                    return
-                logger.debug('Requesting %s' % r.url)
-                self.numFlight += 1
-                try:
-                    # This is the expansion of the short version getPage
-                    # and is taken from twisted's source
-                    scheme, host, port, path = parse(r.url)
-                    factory = BaseRequestServicer(r, self.agent)
-                    # If http_proxy or https_proxy, or whatever appropriate proxy
-                    # is set, then we should try to honor that. We do so simply
-                    # by overriding the host/port we'll connect to. The client
-                    # factory, BaseRequestServicer takes care of the rest
-                    proxy = os.environ.get('%s_proxy' % scheme) or r.proxy
-                    if proxy:
-                        scheme, host, port, path = parse(proxy)
-                    if scheme == 'https':
-                        from twisted.internet import ssl
-                        contextFactory = ssl.ClientContextFactory()
-                        reactor.connectSSL(host, port or 443, factory, contextFactory)
-                    else:
-                        reactor.connectTCP(host, port or 80, factory)
-                    factory.deferred.addCallback(r._success, self).addCallback(self._success)
-                    factory.deferred.addErrback(r._error, self).addErrback(self._error).addErrback(log.err)
-                    factory.deferred.addBoth(r._done, self).addBoth(self._done)
-                except:
-                    self.numFlight -= 1
-                    logger.exception('Unable to request %s' % r.url)
+        self._unhold()
+        while self._ready() and len(self.held) < self.poolSize:
+            r = self.pop()
+            if r == None:
+                return
+            self._start(r)
+
+    # Start a request that's been popped, unless it has to wait on a proxy
+    # from the pool, in which case it's held until one is free. Requests
+    # behind it that don't need the pool carry on, up to `poolSize` held.
+    def _start(self, r):
+        if self._proxiesBusy(r):
+            self.held.append(r)
+        else:
+            self._serve(r)
+
+    # Start the held requests, in order, for as long as there are proxies
+    # (and room) for them
+    def _unhold(self):
+        while self.held and self._ready() and not self._proxiesBusy(self.held[0]):
+            self._serve(self.held.popleft())
+
+    # Whether there's room to start another request right now
+    def _ready(self):
+        if self.numFlight >= self.poolSize:
+            return False
+        if self.throttled is not None:
+            logger.debug('Waiting on %i bytes of responses' % self.buffered)
+            return False
+        if self.threadPool and self.pending >= self.maxPending:
+            logger.debug('Waiting on %i pending responses' % self.pending)
+            return False
+        if self.archive and self.archive.busy():
+            # The writer doesn't tell us when it's caught up, so check back
+            if not (self.archiveTimer and self.archiveTimer.active()):
+                logger.debug('Waiting on the archive')
+                self.archiveTimer = reactor.callLater(0.1, self.serveNext)
+            return False
+        return True
+
+    # Skip the permanent redirects that we know this request's url to lead
+    # through. The request keeps its url, and `onURL` hears where it went.
+    def _rewrite(self, factory, r):
+        url = self.redirects.find(r.url)
+        if url is not None:
+            logger.debug('Rewriting %s => %s' % (r.url, url))
+            factory.setURL(url)
+
+    # Start servicing a request that's been popped
+    def _serve(self, r):
+        logger.debug('Requesting %s' % r.url)
+        self.numFlight += 1
+        proxy = None
+        try:
+            # This is the expansion of the short version getPage
+            # and is taken from twisted's source
+            if self.proxies and not r.proxy:
+                proxy = self.proxies.acquire()
+            factory = self.servicer(r, self.agent, self, proxy)
+            if self.redirects is not None:
+                self._rewrite(factory, r)
+            if proxy:
+                factory.deferred.addBoth(self._release, proxy, time.time())
+            if self.archive:
+                factory.deferred.addBoth(self._record, factory)
+            factory.deferred.addBoth(self._outcome, r)
+            self.connect(factory)
+            factory.deferred.addCallback(self._process, r).addCallback(self._success)
+            factory.deferred.addErrback(r._error, self).addErrback(self._error).addErrback(log.err)
+            factory.deferred.addBoth(self._unbuffer, factory)
+            factory.deferred.addBoth(r._done, self).addBoth(self._done)
+        except:
+            self.numFlight -= 1
+            if proxy:
+                self.proxies.release(proxy, 0)
+            logger.exception('Unable to request %s' % r.url)
 
 # Now do a few imports for convenience
 from PoliteFetcher import PoliteFetcher
+from ProxyPool import ProxyPool
+from Archive import Archive
+from ReplayFetcher import ReplayFetcher
+from AgentServicer import AgentServicer
+from PublicSuffix import PublicSuffix
+from RedisThread import RedisThread
+from Shards import Shards
+from LagMonitor import LagMonitor
+from Robots import Matcher, Matchers
+from Redirects import Redirects
+from AsyncioBridge import AsyncioBridge
@@ -26,9 +26,10 @@ import logging
 
 logger.setLevel(logging.DEBUG)
 
-# Read in a set of urls to fetch
-with file('urls.txt') as f:
-	reqs = [BaseRequest(u) for u in f.read().strip().split('\n')]
+fetcher = BaseFetcher(100, stopWhenDone=True)
+
+# Lazily read in a set of urls to fetch, only as slots open up
+fetcher.extend(BaseRequest(u.strip()) for u in file('urls.txt') if u.strip())
 
 # Now start it!
-BaseFetcher(100, reqs).start()
\ No newline at end of file
+fetcher.start()
\ No newline at end of file
@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+
+'''Lets the tests that need redis run without one. If there's no redis on
+the ports they want, and `fakeredis` is installed, then an in-process fake
+server stands in for each of those ports, for every connection made from
+then on, whether by redis-py itself, by qr or by downpour.'''
+
+import redis
+
+# The fake servers, by where they're standing in for
+servers = {}
+
+def available(ports=(6379,), db=15):
+    '''Whether there's a redis (real or fake) on each of these ports'''
+    try:
+        for port in ports:
+            redis.Redis(port=port, db=db).ping()
+        return True
+    except redis.ConnectionError:
+        pass
+    try:
+        import fakeredis
+    except ImportError:
+        return False
+    standIn(fakeredis)
+    return True
+
+def standIn(fakeredis):
+    '''Make every connection pool connect to a fake server instead'''
+    real = redis.connection.ConnectionPool
+    if getattr(real, 'fake', False):
+        return
+    # These are the only arguments that mean anything to a fake connection
+    kept = ('db', 'password', 'encoding', 'encoding_errors', 'decode_responses')
+
+    class Pool(real):
+        fake = True
+
+        def __init__(self, connection_class=None, max_connections=None, **kwargs):
+            where = (kwargs.get('unix_socket_path'), kwargs.get('host', 'localhost'), kwargs.get('port', 6379))
+            server = servers.setdefault(where, fakeredis.FakeServer())
+            kwargs = dict((k, v) for k, v in kwargs.items() if k in kept)
+            real.__init__(self, fakeredis.FakeConnection, max_connections, server=server, **kwargs)
+
+    redis.ConnectionPool = redis.client.ConnectionPool = redis.connection.ConnectionPool = Pool
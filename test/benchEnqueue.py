@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+
+'''Measure how many urls per second a PoliteFetcher can enqueue, both one
+at a time with `push`, and in bulk with `extend`, `enqueue` and `grow`.
+This needs a redis running locally, and it flushes that redis's database
+before each measurement, so don't point it at anything you care about.'''
+
+import sys
+import time
+import logging
+from downpour import logger, PoliteFetcher, BaseRequest
+
+logger.setLevel(logging.CRITICAL)
+
+def urls(count):
+    return ('http://www.example%i.com/some/path/%i.html' % (i % 1000, i) for i in xrange(count))
+
+def fetcher():
+    f = PoliteFetcher(poolSize=0, allowAll=True)
+    f.r.flushdb()
+    f.remaining = 0
+    return f
+
+def measure(name, count, func):
+    start = time.time()
+    added = func(count)
+    elapsed = time.time() - start
+    print '%-8s %8i urls in %7.2fs : %10.1f urls/sec' % (name, added, elapsed, added / elapsed)
+
+def push(count):
+    f = fetcher()
+    return sum(f.push(BaseRequest(u)) for u in urls(count))
+
+def extend(count):
+    f = fetcher()
+    return f.extend(BaseRequest(u) for u in urls(count))
+
+def grow(count):
+    f = fetcher()
+    f.enqueue(BaseRequest(u) for u in urls(count))
+    # The time it takes to enqueue is not counted here
+    start = time.time()
+    added = f.grow(count)
+    elapsed = time.time() - start
+    print '%-8s %8i urls in %7.2fs : %10.1f urls/sec' % ('grow', added, elapsed, added / elapsed)
+    return added
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # Pushing one at a time is slow enough that a tenth as many will do
+    measure('push', count / 10, push)
+    measure('extend', count, extend)
+    measure('enqueue', count, lambda c: fetcher().enqueue(BaseRequest(u) for u in urls(c)))
+    grow(count)
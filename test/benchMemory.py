@@ -0,0 +1,55 @@
+#! /usr/bin/env python
+
+'''Measure how many bytes each request queued in a BaseFetcher costs.
+Each kind of request is measured in its own process, so that memory
+freed by one measurement isn't reused by the next.'''
+
+import os
+import sys
+import logging
+import subprocess
+from downpour import logger, BaseFetcher, BaseRequest
+
+logger.setLevel(logging.CRITICAL)
+
+class DictRequest(BaseRequest):
+    '''A subclass without __slots__, and so with a __dict__'''
+    def __init__(self, url):
+        BaseRequest.__init__(self, url)
+        self.name = url
+
+class SlotRequest(BaseRequest):
+    '''A subclass that stays compact with __slots__ of its own'''
+    __slots__ = ('name',)
+    def __init__(self, url):
+        BaseRequest.__init__(self, url)
+        self.name = url
+
+kinds = {
+    'BaseRequest': BaseRequest,
+    'DictRequest': DictRequest,
+    'SlotRequest': SlotRequest
+}
+
+def rss():
+    '''Resident set size of this process, in bytes'''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def measure(kind, count):
+    # The urls themselves are made ahead of time, as they're the same
+    # regardless of how requests are represented
+    urls = ['http://www.example%i.com/some/path/%i.html' % (i % 1000, i) for i in xrange(count)]
+    fetcher = BaseFetcher(poolSize=0)
+    before = rss()
+    fetcher.extend([kinds[kind](u) for u in urls])
+    return (rss() - before) / float(count)
+
+if __name__ == '__main__':
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    if len(sys.argv) > 1 and sys.argv[1] in kinds:
+        print '%.1f' % measure(sys.argv[1], count)
+    else:
+        for kind in sorted(kinds):
+            out = subprocess.check_output([sys.executable, __file__, kind, str(count)])
+            print '%-12s %8s bytes per queued request' % (kind, out.strip().split('\n')[-1])
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+
+import logging
+from downpour import logger
+from downpour.test import run, host
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher, UserPreemptionError
+
+logger.setLevel(logging.CRITICAL)
+
+fetcher = BaseFetcher(stopWhenDone=True)
+fetcher.contentTypes  = ['text/html']
+fetcher.maxLength     = 100
+fetcher.abortStatuses = ['404', '5xx']
+
+def aborted(reason):
+	def expect(request, failure, fetcher):
+		return isinstance(failure.value, UserPreemptionError) and fetcher.aborts[reason] > 0
+	return expect
+
+# Responses that pass the rules should be untouched
+fetcher.push(ExpectRequest('Allowed Test', host + 'asis/ok.asis',
+	expectSuccess = 'Hello world'))
+
+# Redirects aren't subject to the rules, but where they lead is
+fetcher.push(ExpectRequest('Redirect Test', host + 'asis/301_to_ok.asis',
+	expectSuccess = 'Hello world'))
+
+# While those that don't should be aborted, without a body
+fetcher.push(ExpectRequest('Content-Type Test', host + 'asis/image.asis',
+	expectSuccess = False,
+	expectError   = aborted('content-type')))
+
+fetcher.push(ExpectRequest('Content-Length Test', host + 'asis/large.asis',
+	expectSuccess = False,
+	expectError   = aborted('content-length')))
+
+fetcher.push(ExpectRequest('404 Status Test', host + 'asis/404.asis',
+	expectSuccess = False,
+	expectError   = aborted('status')))
+
+fetcher.push(ExpectRequest('5xx Status Test', host + 'asis/503.asis',
+	expectSuccess = False,
+	expectError   = aborted('status')))
+
+run(fetcher)
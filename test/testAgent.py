@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+
+import logging
+from downpour import logger
+from downpour.test import run, host
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher, AgentServicer, UserPreemptionError
+
+logger.setLevel(logging.CRITICAL)
+
+# The same callbacks should be made, in the same way, with either servicer
+fetcher = BaseFetcher(stopWhenDone=True, servicer=AgentServicer)
+fetcher.contentTypes = ['text/html']
+
+fetcher.push(ExpectRequest('Agent 200 Test', host + 'asis/ok.asis',
+	expectHeaders = {
+	'content-type': ['text/html'],
+	'content-length': ['11']
+}, expectStatus = ('HTTP/1.1', '200', 'OK'),
+	expectURL     = host + 'asis/ok.asis',
+	expectSuccess = 'Hello world'))
+
+fetcher.push(ExpectRequest('Agent 301 Redirect Test', host + 'asis/301_to_ok.asis', expectURL = [
+	host + 'asis/301_to_ok.asis',
+	host + 'asis/ok.asis'
+], expectSuccess = 'Hello world'))
+
+fetcher.push(ExpectRequest('Agent 302 Redirect Test', host + 'asis/302_to_ok.asis', expectURL = [
+	host + 'asis/302_to_ok.asis',
+	host + 'asis/ok.asis'
+], expectSuccess = 'Hello world'))
+
+fetcher.push(ExpectRequest('Agent Gzip Test', host + 'asis/gzip.asis',
+	expectSuccess = 'Hello world'))
+
+for status in ('404', '500'):
+	fetcher.push(ExpectRequest('Agent %s Failure Test' % status, host + 'asis/%s.asis' % status,
+		expectHeaders = True,
+		expectStatus  = True,
+		expectSuccess = False,
+		expectError   = True))
+
+# Cancellation by way of the abort rules
+fetcher.push(ExpectRequest('Agent Abort Test', host + 'asis/image.asis',
+	expectSuccess = False,
+	expectError   = lambda request, failure, fetcher: isinstance(failure.value, UserPreemptionError)))
+
+# Nothing's listening here
+fetcher.push(ExpectRequest('Agent Refused Test', 'http://localhost:1/',
+	expectStatus  = False,
+	expectSuccess = False,
+	expectError   = True))
+
+run(fetcher)
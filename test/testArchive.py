@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+
+import os
+import gzip
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from downpour import Archive, BaseRequest
+from twisted.web import error
+from twisted.python.failure import Failure
+
+class Factory(object):
+    '''Just enough of a BaseRequestServicer to be recorded'''
+    def __init__(self, url, final, status='200', headers=None):
+        self.request = BaseRequest(url)
+        self.request.time = -time.time()
+        self.url = final
+        if status:
+            self.version, self.status, self.message = 'HTTP/1.1', status, 'OK'
+            self.response_headers = headers or {'content-type': ['text/html']}
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def read(self, archive):
+        return [gzip.open(os.path.join(self.path, s)).read() for s in archive.segments]
+    
+    def test_response(self):
+        archive = Archive(self.path)
+        archive.record(Factory('http://foo.com/', 'https://www.foo.com/'), 'Hello world')
+        archive.close()
+        self.assertEqual(archive.records, 1)
+        self.assertEqual(len(archive.segments), 1)
+        data = self.read(archive)[0]
+        header, sep, content = data.partition('\r\n\r\n')
+        self.assertTrue(header.startswith('WARC/1.0\r\nWARC-Type: response\r\n'))
+        self.assertTrue('WARC-Target-URI: https://www.foo.com/' in header)
+        self.assertTrue('X-Downpour-Original-URI: http://foo.com/' in header)
+        self.assertTrue('X-Downpour-Elapsed: ' in header)
+        http = 'HTTP/1.1 200 OK\r\ncontent-type: text/html\r\n\r\nHello world'
+        self.assertTrue('Content-Length: %i' % len(http) in header)
+        self.assertEqual(content, http + '\r\n\r\n')
+    
+    def test_failure(self):
+        archive = Archive(self.path)
+        # One that got a response, and one that didn't
+        failure = Failure(error.Error('404', 'Not Found', 'Nope'))
+        archive.record(Factory('http://foo.com/a', 'http://foo.com/a', '404'), failure)
+        failure = Failure(ValueError('Connection refused'))
+        archive.record(Factory('http://foo.com/b', 'http://foo.com/b', None), failure)
+        archive.close()
+        data = self.read(archive)[0]
+        records = data.split('WARC/1.0\r\n')[1:]
+        self.assertEqual(len(records), 2)
+        self.assertTrue('WARC-Type: x-failure' in records[0])
+        self.assertTrue(records[0].endswith('\r\n\r\nNope\r\n\r\n'))
+        self.assertTrue('X-Downpour-Failure: Connection refused' in records[1])
+        self.assertTrue('Content-Length: 0\r\n' in records[1])
+    
+    def test_rotate(self):
+        # Each record should be big enough to rotate segments
+        archive = Archive(self.path, maxSize=10, batchSize=1, fsyncInterval=0)
+        for i in range(3):
+            archive.record(Factory('http://foo.com/%i' % i, 'http://foo.com/%i' % i), 'Hello %i' % i)
+        archive.close()
+        self.assertEqual(archive.records, 3)
+        segments = self.read(archive)
+        self.assertEqual(len(segments), 3)
+        for i, data in enumerate(segments):
+            self.assertTrue(data.endswith('Hello %i\r\n\r\n' % i))
+        # And every segment should be closed
+        self.assertEqual(archive.segment, None)
+
+    def test_elapsed(self):
+        # Timed from the first hop, even though a redirect resets the request's
+        # own clock
+        factory = Factory('http://foo.com/', 'http://www.foo.com/')
+        factory.begun = time.time() - 5
+        archive = Archive(self.path)
+        elapsed = archive.gather(factory, 'Hello')[7]
+        archive.close()
+        self.assertTrue(5 <= elapsed < 6)
+
+    def test_truncated(self):
+        archive = Archive(self.path)
+        for i in range(2):
+            archive.record(Factory('http://foo.com/%i' % i, 'http://foo.com/%i' % i), 'Hello %i' % i)
+        archive.close()
+        path = os.path.join(self.path, archive.segments[0])
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Cut off in the headers of the second record, but a whole gzip member
+        first = gzip.open(path).read().split('WARC/1.0')[1]
+        with open(path, 'wb') as f:
+            f.write(archive.compress('WARC/1.0' + first + 'WARC/1.0\r\nWARC-Type: resp'))
+        records = list(Archive.read(path))
+        self.assertEqual([r['body'] for r in records], ['Hello 0'])
+        # And cut off partway through the gzip member itself
+        with open(path, 'wb') as f:
+            f.write(data[:-10])
+        records = list(Archive.read(path))
+        self.assertEqual([r['body'] for r in records], ['Hello 0'])
+
+    def test_index(self):
+        archive = Archive(self.path)
+        for i in range(3):
+            archive.record(Factory('http://foo.com/%i' % i, 'http://foo.com/%i' % i), 'Hello %i' % i)
+        archive.close()
+        # Each record can be read again on its own, from where it's indexed
+        entries = list(Archive.index(self.path))
+        self.assertEqual([e[2]['body'] for e in entries], ['Hello 0', 'Hello 1', 'Hello 2'])
+        for segment, offset, record in entries:
+            self.assertEqual(Archive.readAt(segment, offset), record)
+        # However the members fall across the chunks they're read in
+        with open(os.path.join(self.path, archive.segments[0]), 'rb') as f:
+            members = list(Archive.members(f, chunk=7))
+        self.assertEqual([m[0] for m in members], [e[1] for e in entries])
+
+    def test_full(self):
+        archive = Archive(self.path, maxQueue=2, highWater=1)
+        # Hold the writer up once it has the first record
+        release = threading.Event()
+        write = archive.write
+        archive.write = lambda batch: (release.wait(), write(batch))
+        archive.record(Factory('http://foo.com/0', 'http://foo.com/0'), 'Hello')
+        while archive.queue.qsize():
+            time.sleep(0.01)
+        self.assertFalse(archive.busy())
+        # Now the queue fills up, and then records are dropped rather than
+        # making us wait
+        for i in range(1, 4):
+            archive.record(Factory('http://foo.com/%i' % i, 'http://foo.com/%i' % i), 'Hello')
+        self.assertTrue(archive.busy())
+        self.assertEqual(archive.dropped, 1)
+        release.set()
+        archive.close()
+        self.assertEqual(archive.records, 3)
+
+if __name__ == '__main__':
+    unittest.main()
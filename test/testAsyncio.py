@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+
+import time
+import Queue
+import logging
+from downpour import logger
+from downpour.test import host
+from downpour import BaseFetcher, BaseRequest, AsyncioBridge, Pickled
+from twisted.web import error
+
+logger.setLevel(logging.CRITICAL)
+
+class Future(object):
+	'''Just as much of asyncio's Future as the bridge uses'''
+	def __init__(self):
+		self.result    = None
+		self.exception = None
+		self.finished  = False
+
+	def cancelled(self):
+		return False
+
+	def set_result(self, result):
+		self.result, self.finished = result, True
+
+	def set_exception(self, exception):
+		self.exception, self.finished = exception, True
+
+class Loop(object):
+	'''Just as much of an asyncio event loop as the bridge uses'''
+	def __init__(self):
+		self.calls = Queue.Queue()
+
+	def create_future(self):
+		return Future()
+
+	def call_soon_threadsafe(self, func, *args):
+		self.calls.put((func, args))
+
+	def run_until(self, futures, timeout):
+		deadline = time.time() + timeout
+		while not all(f.finished for f in futures) and time.time() < deadline:
+			try:
+				func, args = self.calls.get(timeout=0.1)
+			except Queue.Empty:
+				continue
+			func(*args)
+
+class Fetcher(BaseFetcher):
+	'''Like the PoliteFetcher, this only ever serves copies of its requests'''
+	def push(self, request):
+		return BaseFetcher.push(self, Pickled.loads(Pickled.dumps(request)))
+
+class Request(BaseRequest):
+	def onSuccess(self, text, fetcher):
+		self.text = text
+
+loop    = Loop()
+bridge  = AsyncioBridge(Fetcher(), loop)
+bridge.start()
+ok      = bridge.fetch(Request(host + 'asis/gzip.asis'))
+missing = bridge.fetch(Request(host + 'asis/404.asis'))
+loop.run_until([ok, missing], 30)
+bridge.stop()
+
+print 'ok: %s' % getattr(ok.result, 'text', None)
+print 'missing: %s' % repr(missing.exception)
+if (ok.result and ok.result.text == 'Hello world' and
+	isinstance(missing.exception, error.Error) and missing.exception.status == '404'):
+	print 'PASSED'
+	exit(0)
+else:
+	print 'FAILED'
+	exit(1)
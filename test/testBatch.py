@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+
+import logging
+from downpour import logger, reactor
+from downpour.test import run, host
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher
+
+logger.setLevel(logging.CRITICAL)
+
+class BatchFetcher(BaseFetcher):
+    '''Keeps every batch it's handed'''
+    flushSize = 4
+
+    def __init__(self, *args, **kwargs):
+        BaseFetcher.__init__(self, *args, **kwargs)
+        self.batches = []
+        self.done    = []
+
+    def onDone(self, request):
+        self.done.append(request)
+
+    def onBatch(self, requests):
+        # Each request has been through all its callbacks by now
+        assert all(r in self.done for r in requests)
+        self.batches.append(requests)
+
+fetcher = BatchFetcher(poolSize=3)
+for i in range(10):
+    fetcher.push(ExpectRequest('Batch Test %i' % i, host + 'asis/ok.asis?%i' % i,
+        expectSuccess = 'Hello world'))
+# Failures are batched along with everything else
+fetcher.push(ExpectRequest('Batch Failure Test', host + 'asis/404.asis',
+    expectHeaders = True,
+    expectStatus  = True,
+    expectSuccess = False,
+    expectError   = True))
+
+# Without an `onBatch`, nothing is collected
+plain = BaseFetcher()
+
+def checkBatches():
+    sizes = [len(b) for b in fetcher.batches]
+    print 'Batches: %s' % sizes
+    # Full batches as they fill, and then whatever's left when we stop
+    assert sizes == [4, 4, 3]
+    assert sorted(sum(fetcher.batches, [])) == sorted(fetcher.done)
+    assert not fetcher.completed and not fetcher.flushTimer
+    assert not plain.batching
+
+run(fetcher, checkBatches)
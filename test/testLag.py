@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+
+import os
+import time
+import signal
+import logging
+import tempfile
+from downpour import logger, reactor
+from downpour.test import host
+from downpour import BaseFetcher, BaseRequest, LagMonitor
+
+logger.setLevel(logging.CRITICAL)
+
+class SlowRequest(BaseRequest):
+    '''Holds up the reactor when it succeeds'''
+    def onSuccess(self, text, fetcher):
+        time.sleep(0.3)
+
+def blocked():
+    time.sleep(0.3)
+
+fetcher = BaseFetcher()
+fetcher.monitor = LagMonitor(interval=0.01, slow=0.05)
+path = os.path.join(tempfile.mkdtemp(), 'profile.folded')
+
+def profile():
+    fetcher.monitor.profile(0.5, path)
+    reactor.callLater(0.1, blocked)
+
+reactor.callWhenRunning(fetcher.push, SlowRequest(host + 'asis/ok.asis'))
+def signalled():
+    # A profile is also taken when the process is sent a signal
+    fetcher.monitor.profileOnSignal(signal.SIGUSR2, 0.2)
+    os.kill(os.getpid(), signal.SIGUSR2)
+    reactor.callLater(0.1, blocked)
+
+reactor.callLater(1, profile)
+reactor.callLater(2, signalled)
+reactor.callLater(3, fetcher.stop)
+fetcher.start()
+
+stats = fetcher.monitor.stats()
+print 'Lag: %s' % stats
+passed = True
+def check(description, condition):
+    global passed
+    print '%s: %s' % (description, 'ok' if condition else 'FAILED')
+    passed = passed and condition
+
+check('Ticks measured', stats['ticks'] > 10)
+check('Stall measured', stats['worst'] >= 0.25 and stats['stalls'] >= 2)
+check('Histogram', sum(c for b, c in fetcher.monitor.histogram()) == stats['ticks'])
+check('Percentiles', stats['p50'] <= stats['p90'] <= stats['p99'] <= stats['worst'])
+check('Put down to onSuccess', stats['culprits'].get('testLag.py:onSuccess', 0) >= 0.1)
+check('Put down to the timer', stats['culprits'].get('testLag.py:blocked', 0) >= 0.1)
+check('Sites within each culprit', sum(stats['sites'].get('testLag.py:onSuccess', {}).values()) >= 0.1)
+lines = open(path).read().splitlines() if os.path.exists(path) else []
+check('Profile written', any('testLag.py:blocked' in line for line in lines))
+signalled = fetcher.monitor.path
+check('Profile on signal', signalled != path and os.path.exists(signalled))
+if os.path.exists(signalled):
+	os.remove(signalled)
+
+if passed:
+    print 'PASSED'
+    exit(0)
+else:
+    print 'FAILED'
+    exit(1)
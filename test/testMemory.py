@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+
+import gzip
+import logging
+from cStringIO import StringIO
+from downpour import logger, reactor
+from downpour.test import run
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher, BaseRequestServicer, AgentServicer
+from twisted.internet import protocol, task
+
+logger.setLevel(logging.CRITICAL)
+
+size  = 1024 * 1024
+chunk = 64 * 1024
+
+class Big(protocol.Protocol):
+    '''Sends a large body, a piece at a time'''
+    def dataReceived(self, data):
+        if not data.startswith('GET '):
+            return
+        if data.startswith('GET /gzip '):
+            # A small response that's large once it's decompressed
+            body = StringIO()
+            with gzip.GzipFile(fileobj=body, mode='w') as f:
+                f.write('.' * size)
+            body = body.getvalue()
+            self.transport.write('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n'
+                'Content-Encoding: gzip\r\nContent-Length: %i\r\n\r\n%s' % (len(body), body))
+            return
+        self.transport.write('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %i\r\n\r\n' % size)
+        self.sent  = 0
+        self.timer = task.LoopingCall(self.send)
+        self.timer.start(0.01)
+
+    def send(self):
+        self.transport.write('.' * chunk)
+        self.sent += chunk
+        if self.sent >= size:
+            self.timer.stop()
+            self.transport.write('.' * (size - self.sent))
+
+    def connectionLost(self, reason):
+        if getattr(self, 'timer', None) and self.timer.running:
+            self.timer.stop()
+
+factory = protocol.ServerFactory()
+factory.protocol = Big
+reactor.listenTCP(8082, factory)
+
+class MixedFetcher(BaseFetcher):
+    '''Services each request with the servicer it names'''
+    def servicer(self, request, *args):
+        return request.servicer(request, *args)
+
+fetcher = MixedFetcher(poolSize=8)
+fetcher.maxBuffered = 2 * size
+
+for name, servicer in (('Factory', BaseRequestServicer), ('Agent', AgentServicer)):
+    for i in range(8):
+        request = ExpectRequest('%s Budget Test %i' % (name, i), 'http://localhost:8082/%i' % i,
+            expectSuccess = '.' * size)
+        request.servicer = servicer
+        fetcher.push(request)
+
+class DecodedRequest(ExpectRequest):
+    '''Notes how much memory was counted while its response was in hand'''
+    held = None
+    
+    def onSuccess(self, text, fetcher):
+        DecodedRequest.held = fetcher.buffered
+        ExpectRequest.onSuccess(self, text, fetcher)
+
+request = DecodedRequest('Decoded Budget Test', 'http://localhost:8082/gzip', expectSuccess = '.' * size)
+request.servicer = BaseRequestServicer
+fetcher.push(request)
+
+def checkMemory():
+    memory = fetcher.memory()
+    print 'Memory: %s' % memory
+    # Responses are held up, rather than all of them arriving at once...
+    assert memory['pauses'] and memory['throttledSeconds']
+    # Once we're over budget, only the smallest response is still read, so
+    # at most one response (and the read that tipped us over) gets past it
+    assert memory['peak'] <= fetcher.maxBuffered + size + chunk
+    # Decompressed responses count, too, until their requests are done
+    assert DecodedRequest.held >= size
+    assert not fetcher.decoded
+    # ... and everything is given back
+    assert memory['buffered'] == 0 and not memory['paused']
+    assert not fetcher.transfers
+
+run(fetcher, checkMemory)
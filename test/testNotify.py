@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+
+'''A request enqueued to a PoliteFetcher that's waiting on the incoming queue
+starts right away, rather than when the fetcher next grows. This needs a
+redis running locally (or fakeredis), and it flushes its database 15.'''
+
+import time
+import redis
+import logging
+from downpour import logger, reactor
+from downpour import PoliteFetcher, BaseRequest
+from downpour.test import fakeRedis
+
+logger.setLevel(logging.CRITICAL)
+
+db = 15
+
+class Fetcher(PoliteFetcher):
+	def _serve(self, r):
+		# Nothing is fetched. It's enough to know when it would have been.
+		started.append(time.time())
+		reactor.callLater(0, self.stop)
+
+if not fakeRedis.available(db=db):
+	print 'SKIPPED: this test needs a redis on localhost:6379, or fakeredis'
+	exit(0)
+redis.Redis(db=db).flushdb()
+
+started  = []
+enqueued = []
+fetcher  = Fetcher(poolSize=1, allowAll=True, worker='test', db=db)
+
+def enqueue():
+	enqueued.append(time.time())
+	fetcher.enqueue([BaseRequest('http://example.com/')])
+
+# Long enough for the first grow to have come and gone, and well short of
+# the next one
+reactor.callLater(1, enqueue)
+reactor.callLater(10, fetcher.stop)
+fetcher.start()
+
+latency = started[0] - enqueued[0] if started and enqueued else None
+print 'Started after: %s' % latency
+if latency is not None and latency < 0.25:
+	print 'PASSED'
+	exit(0)
+else:
+	print 'FAILED'
+	exit(1)
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+'''Tests of PoliteFetcher's bookkeeping in redis. These need a redis running
+locally (or fakeredis), and they flush its database 15 before each test.'''
+
+import time
+import redis
+import logging
+import unittest
+from downpour import logger, PoliteFetcher, BaseRequest
+from downpour.test import fakeRedis
+
+logger.setLevel(logging.CRITICAL)
+
+db = 15
+
+class Fetcher(PoliteFetcher):
+    # Everything happens right away, on this thread, so there's no need for
+    # the reactor to be running
+    offload = False
+    notify  = False
+
+class TestPolite(unittest.TestCase):
+    def setUp(self):
+        redis.Redis(db=db).flushdb()
+        self.fetcher = Fetcher(poolSize=0, allowAll=True, worker='test', db=db)
+        self.r = self.fetcher.r
+
+    def tearDown(self):
+        self.fetcher.heartbeat.stop()
+
+    def depth(self):
+        return int(self.r.hget('depths', '') or 0)
+
+    def test_push_duplicates(self):
+        # A request that's already queued isn't counted twice
+        request = BaseRequest('http://example.com/')
+        self.assertEqual(self.fetcher.push(request), 1)
+        self.assertEqual(self.fetcher.push(request), 0)
+        self.assertEqual(self.fetcher.remaining, 1)
+        self.assertEqual(self.depth(), 1)
+        self.assertEqual(self.fetcher.extend([request, BaseRequest('http://example.com/a')]), 1)
+        self.assertEqual(self.fetcher.remaining, 2)
+        self.assertEqual(self.depth(), 2)
+
+    def test_leases(self):
+        self.fetcher.push(BaseRequest('http://example.com/'))
+        request = self.fetcher.pop()
+        self.assertEqual(request.url, 'http://example.com/')
+        self.assertEqual(self.r.hkeys('lease:test'), ['http://example.com/'])
+        self.assertEqual(self.fetcher.inFlight('domain:example.com'), 1)
+        # The lease is released even if the url changed along the way
+        request.url = 'https://www.example.com/'
+        self.fetcher.finished(request, self.fetcher.job(None))
+        self.assertEqual(self.r.hkeys('lease:test'), [])
+        self.assertEqual(self.fetcher.inFlight('domain:example.com'), 0)
+    
+    def test_reclaim(self):
+        self.fetcher.extend([BaseRequest('http://example.com/'), BaseRequest('http://example.com/a')])
+        request = self.fetcher.pop()
+        self.assertEqual(self.depth(), 1)
+        request.url = 'https://www.example.com/'
+        # Should this worker die, its request goes back to the front of
+        # the queue, as it was popped
+        self.assertEqual(self.fetcher.reclaim('test'), 1)
+        self.assertEqual(self.depth(), 2)
+        self.assertEqual(self.r.hkeys('lease:test'), [])
+        self.assertEqual(self.fetcher.inFlight('domain:example.com'), 0)
+        self.assertEqual(self.fetcher.queue('domain:example.com').peek().url, 'http://example.com/')
+
+    def test_probe(self):
+        self.fetcher.extend([BaseRequest('http://example.com/'), BaseRequest('http://example.com/a')])
+        # The circuit is open, but due to be probed
+        self.r.hmset('breaker:domain:example.com', {'until': time.time() - 1, 'cooldown': 10})
+        request = self.fetcher.pop()
+        self.assertEqual(self.r.hget('breaker:domain:example.com', 'probe'), 'http://example.com/')
+        self.assertEqual(self.fetcher.pop(), None)
+        # Another worker finishing the probe can close the circuit
+        other = Fetcher(poolSize=0, allowAll=True, worker='other', db=db)
+        try:
+            other.breaker(request, 'domain:example.com', 0)
+        finally:
+            other.heartbeat.stop()
+        self.assertFalse(self.r.exists('breaker:domain:example.com'))
+    
+    def test_reclaim_probe(self):
+        self.fetcher.extend([BaseRequest('http://example.com/'), BaseRequest('http://example.com/a')])
+        self.r.hmset('breaker:domain:example.com', {'until': time.time() - 1, 'cooldown': 10})
+        self.fetcher.pop()
+        # Should the prober die, the domain is due to be probed right away
+        self.fetcher.reclaim('test')
+        self.assertLessEqual(float(self.r.hget('breaker:domain:example.com', 'until')), time.time())
+        self.assertEqual(self.r.hget('breaker:domain:example.com', 'probe'), None)
+        request = self.fetcher.pop()
+        self.assertEqual(request.url, 'http://example.com/')
+        self.assertEqual(self.r.hget('breaker:domain:example.com', 'probe'), 'http://example.com/')
+
+    def test_polite_pruned(self):
+        self.r.zadd('polite', **{'domain:stale.com': time.time() - 1})
+        self.fetcher.push(BaseRequest('http://example.com/'))
+        self.fetcher.pop()
+        self.assertEqual(self.r.zrange('polite', 0, -1), ['domain:example.com'])
+
+    def test_key_by_ip(self):
+        self.fetcher.keyBy = 'ip'
+        # An address is its own key
+        self.assertEqual(self.fetcher.push(BaseRequest('http://127.0.0.1/')), 1)
+        # Anything else waits on the resolver, and is queued once it answers
+        self.assertEqual(self.fetcher.push(BaseRequest('http://example.com/')), 0)
+        self.assertEqual(self.fetcher.push(BaseRequest('http://example.com/a')), 0)
+        self.assertEqual(len(self.fetcher.resolving['example.com']), 2)
+        self.fetcher.resolved('127.0.0.1', 'example.com')
+        self.assertEqual(self.fetcher.resolving, {})
+        self.assertEqual(self.depth(), 3)
+        self.assertEqual(self.fetcher.keys['example.com'], 'domain:127.0.0.1')
+    
+    def test_unresolved(self):
+        self.fetcher.keyBy = 'ip'
+        self.assertEqual(self.fetcher.push(BaseRequest('http://nowhere.invalid/')), 0)
+        self.fetcher.unresolvable(None, 'nowhere.invalid')
+        self.fetcher.resolved(None, 'nowhere.invalid')
+        self.assertEqual(self.depth(), 1)
+        self.assertEqual(len(self.fetcher.queue('domain:nowhere.invalid')), 1)
+        # Which isn't remembered for good
+        self.assertFalse('nowhere.invalid' in self.fetcher.keys)
+        self.fetcher.unresolved['nowhere.invalid'] = time.time() - 1
+        self.assertEqual(self.fetcher.getKey(BaseRequest('http://nowhere.invalid/a')), None)
+
+    def test_no_hostname(self):
+        # A url without a hostname is keyed on None, however we key the rest
+        for keyBy in ('hostname', 'domain', 'ip'):
+            self.fetcher.keyBy = keyBy
+            self.assertEqual(self.fetcher.getKey(BaseRequest('http:///%s' % keyBy)), 'domain:None')
+            self.assertEqual(self.fetcher.push(BaseRequest('http:///%s' % keyBy)), 1)
+        self.assertEqual(self.fetcher.resolving, {})
+        self.assertEqual(len(self.fetcher.queue('domain:None')), 3)
+
+    def test_arrived(self):
+        # A request that arrives while we're listening is queued, and it's no
+        # longer among the taken requests
+        taken = self.fetcher.pack(BaseRequest('http://example.com/'))
+        self.r.lpush('incoming:test', taken)
+        self.fetcher.listening = True
+        try:
+            self.fetcher.arrived(taken)
+        finally:
+            self.fetcher.listening = False
+        self.assertFalse(self.r.exists('incoming:test'))
+        self.assertEqual(self.fetcher.remaining, 1)
+
+    def test_taken(self):
+        # A request that was taken from the incoming queue, but never queued
+        taken = self.fetcher.pack(BaseRequest('http://example.com/'))
+        self.r.lpush('incoming:test', taken)
+        self.assertEqual(self.fetcher.arrived(taken), 0)
+        self.assertEqual(self.r.lrange('incoming:test', 0, -1), [taken])
+        # Goes back to the front of the incoming queue when it's reclaimed
+        self.r.lpush('request', self.fetcher.pack(BaseRequest('http://example.com/a')))
+        self.fetcher.reclaim('test')
+        self.assertFalse(self.r.exists('incoming:test'))
+        self.assertEqual(self.r.lindex('request', -1), taken)
+        self.assertEqual(self.fetcher.drain(), 2)
+
+if __name__ == '__main__':
+    if not fakeRedis.available(db=db):
+        print 'SKIPPED: these tests need a redis on localhost:6379, or fakeredis'
+        exit(0)
+    unittest.main()
@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+
+import time
+import unittest
+from downpour import BaseFetcher, BaseRequest
+
+class TestPriority(unittest.TestCase):
+    def setUp(self):
+        # With a pool size of 0, nothing is ever serviced, so we can
+        # inspect the order in which requests are popped
+        self.fetcher = BaseFetcher(poolSize=0)
+
+    def test_fifo(self):
+        # Requests of equal priority should come out in the order
+        # in which they were enqueued
+        urls = ['http://localhost:8080/%i' % i for i in range(10)]
+        self.fetcher.extend([BaseRequest(u) for u in urls])
+        self.assertEqual([self.fetcher.pop().url for u in urls], urls)
+        self.assertEqual(self.fetcher.pop(), None)
+
+    def test_priority(self):
+        # Higher priority requests should jump ahead of the queue
+        self.fetcher.push(BaseRequest('http://localhost:8080/low', priority=-1))
+        self.fetcher.push(BaseRequest('http://localhost:8080/normal'))
+        self.fetcher.push(BaseRequest('http://localhost:8080/high', priority=5))
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/high')
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/normal')
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/low')
+        self.assertEqual(len(self.fetcher), 3)
+
+    def test_aging(self):
+        # A request that has waited long enough should eventually be
+        # serviced ahead of a fresher request with higher priority
+        self.fetcher.aging = 0.01
+        self.fetcher.push(BaseRequest('http://localhost:8080/old'))
+        time.sleep(0.05)
+        self.fetcher.push(BaseRequest('http://localhost:8080/new', priority=1))
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/old')
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/new')
+
+if __name__ == '__main__':
+    unittest.main()
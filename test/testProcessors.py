@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+
+import logging
+import threading
+from downpour import logger
+from downpour.test import run, host
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher
+
+logger.setLevel(logging.CRITICAL)
+
+fetcher = BaseFetcher(stopWhenDone=True, processors=2)
+
+def offloaded(request, text, fetcher):
+	return text == 'Hello world' and threading.current_thread().name != 'MainThread'
+
+def reactorThread(request):
+	return threading.current_thread().name == 'MainThread'
+
+# Success processing should happen in the pool, but the request should
+# still be done on the reactor thread
+for i in range(10):
+	fetcher.push(ExpectRequest('Offload Test %i' % i, host + 'asis/ok.asis',
+		expectSuccess = offloaded,
+		expectDone    = reactorThread))
+
+# As should decompression
+fetcher.push(ExpectRequest('Offload Gzip Test', host + 'asis/gzip.asis',
+	expectSuccess = offloaded))
+
+# Errors are unaffected
+fetcher.push(ExpectRequest('Offload Error Test', host + 'asis/404.asis',
+	expectSuccess = False,
+	expectError   = True,
+	expectDone    = reactorThread))
+
+run(fetcher)
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+
+import time
+import unittest
+from downpour import Auth, ProxyPool, BaseFetcher, BaseRequest
+
+class TestProxyPool(unittest.TestCase):
+    def test_least_loaded(self):
+        pool = ProxyPool(['http://proxy-a:3128', 'http://proxy-b:3128'])
+        # Requests should be spread evenly across the proxies
+        a = pool.acquire()
+        b = pool.acquire()
+        self.assertNotEqual(a.url, b.url)
+        # And favor the one that has the fewest in flight
+        pool.release(a, 0.1)
+        self.assertEqual(pool.acquire().url, a.url)
+    
+    def test_weight(self):
+        pool = ProxyPool()
+        pool.add('http://big:3128', weight=3)
+        pool.add('http://small:3128')
+        urls = [pool.acquire().url for i in range(4)]
+        self.assertEqual(urls.count('http://big:3128'), 3)
+        self.assertEqual(urls.count('http://small:3128'), 1)
+    
+    def test_weighted(self):
+        pool = ProxyPool(['http://proxy-a:3128', 'http://proxy-b:3128'],
+            strategy='weighted')
+        self.assertTrue(pool.acquire().url in pool.proxies)
+        self.assertRaises(ValueError, ProxyPool, strategy='wacky')
+    
+    def test_max_flight(self):
+        pool = ProxyPool()
+        proxy = pool.add('http://proxy:3128', maxFlight=2)
+        self.assertEqual(pool.acquire(), proxy)
+        self.assertEqual(pool.acquire(), proxy)
+        # Now it's saturated, until a request finishes
+        self.assertEqual(pool.acquire(), None)
+        self.assertFalse(pool.available())
+        self.assertEqual(pool.delay(), None)
+        pool.release(proxy, 0.5)
+        self.assertEqual(pool.acquire(), proxy)
+    
+    def test_eject(self):
+        pool = ProxyPool(maxFailures=2, backoff=0.05)
+        proxy = pool.add('http://proxy:3128')
+        # A success in between should reset the count of failures
+        for failed in (True, False, True):
+            pool.release(pool.acquire(), 1, failed)
+        self.assertTrue(pool.available())
+        # But consecutive failures should eject the proxy for a while
+        pool.release(pool.acquire(), 1, True)
+        self.assertFalse(pool.available())
+        self.assertEqual(pool.acquire(), None)
+        self.assertTrue(0 < pool.delay() <= 0.05)
+        self.assertTrue(proxy.stats()['ejected'])
+        time.sleep(0.06)
+        self.assertEqual(pool.acquire(), proxy)
+        # And if it fails again, it should be ejected for longer
+        pool.release(proxy, 1, True)
+        pool.release(pool.acquire(), 1, True)
+        self.assertTrue(0.05 < pool.delay() <= 0.1)
+    
+    def test_stats(self):
+        pool = ProxyPool(['http://proxy:3128'])
+        pool.release(pool.acquire(), 1.0)
+        pool.release(pool.acquire(), 3.0, True)
+        stats = pool.stats()['http://proxy:3128']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['latency'], 2.0)
+        self.assertEqual(stats['slowest'], 3.0)
+        self.assertEqual(stats['inFlight'], 0)
+    
+    def test_auth(self):
+        # Credentials should be available through Auth for the proxy
+        pool = ProxyPool()
+        pool.add('http://flipper.seomoz.org:3128', username='Aladdin', password='open sesame')
+        self.assertEqual(Auth.basicAuth({}, 'flipper.seomoz.org:3128', None, {}), 'Basic QWxhZGRpbjpvcGVuIHNlc2FtZQ==')
+        pool.remove('http://flipper.seomoz.org:3128')
+        self.assertEqual(Auth.basicAuth({}, 'flipper.seomoz.org:3128', None, {}), None)
+
+    def test_own_proxy(self):
+        # Requests that bring their own proxy don't wait on a busy pool
+        class Fetcher(BaseFetcher):
+            def _serve(self, r):
+                if not r.proxy:
+                    self.proxies.acquire()
+                self.served.append(r.url)
+        fetcher = Fetcher(poolSize=10)
+        fetcher.served  = []
+        fetcher.proxies = ProxyPool()
+        proxy = fetcher.proxies.add('http://proxy:3128', maxFlight=1)
+        fetcher.proxies.acquire()
+        fetcher.extend([BaseRequest('http://a.com/'),
+            BaseRequest('http://b.com/', proxy='http://mine:3128')])
+        self.assertEqual(fetcher.served, ['http://b.com/'])
+        self.assertEqual([r.url for r in fetcher.held], ['http://a.com/'])
+        # And those that were held go first once there's a proxy for them
+        fetcher.proxies.release(proxy, 0.1)
+        fetcher.push(BaseRequest('http://c.com/'))
+        self.assertEqual(fetcher.served, ['http://b.com/', 'http://a.com/'])
+        self.assertEqual([r.url for r in fetcher.held], ['http://c.com/'])
+
+if __name__ == '__main__':
+    unittest.main()
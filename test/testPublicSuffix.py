@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+from downpour import PublicSuffix
+
+class TestPublicSuffix(unittest.TestCase):
+    rules = '''
+// A comment, and then a blank line
+
+com
+uk
+co.uk
+jp
+*.kawasaki.jp
+!city.kawasaki.jp
+*.ck
+!www.ck
+blogspot.com
+公司.cn
+'''.split('\n')
+
+    def setUp(self):
+        self.psl = PublicSuffix(self.rules)
+
+    def test_plain(self):
+        self.assertEqual(self.psl.registered('example.com'), 'example.com')
+        self.assertEqual(self.psl.registered('a.b.example.com'), 'example.com')
+        self.assertEqual(self.psl.registered('www.example.co.uk'), 'example.co.uk')
+        self.assertEqual(self.psl.registered('WWW.Example.COM.'), 'example.com')
+
+    def test_unlisted(self):
+        # Unlisted top-level domains are public suffixes all the same
+        self.assertEqual(self.psl.registered('foo.example.test'), 'example.test')
+        self.assertEqual(self.psl.registered('localhost'), 'localhost')
+
+    def test_suffixes(self):
+        # Public suffixes are their own registered domain
+        self.assertEqual(self.psl.registered('co.uk'), 'co.uk')
+        self.assertEqual(self.psl.registered('blogspot.com'), 'blogspot.com')
+        self.assertEqual(self.psl.registered('me.blogspot.com'), 'me.blogspot.com')
+
+    def test_wildcards(self):
+        self.assertEqual(self.psl.registered('a.b.foo.ck'), 'b.foo.ck')
+        self.assertEqual(self.psl.registered('a.b.c.kawasaki.jp'), 'b.c.kawasaki.jp')
+
+    def test_exceptions(self):
+        self.assertEqual(self.psl.registered('www.ck'), 'www.ck')
+        self.assertEqual(self.psl.registered('a.www.ck'), 'www.ck')
+        self.assertEqual(self.psl.registered('a.city.kawasaki.jp'), 'city.kawasaki.jp')
+
+    def test_international(self):
+        # Rules are kept in the form that hostnames take in urls
+        host = u'www.例子.公司.cn'.encode('idna')
+        self.assertEqual(self.psl.registered(host), host.split('.', 1)[1])
+
+    def test_addresses(self):
+        self.assertEqual(self.psl.registered('10.0.0.1'), '10.0.0.1')
+        self.assertEqual(self.psl.registered('::1'), '::1')
+
+    @unittest.skipUnless(any(os.path.exists(p) for p in PublicSuffix.paths), 'No public suffix list')
+    def test_load(self):
+        psl = PublicSuffix.load()
+        # Only compiled once
+        self.assertTrue(psl is PublicSuffix.load())
+        self.assertEqual(psl.registered('news.bbc.co.uk'), 'bbc.co.uk')
+        self.assertEqual(psl.registered('foo.blogspot.com'), 'foo.blogspot.com')
+
+if __name__ == '__main__':
+    unittest.main()
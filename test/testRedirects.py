@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+
+import logging
+from downpour import logger
+from downpour.test import run, host
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher, BaseRequestServicer, AgentServicer, Redirects
+
+logger.setLevel(logging.CRITICAL)
+
+class ThenRequest(ExpectRequest):
+	'''Once it's done, pushes another request'''
+	def __init__(self, *args, **kwargs):
+		self.then = kwargs.pop('then')
+		ExpectRequest.__init__(self, *args, **kwargs)
+
+	def onDone(self, results, fetcher):
+		ExpectRequest.onDone(self, results, fetcher)
+		fetcher.push(self.then)
+
+class MixedFetcher(BaseFetcher):
+	'''Services each request with the servicer it names'''
+	def servicer(self, request, *args):
+		return request.servicer(request, *args)
+
+fetcher = MixedFetcher(stopWhenDone=True)
+fetcher.redirects = Redirects(size=100)
+for name, servicer in (('Factory', BaseRequestServicer), ('Agent', AgentServicer)):
+	url = host + 'asis/301_to_ok.asis?' + name
+	# The second time around, the request goes straight to where it was
+	# redirected to, without ever seeing the 301, but still hears of both urls
+	second = ExpectRequest('%s Cached Redirect Test' % name, url,
+		expectURL     = [url, host + 'asis/ok.asis'],
+		expectStatus  = ('HTTP/1.1', '200', 'OK'),
+		expectSuccess = 'Hello world')
+	first = ThenRequest('%s Redirect Test' % name, url,
+		expectURL     = [url, host + 'asis/ok.asis'],
+		expectSuccess = 'Hello world',
+		then          = second)
+	first.servicer = second.servicer = servicer
+	fetcher.push(first)
+
+def checkCounts():
+	print 'Redirects: %s' % fetcher.redirects.stats()
+	assert fetcher.redirects.hits == 2
+	assert fetcher.redirects.learned == 2
+	# Redirects that keep the path are learned for the whole host
+	redirects = Redirects(size=2)
+	redirects.record('http://example.com/a?b', 'https://www.example.com/a?b', '301')
+	assert redirects.find('http://example.com/c') == 'https://www.example.com/c'
+	# But temporary redirects aren't learned at all, and loops aren't followed
+	redirects.record('http://example.org/', 'http://example.org/elsewhere', '302')
+	assert redirects.find('http://example.org/') is None
+	redirects.record('http://example.net/a', 'http://example.net/b', '301')
+	redirects.record('http://example.net/b', 'http://example.net/a', '301')
+	assert redirects.find('http://example.net/a') == 'http://example.net/b'
+	# And the cache is bounded
+	assert len(redirects) == 2
+
+run(fetcher, checkCounts)
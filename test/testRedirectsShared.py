@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+'''Tests of a Redirects cache shared through redis. These need a redis
+running locally (or fakeredis), and they flush its database 15 before each test.'''
+
+import time
+import redis
+import unittest
+from downpour import Redirects
+from downpour.test import fakeRedis
+
+db = 15
+
+class Shared(Redirects):
+	# Redis is asked right away, so there's no need for the reactor
+	offload = False
+
+class TestShared(unittest.TestCase):
+	def setUp(self):
+		self.r = redis.Redis(db=db)
+		self.r.flushdb()
+
+	def test_shared(self):
+		# What one worker learns, another finds
+		Shared(redis=self.r).record('http://example.com/a', 'https://www.example.com/a', '301')
+		self.assertEqual(self.r.hget('redirects', 'http://example.com'), 'https://www.example.com')
+		other = Shared(redis=self.r)
+		self.assertEqual(other.find('http://example.com/b'), 'https://www.example.com/b')
+		self.assertTrue(other.asked)
+		# And after that, without asking again
+		asked = other.asked
+		self.assertEqual(other.find('http://example.com/b'), 'https://www.example.com/b')
+		self.assertEqual(other.asked, asked)
+
+	def test_misses(self):
+		redirects = Shared(size=2, redis=self.r)
+		redirects.missSize = 2
+		redirects.record('http://example.com/a', 'http://example.com/b', '301')
+		redirects.record('http://example.com/c', 'http://example.com/d', '301')
+		# Misses are remembered apart from the redirects, and never evict them
+		for i in range(10):
+			self.assertEqual(redirects.lookup('http://example.org/%i' % i), None)
+		self.assertEqual(len(redirects.missed), 2)
+		self.assertEqual(len(redirects), 2)
+		self.assertEqual(redirects.lookup('http://example.com/a'), 'http://example.com/b')
+		self.assertEqual(redirects.lookup('http://example.com/c'), 'http://example.com/d')
+		# A recent miss isn't asked about again
+		asked = redirects.asked
+		self.assertEqual(redirects.lookup('http://example.org/9'), None)
+		self.assertEqual(redirects.asked, asked)
+		# Until it's too old to trust
+		redirects.missed['http://example.org/9'] = time.time() - redirects.missTime
+		self.r.hset('redirects', 'http://example.org/9', 'http://example.org/')
+		self.assertEqual(redirects.lookup('http://example.org/9'), 'http://example.org/')
+		self.assertEqual(redirects.asked, asked + 1)
+
+if __name__ == '__main__':
+	if not fakeRedis.available(db=db):
+		print 'SKIPPED: these tests need a redis on localhost:6379, or fakeredis'
+		exit(0)
+	unittest.main()
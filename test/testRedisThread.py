@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+
+import time
+import logging
+import threading
+from downpour import logger, reactor
+from downpour import RedisThread
+
+logger.setLevel(logging.CRITICAL)
+
+io = RedisThread()
+calls   = []
+results = []
+errors  = []
+threads = set()
+
+def slow(i):
+    # Stands in for a blocking call to redis
+    calls.append((i, threading.current_thread().name))
+    time.sleep(0.01)
+    return i
+
+def broken():
+    raise ValueError('Broken')
+
+def got(result):
+    threads.add(threading.current_thread().name)
+    results.append(result)
+
+def submit():
+    for i in range(50):
+        io.submit(slow, i).addCallback(got)
+    io.submit(broken).addErrback(lambda f: errors.append(f.check(ValueError)))
+    # The reactor doesn't wait on any of it
+    started = time.time()
+    io.submit(slow, 50).addCallback(got).addCallback(lambda _: reactor.stop())
+    ticks.append(time.time() - started)
+
+ticks = []
+reactor.callWhenRunning(submit)
+timeout = reactor.callLater(30, reactor.stop)
+reactor.run()
+io.stop()
+
+passed = True
+def check(description, condition):
+    global passed
+    print '%s: %s' % (description, 'ok' if condition else 'FAILED')
+    passed = passed and condition
+
+check('Results in order', results == range(51))
+check('Calls made on the redis thread', set(t for i, t in calls) == set(['downpour-redis']))
+check('Results delivered on the reactor', threads == set(['MainThread']))
+check('Failures delivered', errors == [ValueError])
+check('Submitting never blocks', ticks and ticks[0] < 0.01)
+check('Calls were batched', io.batches < io.calls)
+# Once stopped, calls are just made directly
+check('Calls after stopping', io.submit(slow, 51).result == 51)
+
+if passed:
+    print 'PASSED'
+    exit(0)
+else:
+    print 'FAILED'
+    exit(1)
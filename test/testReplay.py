@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+
+import time
+import shutil
+import logging
+import tempfile
+from downpour import logger
+from downpour.test import run
+from downpour.test import ExpectRequest
+from downpour import Archive, ReplayFetcher, BaseRequest
+from twisted.web import error
+from twisted.python.failure import Failure
+
+logger.setLevel(logging.CRITICAL)
+
+class Factory(object):
+	'''Just enough of a BaseRequestServicer to be recorded'''
+	def __init__(self, url, final, status, message, headers):
+		self.request = BaseRequest(url)
+		self.request.time = -time.time()
+		self.url = final
+		if status:
+			self.version, self.status, self.message = 'HTTP/1.1', status, message
+			self.response_headers = headers
+
+# First, record a few responses
+path = tempfile.mkdtemp()
+archive = Archive(path)
+archive.record(Factory('http://example.com/a', 'http://example.com/b', '200', 'OK',
+	{'content-type': ['text/html']}), 'Hello world')
+archive.record(Factory('http://example.com/missing', 'http://example.com/missing', '404', 'Not Found',
+	{'content-type': ['text/html']}), Failure(error.Error('404', 'Not Found', 'Nope')))
+archive.record(Factory('http://example.com/refused', 'http://example.com/refused', None, None, None),
+	Failure(ValueError('Connection refused')))
+archive.close()
+
+# And then replay them through the usual callbacks
+fetcher = ReplayFetcher(path, stopWhenDone=True, latency=0.01, speedup=10)
+
+fetcher.push(ExpectRequest('Replay Success Test', 'http://example.com/a',
+	expectURL     = ['http://example.com/a', 'http://example.com/b'],
+	expectStatus  = ('HTTP/1.1', '200', 'OK'),
+	expectHeaders = {'content-type': ['text/html']},
+	expectSuccess = 'Hello world',
+	expectError   = False))
+
+fetcher.push(ExpectRequest('Replay Status Test', 'http://example.com/missing',
+	expectStatus  = ('HTTP/1.1', '404', 'Not Found'),
+	expectSuccess = False,
+	expectError   = lambda request, failure, fetcher: failure.value.response == 'Nope'))
+
+fetcher.push(ExpectRequest('Replay Failure Test', 'http://example.com/refused',
+	expectStatus  = False,
+	expectSuccess = False,
+	expectError   = lambda request, failure, fetcher: 'Connection refused' in str(failure.value)))
+
+fetcher.push(ExpectRequest('Replay Unrecorded Test', 'http://example.com/unrecorded',
+	expectStatus  = False,
+	expectSuccess = False,
+	expectError   = True))
+
+# The bodies are only read as they're replayed
+run(fetcher, shutil.rmtree, path)
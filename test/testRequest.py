@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+
+import unittest
+import cPickle as pickle
+from downpour import BaseRequest, RobotsRequest
+
+class CustomRequest(BaseRequest):
+    # Subclasses can still override the defaults with class attributes
+    timeout  = 10
+    priority = 3
+
+    def __init__(self, url, name):
+        BaseRequest.__init__(self, url)
+        self.name = name
+
+class CompactRequest(BaseRequest):
+    __slots__ = ('name',)
+
+class TestRequest(unittest.TestCase):
+    def test_defaults(self):
+        r = BaseRequest('http://localhost:8080/#fragment', proxy='http://proxy:3128')
+        self.assertEqual(r.url, 'http://localhost:8080/')
+        self.assertEqual(r.proxy, 'http://proxy:3128')
+        self.assertEqual(r.timeout, 45)
+        self.assertEqual(r.priority, 0)
+        self.assertEqual(r.encoding, 'identity')
+        self.assertRaises(AttributeError, getattr, r, 'nonexistent')
+        # Without any place to put other attributes
+        self.assertFalse(hasattr(r, '__dict__'))
+        self.assertRaises(AttributeError, setattr, r, 'name', 'foo')
+
+    def test_subclass(self):
+        r = CustomRequest('http://localhost:8080/', 'foo')
+        self.assertEqual((r.timeout, r.priority, r.name), (10, 3, 'foo'))
+        r.priority = 4
+        self.assertEqual(r.priority, 4)
+        # Subclasses can stay compact with slots of their own
+        c = CompactRequest('http://localhost:8080/')
+        c.name = 'foo'
+        self.assertFalse(hasattr(c, '__dict__'))
+
+    def test_pickle(self):
+        for protocol in (0, 2):
+            r = BaseRequest('http://localhost:8080/', data='hello', priority=2)
+            r._originalKey = 'domain:localhost'
+            s = pickle.loads(pickle.dumps(r, protocol))
+            self.assertEqual((s.url, s.data, s.priority, s._originalKey),
+                ('http://localhost:8080/', 'hello', 2, 'domain:localhost'))
+            self.assertEqual(s.proxy, None)
+            r = CustomRequest('http://localhost:8080/', 'foo')
+            s = pickle.loads(pickle.dumps(r, protocol))
+            self.assertEqual((s.name, s.timeout), ('foo', 10))
+            r = RobotsRequest('http://localhost:8080/robots.txt')
+            s = pickle.loads(pickle.dumps(r, protocol))
+            self.assertEqual((s.status, s.ttl), (r.status, r.ttl))
+
+if __name__ == '__main__':
+    unittest.main()
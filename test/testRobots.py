@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+
+import time
+import reppy
+import unittest
+from downpour import Matcher, Matchers
+
+class TestRobots(unittest.TestCase):
+    text = '''
+User-agent: *
+Disallow: /private
+Allow: /private/ok
+Disallow: /*.pdf$
+
+User-agent: special
+Disallow: /
+'''
+
+    def robot(self, text=None):
+        return reppy.parse(text or self.text, url='http://example.com/robots.txt')
+
+    def test_rules(self):
+        matcher = Matcher(self.robot(), 'downpour')
+        self.assertTrue(matcher('http://example.com/'))
+        self.assertTrue(matcher('http://example.com/public'))
+        self.assertFalse(matcher('http://example.com/private'))
+        self.assertFalse(matcher('http://example.com/private/secret'))
+        # The longer allow takes precedence over the shorter disallow
+        self.assertTrue(matcher('http://example.com/private/ok'))
+        self.assertFalse(matcher('http://example.com/a/b.pdf'))
+        self.assertTrue(matcher('http://example.com/a/b.pdf?page=2'))
+
+    def test_agent(self):
+        matcher = Matcher(self.robot(), 'special')
+        self.assertFalse(matcher('http://example.com/public'))
+        # robots.txt itself is always allowed
+        self.assertTrue(matcher('http://example.com/robots.txt'))
+
+    def test_agrees(self):
+        # The compiled rules decide just as reppy does
+        robot = self.robot()
+        matcher = Matcher(robot, 'downpour')
+        for path in ('/', '/private', '/private/', '/private/ok/x', '/x.pdf', '/%70rivate'):
+            url = 'http://example.com' + path
+            self.assertEqual(matcher(url), robot.allowed(url, 'downpour'), path)
+
+    def test_expired(self):
+        self.assertFalse(Matcher(self.robot(), 'downpour', time.time() + 60).expired())
+        self.assertTrue(Matcher(self.robot(), 'downpour', time.time() - 1).expired())
+
+    def test_lru(self):
+        # Sites we don't have robots.txt for have no matcher
+        matchers = Matchers('downpour', size=2)
+        matchers.compile = lambda netloc, now: None
+        self.assertEqual(matchers.allowed('http://unknown.com/private'), None)
+        self.assertEqual(len(matchers), 0)
+        # Once the cache is full, the least recently used is forgotten
+        until = time.time() + 60
+        matchers.compile = lambda netloc, now: Matcher(self.robot(), 'downpour', until)
+        matchers.get('a.com')
+        matchers.get('b.com')
+        matchers.get('a.com')
+        matchers.get('c.com')
+        self.assertEqual(list(matchers.matchers), ['a.com', 'c.com'])
+        self.assertFalse(matchers.allowed('http://a.com/private'))
+
+if __name__ == '__main__':
+    unittest.main()
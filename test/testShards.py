@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+import redis
+import logging
+import unittest
+from downpour import logger, Shards, PoliteFetcher, BaseRequest
+from downpour.test import fakeRedis
+
+logger.setLevel(logging.CRITICAL)
+
+# The sharded fetcher tests need two redis servers (or fakeredis), and they
+# flush their database 15 before each test
+ports = (6379, 6380)
+db    = 15
+
+def keys(count):
+    return ['domain:www.example%i.com' % i for i in range(count)]
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        # Nothing here connects to redis until it's used
+        self.shards = Shards([{'port': 6379}, {'port': 6380}, {'port': 6381}])
+
+    def test_single(self):
+        shards = Shards([{}])
+        self.assertEqual(shards[0].name, 'localhost:6379/0')
+        self.assertTrue(all(shards.find(k) is shards[0] for k in keys(100)))
+
+    def test_stable(self):
+        owners = [self.shards.find(k) for k in keys(1000)]
+        self.assertEqual(owners, [self.shards.find(k) for k in keys(1000)])
+
+    def test_balanced(self):
+        counts = dict((shard.name, 0) for shard in self.shards)
+        for key in keys(30000):
+            counts[self.shards.find(key).name] += 1
+        for count in counts.values():
+            self.assertTrue(7000 < count < 13000, counts)
+
+    def test_order(self):
+        # It's the names that decide, and not the order they're given in
+        shards = Shards([{'port': 6381}, {'port': 6379}, {'port': 6380}])
+        for key in keys(1000):
+            self.assertEqual(self.shards.find(key).name, shards.find(key).name)
+
+    def test_add(self):
+        before = dict((k, self.shards.find(k).name) for k in keys(10000))
+        shard = self.shards.add(name='fourth', port=6382)
+        moved = [k for k in before if self.shards.find(k).name != before[k]]
+        # Only about a quarter of the keys move, and only to the new shard
+        self.assertTrue(1500 < len(moved) < 3500, len(moved))
+        self.assertTrue(all(self.shards.find(k) is shard for k in moved))
+
+    def test_duplicate(self):
+        self.assertRaises(ValueError, self.shards.add, port=6379)
+
+class Fetcher(PoliteFetcher):
+    offload = False
+    notify  = False
+
+class TestShardedFetcher(unittest.TestCase):
+    def setUp(self):
+        if not fakeRedis.available(ports, db):
+            raise unittest.SkipTest('these tests need redis on ports %s, or fakeredis' % (ports,))
+        for port in ports:
+            redis.Redis(port=port, db=db).flushdb()
+        self.configs = [{'port': port, 'db': db} for port in ports]
+        self.fetchers = []
+
+    def tearDown(self):
+        for fetcher in self.fetchers:
+            fetcher.heartbeat.stop()
+
+    def fetcher(self, configs):
+        fetcher = Fetcher(poolSize=0, allowAll=True, worker='test', shards=configs)
+        self.fetchers.append(fetcher)
+        return fetcher
+
+    def requests(self, count):
+        return [BaseRequest('http://www.example%i.com/' % i) for i in range(count)]
+
+    def test_spread(self):
+        fetcher = self.fetcher(self.configs)
+        self.assertEqual(fetcher.extend(self.requests(50)), 50)
+        # Each domain's queue and its place in the schedule are on its shard
+        for key in keys(50):
+            owner = fetcher.shard(key)
+            for shard in fetcher.shards:
+                self.assertEqual(shard.r.zcard(key), int(shard is owner))
+                self.assertEqual(shard.r.zscore('plds', fetcher.pack(key)) is not None, shard is owner)
+        self.assertTrue(all(shard.r.zcard('plds') for shard in fetcher.shards))
+        self.assertEqual(len(fetcher), 50)
+        self.assertFalse(fetcher.idle())
+        # Every request comes out, with its flight and lease on its shard
+        popped = [fetcher.pop() for i in range(50)]
+        self.assertEqual(sorted(r.url for r in popped), sorted(r.url for r in self.requests(50)))
+        for request in popped:
+            shard = fetcher.shard(request._originalKey)
+            self.assertTrue(shard.r.hexists('lease:test', request.url))
+            self.assertEqual(fetcher.inFlight(request._originalKey), 1)
+        self.assertEqual(fetcher.pop(), None)
+        # And a dead worker's leases are found on every shard
+        self.assertEqual(fetcher.reclaim('test'), 50)
+        self.assertEqual(sum(shard.r.zcard(key) for key in keys(50) for shard in fetcher.shards), 50)
+
+    def test_rebalance(self):
+        fetcher = self.fetcher(self.configs[:1])
+        fetcher.extend(self.requests(100))
+        shard = fetcher.addShard(**self.configs[1])
+        moved = [key for key in keys(100) if fetcher.shard(key) is shard]
+        self.assertTrue(moved)
+        for key in keys(100):
+            self.assertEqual(shard.r.zcard(key), int(key in moved))
+            self.assertEqual(fetcher.shards[0].r.zcard(key), int(key not in moved))
+        self.assertEqual(int(shard.r.hget('depths', '')), len(moved))
+        self.assertEqual(int(fetcher.shards[0].r.hget('depths', '')), 100 - len(moved))
+        self.assertEqual(len(fetcher), 100)
+        # Another worker given both shards finds everything
+        other = self.fetcher(self.configs)
+        popped = [other.pop() for i in range(100)]
+        self.assertEqual(sorted(r.url for r in popped), sorted(r.url for r in self.requests(100)))
+        self.assertEqual(other.pop(), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+
+import unittest
+from downpour import BaseFetcher, BaseRequest
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        # With a pool size of 0, nothing is ever serviced, so we can
+        # pop requests ourselves and see how far ahead we've read
+        self.fetcher = BaseFetcher(poolSize=0, readAhead=5)
+        self.read = 0
+
+    def source(self, count):
+        for i in range(count):
+            self.read += 1
+            yield BaseRequest('http://localhost:8080/%i' % i)
+
+    def test_lazy(self):
+        # Nothing should be read until it's needed
+        self.assertEqual(self.fetcher.extend(self.source(20)), None)
+        self.assertEqual(self.read, 0)
+        self.assertTrue(self.fetcher.streaming())
+        # And then, only as much as the read-ahead allows
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/0')
+        self.assertEqual(self.read, 5)
+        self.assertEqual(len(self.fetcher), 5)
+        self.assertEqual(self.fetcher.pop().url, 'http://localhost:8080/1')
+        self.assertEqual(self.read, 6)
+
+    def test_exhausted(self):
+        self.fetcher.extend(self.source(7))
+        urls = [self.fetcher.pop().url for i in range(7)]
+        self.assertEqual(urls, ['http://localhost:8080/%i' % i for i in range(7)])
+        self.assertEqual(self.fetcher.pop(), None)
+        self.assertFalse(self.fetcher.streaming())
+        self.assertEqual(len(self.fetcher), 7)
+
+    def test_list(self):
+        # Lists should still be consumed eagerly
+        self.assertEqual(self.fetcher.extend(list(self.source(7))), 7)
+        self.assertFalse(self.fetcher.streaming())
+        self.assertEqual(len(self.fetcher), 7)
+
+if __name__ == '__main__':
+    unittest.main()
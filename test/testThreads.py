@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+
+import logging
+import threading
+from downpour import logger, reactor
+from downpour.test import host
+from downpour import BaseFetcher, BaseRequest
+
+logger.setLevel(logging.CRITICAL)
+
+producers = 4
+perProducer = 50
+
+class CountingFetcher(BaseFetcher):
+	'''Stops once every request from every producer is done'''
+	def __init__(self, *args, **kwargs):
+		BaseFetcher.__init__(self, *args, **kwargs)
+		self.done    = 0
+		self.threads = set()
+
+	def extend(self, requests):
+		# Requests from other threads should only ever get here by way of
+		# the reactor thread
+		self.threads.add(threading.current_thread().name)
+		return BaseFetcher.extend(self, requests)
+
+	def onDone(self, request):
+		self.done += 1
+		if self.done == producers * perProducer:
+			reactor.stop()
+
+fetcher = CountingFetcher(poolSize=10)
+
+def produce(n):
+	for i in range(perProducer):
+		if i % 10:
+			fetcher.pushFromThread(BaseRequest(host + 'asis/ok.asis?%i-%i' % (n, i)))
+		else:
+			fetcher.extendFromThread([BaseRequest(host + 'asis/ok.asis?%i-%i-batch' % (n, i))])
+
+def startProducers():
+	for n in range(producers):
+		threading.Thread(target=produce, args=(n,)).start()
+
+reactor.callWhenRunning(startProducers)
+# Just in case some requests never make it
+timeout = reactor.callLater(60, reactor.stop)
+fetcher.start()
+
+print 'Done: %i of %i' % (fetcher.done, producers * perProducer)
+print 'Ingested on: %s' % ', '.join(sorted(fetcher.threads))
+if fetcher.done == producers * perProducer and fetcher.threads == set(['MainThread']):
+	print 'PASSED'
+	exit(0)
+else:
+	print 'FAILED'
+	exit(1)
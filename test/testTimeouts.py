@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+import logging
+from downpour import logger, reactor
+from downpour.test import run, host
+from downpour.test import ExpectRequest
+from downpour import BaseFetcher, BaseRequestServicer, AgentServicer, PhaseTimeout
+from twisted.internet import protocol, task
+
+logger.setLevel(logging.CRITICAL)
+
+class Slow(protocol.Protocol):
+	'''A server that misbehaves depending on the path requested: `silent`
+	never responds, `stall` sends a little and then stops, and `drip` sends
+	a byte every tenth of a second.'''
+	def dataReceived(self, data):
+		if not data.startswith('GET '):
+			return
+		path = data.split(' ')[1]
+		self.timer = None
+		if path == '/silent':
+			return
+		self.transport.write('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 1000\r\n\r\n')
+		if path == '/stall':
+			self.transport.write('Hello')
+		elif path == '/drip':
+			self.timer = task.LoopingCall(self.transport.write, '.')
+			self.timer.start(0.1)
+
+	def connectionLost(self, reason):
+		if getattr(self, 'timer', None) and self.timer.running:
+			self.timer.stop()
+
+factory = protocol.ServerFactory()
+factory.protocol = Slow
+reactor.listenTCP(8081, factory)
+slow = 'http://localhost:8081/'
+
+class QuickRequest(ExpectRequest):
+	'''Gives up quickly'''
+	def __init__(self, *args, **kwargs):
+		ExpectRequest.__init__(self, *args, **kwargs)
+		self.timeout          = 5
+		self.firstByteTimeout = 0.5
+		self.idleTimeout      = 0.5
+		self.minRate          = 100
+		self.minRateWindow    = 1
+
+def timedOut(phase):
+	def expect(request, failure, fetcher):
+		return isinstance(failure.value, PhaseTimeout) and failure.value.phase == phase
+	return expect
+
+class MixedFetcher(BaseFetcher):
+	'''Services each request with the servicer it names'''
+	def servicer(self, request, *args):
+		return request.servicer(request, *args)
+
+# Each phase should be enforced by either servicer
+fetcher = MixedFetcher(stopWhenDone=True)
+for name, servicer in (('Factory', BaseRequestServicer), ('Agent', AgentServicer)):
+	def servicing(request, servicer=servicer):
+		request.servicer = servicer
+		return request
+	fetcher.push(servicing(QuickRequest('%s First Byte Test' % name, slow + 'silent',
+		expectSuccess = False,
+		expectError   = timedOut('first-byte'))))
+	fetcher.push(servicing(QuickRequest('%s Idle Test' % name, slow + 'stall',
+		expectSuccess = False,
+		expectError   = timedOut('idle'))))
+	fetcher.push(servicing(QuickRequest('%s Rate Test' % name, slow + 'drip',
+		expectSuccess = False,
+		expectError   = timedOut('rate'))))
+	# And well-behaved servers are unaffected
+	fetcher.push(servicing(QuickRequest('%s Quick Test' % name, host + 'asis/ok.asis',
+		expectSuccess = 'Hello world')))
+
+def checkCounts():
+	print 'Timeouts: %s' % dict(fetcher.timeouts)
+	assert fetcher.timeouts == {'first-byte': 2, 'idle': 2, 'rate': 2}
+
+run(fetcher, checkCounts)